@@ -0,0 +1,551 @@
+"""
+Local stand-in for the OpenAI, Anthropic and search APIs used by STORM and Co-STORM, for load testing without accounts.
+
+Endpoints:
+    POST /v1/chat/completions, POST /v1/completions: OpenAI-compatible completions. Completions are synthesized from
+        the output field requested by the DSPy prompt (queries, outlines, personas, sections, ...) so that the real
+        pipeline can parse them. Like vLLM, /v1/completions also takes a list of prompts.
+    POST /v1/messages: Anthropic Messages API with a simulated prompt cache. Prefixes ending at a content block with
+        `cache_control` are cached, and the usage reports `cache_creation_input_tokens` and `cache_read_input_tokens`
+        like the real API (use with `ClaudeModel(api_base=...)`).
+    POST /v1/embeddings: OpenAI-compatible embeddings (hashed bags of words).
+    POST /search: Serper-shaped search results (use with `SerperRM(base_url=...)`).
+    GET /search?q=...&format=json: SearXNG-shaped search results (use with `SearXNG(searxng_api_url=.../search)`).
+    GET /stats: request, error and rate limit counts per endpoint.
+
+Latency distributions are given as `fixed:MS`, `uniform:MIN_MS,MAX_MS` or `lognormal:MEDIAN_MS,SIGMA`. Completions
+additionally take `completion_tokens / tokens_per_second` seconds. A fraction of requests can fail with HTTP 500
+(`error_rate`) or be rejected with HTTP 429 and a Retry-After header (`rate_limit_rate`).
+
+Usage:
+    python benchmarks/fake_server.py --port 8000 --lm-latency lognormal:800,0.5 --rate-limit-rate 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+WORDS = [f"word{i}" for i in range(2000)]
+
+
+class LatencyDistribution:
+    """Latency in milliseconds drawn from a `fixed`, `uniform` or `lognormal` distribution."""
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value]
+        if kind == "fixed" and len(values) == 1:
+            self._sample = lambda rng: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda rng: rng.uniform(values[0], values[1])
+        elif kind == "lognormal" and len(values) == 2:
+            self._sample = lambda rng: values[0] * math.exp(rng.gauss(0, values[1]))
+        else:
+            raise ValueError(f"Invalid latency distribution {spec}.")
+        self.spec = spec
+
+    def sample_seconds(self, rng: random.Random) -> float:
+        return max(0.0, self._sample(rng)) / 1000
+
+
+@dataclass
+class FakeServerConfig:
+    lm_latency: str = "fixed:0"
+    embedding_latency: str = "fixed:0"
+    search_latency: str = "fixed:0"
+    tokens_per_second: float = 0.0  # 0 disables the completion token delay
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_seconds: int = 1
+    embedding_dim: int = 256
+    num_search_results: int = 5
+    url_pool_size: int = 200
+    seed: int = 0
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _rng_for(text: str) -> random.Random:
+    return random.Random(hashlib.md5(text.encode("utf-8")).hexdigest())
+
+
+def _prose(rng: random.Random, num_sentences: int, with_citations: bool = True) -> str:
+    sentences = []
+    for _ in range(num_sentences):
+        sentence = " ".join(rng.choices(WORDS, k=rng.randint(10, 20))).capitalize()
+        citation = f" [{rng.randint(1, 3)}]" if with_citations else ""
+        sentences.append(f"{sentence}.{citation}")
+    return " ".join(sentences)
+
+
+def _get_output_field_name(prompt: str) -> Tuple[str, bool]:
+    """
+    Returns the name of the field the DSPy prompt asks to complete next, and whether the prompt asks for chain of
+    thought reasoning before that field.
+    """
+    last_line = prompt.rstrip().split("\n")[-1].strip()
+    if not last_line.startswith("Reasoning: Let's think step by step"):
+        return last_line, False
+    # the output field follows the reasoning field in the format guidelines
+    guidelines = prompt.split("Follow the following format.", 1)[-1].split("\n---")[0]
+    after_reasoning = guidelines.split("Reasoning: Let's think step by step", 1)[-1]
+    next_fields = after_reasoning.split("\n", 1)[-1].strip()
+    return next_fields.split("${", 1)[0].strip(), True
+
+
+def synthesize_completion(prompt: str) -> str:
+    """Synthesizes a completion in the format that the pipeline expects for the requested output field."""
+    rng = _rng_for(prompt)
+    field_name, is_chain_of_thought = _get_output_field_name(prompt)
+    name = field_name.lower()
+    if "quer" in name:
+        content = "\n".join(
+            "- " + " ".join(rng.choices(WORDS, k=4)) for _ in range(rng.randint(2, 3))
+        )
+    elif "outline" in name:
+        content = "\n".join(
+            f"# Section {idx}\n## Subsection {idx}.1\n## Subsection {idx}.2"
+            for idx in rng.sample(range(20), 3)
+        )
+    elif "persona" in name or "expert" in name:
+        content = "\n".join(
+            f"{idx + 1}. Expert {rng.randint(0, 99)}: {_prose(rng, 1, False)}"
+            for idx in range(3)
+        )
+    elif "related topics" in name:
+        content = "\n".join(
+            f"- https://en.wikipedia.org/wiki/Topic_{rng.randint(0, 99)}"
+            for _ in range(3)
+        )
+    elif name.startswith("choice"):
+        content = "insert"
+    elif name.startswith("decision"):
+        content = "Best placement: [1]"
+    elif "expanded subsection names" in name:
+        content = "None"
+    elif "give your note" in name:
+        content = f"Potential Answer: {_prose(rng, 1, with_citations=False)}"
+    elif "question" in name or "discussion focus" in name:
+        content = _prose(rng, 1, with_citations=False).rstrip(".") + "?"
+    elif "section" in name:
+        match = re.search(r"The section you need to write: (.*)", prompt)
+        header = f"# {match.group(1).strip()}\n" if match else ""
+        content = header + _prose(rng, rng.randint(3, 6))
+    else:
+        content = _prose(rng, rng.randint(2, 5))
+    if is_chain_of_thought:
+        reasoning = f"produce the {name.rstrip(':')}. We follow the instructions."
+        return f"{reasoning}\n\n{field_name} {content}"
+    return content
+
+
+def _get_content_blocks(content) -> List[Dict]:
+    """Normalizes the `system` or message content of an Anthropic request to a list of content blocks."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return [block for block in content or [] if block.get("type") == "text"]
+
+
+def hashed_embedding(text: str, dim: int) -> List[float]:
+    embedding = [0.0] * dim
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        embedding[int.from_bytes(digest[:4], "little") % dim] += 1.0
+    norm = math.sqrt(sum(value * value for value in embedding)) or 1.0
+    return [value / norm for value in embedding]
+
+
+def search_results(query: str, num_results: int, url_pool_size: int) -> List[Dict]:
+    rng = _rng_for(query)
+    results = []
+    for page_id in rng.sample(range(url_pool_size), min(num_results, url_pool_size)):
+        results.append(
+            {
+                "url": f"https://example.com/page/{page_id}",
+                "title": f"Page {page_id}",
+                "snippet": f"{query}. {_prose(rng, 4, with_citations=False)}",
+            }
+        )
+    return results
+
+
+class _FakeAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # keep the load test output readable
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _inject_fault(self, endpoint: str) -> bool:
+        """Sends an error or rate limit response for a fraction of requests. Returns True if one was sent."""
+        server: FakeServer = self.server.fake_server
+        roll = server.random()
+        if roll < server.config.rate_limit_rate:
+            server.record(endpoint, "rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached.", "type": "rate_limit"}},
+                headers={"Retry-After": str(server.config.retry_after_seconds)},
+            )
+            return True
+        if roll < server.config.rate_limit_rate + server.config.error_rate:
+            server.record(endpoint, "errors")
+            self._send_json(
+                500, {"error": {"message": "Injected error.", "type": "server_error"}}
+            )
+            return True
+        return False
+
+    def do_GET(self):
+        server: FakeServer = self.server.fake_server
+        parsed_url = urlparse(self.path)
+        if parsed_url.path == "/stats":
+            self._send_json(200, server.get_stats())
+        elif parsed_url.path == "/search":
+            server.record("searxng", "requests")
+            if self._inject_fault("searxng"):
+                return
+            server.sleep(server.search_latency)
+            query = parse_qs(parsed_url.query).get("q", [""])[0]
+            results = search_results(
+                query, server.config.num_search_results, server.config.url_pool_size
+            )
+            self._send_json(
+                200,
+                {
+                    "query": query,
+                    "results": [
+                        {"url": r["url"], "title": r["title"], "content": r["snippet"]}
+                        for r in results
+                    ],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}."}})
+
+    def do_POST(self):
+        server: FakeServer = self.server.fake_server
+        path = urlparse(self.path).path
+        body = self._read_json()
+        if path.endswith("/chat/completions") or path.endswith("/completions"):
+            is_chat = path.endswith("/chat/completions")
+            endpoint = "chat_completions" if is_chat else "completions"
+            server.record(endpoint, "requests")
+            if self._inject_fault(endpoint):
+                return
+            if is_chat:
+                prompt = "\n".join(
+                    message.get("content") or "" for message in body.get("messages", [])
+                )
+            else:
+                prompt = body.get("prompt") or ""
+            # the completions endpoint takes a list of prompts, with choice i * n + j for the j-th completion of prompt i
+            prompts = prompt if isinstance(prompt, list) else [prompt]
+            completions = [
+                synthesize_completion(p)
+                for p in prompts
+                for _ in range(body.get("n", 1))
+            ]
+            completion_tokens = sum(_count_tokens(c) for c in completions)
+            token_delay = 0.0
+            if server.config.tokens_per_second > 0:
+                # the prompts of a batch are decoded in parallel
+                n = body.get("n", 1)
+                token_delay = (
+                    max(
+                        sum(_count_tokens(c) for c in completions[i : i + n])
+                        for i in range(0, len(completions), n)
+                    )
+                    / server.config.tokens_per_second
+                )
+            server.sleep(server.lm_latency, extra_seconds=token_delay)
+            choices = [
+                (
+                    {
+                        "index": idx,
+                        "message": {"role": "assistant", "content": completion},
+                        "finish_reason": "stop",
+                    }
+                    if is_chat
+                    else {"index": idx, "text": completion, "finish_reason": "stop"}
+                )
+                for idx, completion in enumerate(completions)
+            ]
+            self._send_json(
+                200,
+                {
+                    "id": f"fake-{uuid.uuid4().hex}",
+                    "object": "chat.completion" if is_chat else "text_completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": choices,
+                    "usage": {
+                        "prompt_tokens": sum(_count_tokens(p) for p in prompts),
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": sum(_count_tokens(p) for p in prompts)
+                        + completion_tokens,
+                    },
+                },
+            )
+        elif path.endswith("/messages"):
+            server.record("messages", "requests")
+            if self._inject_fault("messages"):
+                return
+            blocks = _get_content_blocks(body.get("system"))
+            for message in body.get("messages", []):
+                blocks.extend(_get_content_blocks(message.get("content")))
+            prompt = "".join(block["text"] for block in blocks)
+            completion = synthesize_completion(prompt)
+            completion_tokens = _count_tokens(completion)
+            cache_read_tokens, cache_creation_tokens = server.lookup_prompt_cache(
+                blocks
+            )
+            token_delay = 0.0
+            if server.config.tokens_per_second > 0:
+                token_delay = completion_tokens / server.config.tokens_per_second
+            server.sleep(server.lm_latency, extra_seconds=token_delay)
+            self._send_json(
+                200,
+                {
+                    "id": f"msg_fake{uuid.uuid4().hex}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body.get("model", "fake"),
+                    "content": [{"type": "text", "text": completion}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {
+                        "input_tokens": max(
+                            0,
+                            _count_tokens(prompt)
+                            - cache_read_tokens
+                            - cache_creation_tokens,
+                        ),
+                        "output_tokens": completion_tokens,
+                        "cache_creation_input_tokens": cache_creation_tokens,
+                        "cache_read_input_tokens": cache_read_tokens,
+                    },
+                },
+            )
+        elif path.endswith("/embeddings"):
+            server.record("embeddings", "requests")
+            if self._inject_fault("embeddings"):
+                return
+            server.sleep(server.embedding_latency)
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "model": body.get("model", "fake"),
+                    "data": [
+                        {
+                            "object": "embedding",
+                            "index": idx,
+                            "embedding": hashed_embedding(
+                                text, server.config.embedding_dim
+                            ),
+                        }
+                        for idx, text in enumerate(texts)
+                    ],
+                    "usage": {
+                        "prompt_tokens": sum(_count_tokens(t) for t in texts),
+                        "total_tokens": sum(_count_tokens(t) for t in texts),
+                    },
+                },
+            )
+        elif path == "/search":
+            server.record("serper", "requests")
+            if self._inject_fault("serper"):
+                return
+            server.sleep(server.search_latency)
+            query = body.get("q", "")
+            num_results = body.get("num") or server.config.num_search_results
+            results = search_results(query, num_results, server.config.url_pool_size)
+            self._send_json(
+                200,
+                {
+                    "searchParameters": {"q": query},
+                    "organic": [
+                        {
+                            "title": r["title"],
+                            "link": r["url"],
+                            "snippet": r["snippet"],
+                            "position": idx + 1,
+                        }
+                        for idx, r in enumerate(results)
+                    ],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}."}})
+
+
+class FakeServer:
+    """
+    Threaded HTTP server implementing the fake APIs.
+
+    Usage:
+        server = FakeServer(FakeServerConfig(lm_latency="uniform:100,300")).start()
+        lm = OpenAIModel(model="gpt-4o-mini", api_key="fake", api_base=server.openai_api_base)
+        ...
+        server.stop()
+    """
+
+    def __init__(
+        self, config: Optional[FakeServerConfig] = None, host="127.0.0.1", port=0
+    ):
+        self.config = config or FakeServerConfig()
+        self.lm_latency = LatencyDistribution(self.config.lm_latency)
+        self.embedding_latency = LatencyDistribution(self.config.embedding_latency)
+        self.search_latency = LatencyDistribution(self.config.search_latency)
+        self.rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._stats_lock = threading.Lock()
+        self._prompt_cache = set()
+        self._prompt_cache_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _FakeAPIRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake_server = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_api_base(self) -> str:
+        return f"{self.url}/v1/"
+
+    def random(self) -> float:
+        with self._rng_lock:
+            return self.rng.random()
+
+    def sleep(self, latency: LatencyDistribution, extra_seconds: float = 0.0):
+        with self._rng_lock:
+            delay = latency.sample_seconds(self.rng)
+        time.sleep(delay + extra_seconds)
+
+    def record(self, endpoint: str, counter: str):
+        with self._stats_lock:
+            self._stats[endpoint][counter] += 1
+
+    def lookup_prompt_cache(self, blocks: List[Dict]) -> Tuple[int, int]:
+        """
+        Simulates the Anthropic prompt cache for the content blocks of a request. Returns the number of tokens read
+        from the cache (the longest cached prefix ending at a `cache_control` block) and the number written to it (the
+        rest of the prefix up to the last `cache_control` block). Cached prefixes never expire.
+        """
+        prefix_hash = hashlib.sha256()
+        prefix_tokens = 0
+        breakpoints = []
+        for block in blocks:
+            prefix_hash.update(block["text"].encode("utf-8"))
+            prefix_tokens += _count_tokens(block["text"])
+            if block.get("cache_control"):
+                breakpoints.append((prefix_hash.hexdigest(), prefix_tokens))
+        if not breakpoints:
+            return 0, 0
+        with self._prompt_cache_lock:
+            cache_read_tokens = max(
+                (tokens for key, tokens in breakpoints if key in self._prompt_cache),
+                default=0,
+            )
+            self._prompt_cache.update(key for key, _ in breakpoints)
+        self.record("messages", "cache_hits" if cache_read_tokens else "cache_misses")
+        return cache_read_tokens, breakpoints[-1][1] - cache_read_tokens
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        with self._stats_lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--lm-latency", type=str, default="fixed:0")
+    parser.add_argument("--embedding-latency", type=str, default="fixed:0")
+    parser.add_argument("--search-latency", type=str, default="fixed:0")
+    parser.add_argument(
+        "--tokens-per-second",
+        type=float,
+        default=0.0,
+        help="Completion token rate. 0 disables the token delay.",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--num-search-results", type=int, default=5)
+
+
+def get_server_config(args) -> FakeServerConfig:
+    return FakeServerConfig(
+        lm_latency=args.lm_latency,
+        embedding_latency=args.embedding_latency,
+        search_latency=args.search_latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        num_search_results=args.num_search_results,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeServer(get_server_config(args), host=args.host, port=args.port)
+    print(f"Fake API server listening on {server.url}")
+    print(f"  OpenAI api_base: {server.openai_api_base}")
+    print(f"  Serper base_url: {server.url}")
+    print(f"  SearXNG url:     {server.url}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Microbenchmark for hashing and memory footprint of Information objects.
+
+Compares `knowledge_storm.interface.Information` against the previous layout
+(per-instance __dict__ and an MD5 over JSON recomputed on every hash call).
+
+Usage:
+    python benchmarks/information_hashing.py --num-objects 100000
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import random
+import time
+import tracemalloc
+
+from knowledge_storm.interface import Information
+
+
+class LegacyInformation:
+    """Copy of the Information layout before hash memoization and __slots__."""
+
+    def __init__(self, url, description, snippets, title, meta=None):
+        self.description = description
+        self.snippets = snippets
+        self.title = title
+        self.url = url
+        self.meta = meta if meta is not None else {}
+        self.citation_uuid = -1
+
+    def __eq__(self, other):
+        if not isinstance(other, LegacyInformation):
+            return False
+        return (
+            self.url == other.url
+            and set(self.snippets) == set(other.snippets)
+            and self._meta_str() == other._meta_str()
+        )
+
+    def __hash__(self):
+        return int(
+            self._md5_hash((self.url, tuple(sorted(self.snippets)), self._meta_str())),
+            16,
+        )
+
+    def _meta_str(self):
+        return f"Question: {self.meta.get('question', '')}, Query: {self.meta.get('query', '')}"
+
+    def _md5_hash(self, value):
+        if isinstance(value, (dict, list, tuple)):
+            value = json.dumps(value, sort_keys=True)
+        return hashlib.md5(str(value).encode("utf-8")).hexdigest()
+
+
+def make_records(num_objects: int, num_urls: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(2000)]
+    records = []
+    for i in range(num_objects):
+        url_id = rng.randrange(num_urls)
+        records.append(
+            {
+                "url_id": url_id,
+                "snippets": [" ".join(rng.choices(words, k=60))],
+                "meta": {"question": f"question {i % 50}", "query": f"query {i % 200}"},
+            }
+        )
+    return records
+
+
+def build(cls, records):
+    # build urls and titles per object, as they are when parsed from search results
+    return [
+        cls(
+            url=f"https://example.com/page/{r['url_id']}",
+            description="",
+            snippets=list(r["snippets"]),
+            title=f"Title of page {r['url_id']}",
+            meta=dict(r["meta"]),
+        )
+        for r in records
+    ]
+
+
+def measure_memory(cls, records):
+    gc.collect()
+    tracemalloc.start()
+    objects = build(cls, records)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return current
+
+
+def measure_hashing(cls, records, repeat: int):
+    objects = build(cls, records)
+    start = time.perf_counter()
+    for obj in objects:
+        hash(obj)
+    first_pass = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hash_set = set()
+        for obj in objects:
+            hash_set.add(hash(obj))
+    repeated_pass = (time.perf_counter() - start) / repeat
+    return first_pass, repeated_pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-objects", type=int, default=100000)
+    parser.add_argument("--num-urls", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    records = make_records(args.num_objects, args.num_urls)
+    print(f"{args.num_objects} objects, {args.num_urls} unique urls")
+    print(f"{'layout':<10}{'memory (MB)':>14}{'first hash (s)':>18}{'re-hash (s)':>14}")
+    for name, cls in (("before", LegacyInformation), ("after", Information)):
+        memory = measure_memory(cls, records)
+        first_pass, repeated_pass = measure_hashing(cls, records, args.repeat)
+        print(
+            f"{name:<10}{memory / 2**20:>14.1f}"
+            f"{first_pass:>18.3f}{repeated_pass:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+End-to-end load harness for STORMWikiRunner and CoStormRunner.
+
+Drives `--num-jobs` topics (STORM) or sessions (Co-STORM), `--concurrency` at a time, through the real pipeline
+against the local fake API server in `benchmarks/fake_server.py`, and reports throughput, p50/p95/p99 latency per
+pipeline stage, peak thread count, peak RSS, the number of requests the server saw, errored and rate limited, and the
+client-side request metrics from `knowledge_storm.metrics`.
+Use it to tune `max_thread_num` and to catch concurrency regressions: it exits with a non-zero status when any job
+fails.
+
+By default the fake server runs in-process; pass `--server-url` to use one started separately. The OpenAI LM and
+embedding clients and the Serper/SearXNG retrievers are pointed at the server, so no API keys are needed. STORM
+article generation encodes snippets with the local paraphrase-MiniLM-L6-v2 sentence transformer, which is downloaded
+on first use; cache it beforehand for fully offline runs.
+
+Usage:
+    python benchmarks/load_harness.py --mode storm --num-jobs 8 --concurrency 4 --max-thread-num 3
+    python benchmarks/load_harness.py --mode costorm --num-jobs 4 --concurrency 4 --num-turns 3 \
+        --lm-latency lognormal:500,0.4 --rate-limit-rate 0.02 --output results.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from fake_server import FakeServer, add_server_arguments, get_server_config
+
+
+class ResourceMonitor:
+    """Samples the number of live threads in the background and reads the peak RSS of the process."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_thread_count = threading.active_count()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_thread_count = max(
+                self.peak_thread_count, threading.active_count()
+            )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    @staticmethod
+    def get_peak_rss_mb():
+        try:
+            import resource
+        except ImportError:
+            # not available on Windows
+            return None
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak_rss / 2**20 if sys.platform == "darwin" else peak_rss / 2**10
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = q / 100 * (len(values) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def build_rm(args, server_url: str):
+    from knowledge_storm.rm import SearXNG, SerperRM
+
+    if args.search == "serper":
+        return SerperRM(
+            serper_search_api_key="fake",
+            k=args.search_top_k,
+            base_url=server_url,
+        )
+    return SearXNG(searxng_api_url=f"{server_url}/search", k=args.search_top_k)
+
+
+def build_lm(args, api_base: str, max_tokens: int):
+    from knowledge_storm.lm import OpenAIModel
+
+    return OpenAIModel(
+        model=args.model,
+        api_key="fake",
+        api_base=api_base,
+        max_tokens=max_tokens,
+        temperature=1.0,
+        top_p=0.9,
+    )
+
+
+def run_storm_job(job_idx: int, args, server_url: str) -> Dict[str, float]:
+    from knowledge_storm import (
+        STORMWikiLMConfigs,
+        STORMWikiRunner,
+        STORMWikiRunnerArguments,
+    )
+
+    api_base = f"{server_url}/v1/"
+    lm_configs = STORMWikiLMConfigs()
+    lm_configs.set_conv_simulator_lm(build_lm(args, api_base, 500))
+    lm_configs.set_question_asker_lm(build_lm(args, api_base, 500))
+    lm_configs.set_outline_gen_lm(build_lm(args, api_base, 400))
+    lm_configs.set_article_gen_lm(build_lm(args, api_base, 700))
+    lm_configs.set_article_polish_lm(build_lm(args, api_base, 4000))
+    engine_args = STORMWikiRunnerArguments(
+        output_dir=os.path.join(args.output_dir, f"job_{job_idx}"),
+        max_conv_turn=args.max_conv_turn,
+        max_perspective=args.max_perspective,
+        search_top_k=args.search_top_k,
+        max_thread_num=args.max_thread_num,
+    )
+    runner = STORMWikiRunner(engine_args, lm_configs, build_rm(args, server_url))
+    runner.run(topic=f"Load test topic {job_idx}")
+    runner.post_run()
+    return dict(runner.time)
+
+
+def run_costorm_job(job_idx: int, args, server_url: str) -> Dict[str, float]:
+    from knowledge_storm.collaborative_storm.engine import (
+        CollaborativeStormLMConfigs,
+        CoStormRunner,
+        RunnerArgument,
+    )
+    from knowledge_storm.logging_wrapper import LoggingWrapper
+
+    api_base = f"{server_url}/v1/"
+    lm_config = CollaborativeStormLMConfigs()
+    lm_config.set_question_answering_lm(build_lm(args, api_base, 1000))
+    lm_config.set_discourse_manage_lm(build_lm(args, api_base, 500))
+    lm_config.set_utterance_polishing_lm(build_lm(args, api_base, 2000))
+    lm_config.set_warmstart_outline_gen_lm(build_lm(args, api_base, 500))
+    lm_config.set_question_asking_lm(build_lm(args, api_base, 300))
+    lm_config.set_knowledge_base_lm(build_lm(args, api_base, 1000))
+    runner_argument = RunnerArgument(
+        topic=f"Load test topic {job_idx}",
+        retrieve_top_k=args.search_top_k,
+        max_search_thread=args.max_thread_num,
+        max_thread_num=args.max_thread_num,
+        warmstart_max_thread=args.max_thread_num,
+    )
+    costorm_runner = CoStormRunner(
+        lm_config=lm_config,
+        runner_argument=runner_argument,
+        logging_wrapper=LoggingWrapper(lm_config),
+        rm=build_rm(args, server_url),
+    )
+    stage_times = defaultdict(float)
+
+    def timed(stage_name, func):
+        start = time.perf_counter()
+        result = func()
+        stage_times[stage_name] += time.perf_counter() - start
+        return result
+
+    timed("warm_start", costorm_runner.warm_start)
+    for _ in range(args.num_turns):
+        timed("step", costorm_runner.step)
+    timed("reorganize", costorm_runner.knowledge_base.reorganize)
+    timed("generate_report", costorm_runner.generate_report)
+    return dict(stage_times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["storm", "costorm"], default="storm")
+    parser.add_argument("--num-jobs", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--max-thread-num", type=int, default=3)
+    parser.add_argument("--search", choices=["serper", "searxng"], default="serper")
+    parser.add_argument("--search-top-k", type=int, default=3)
+    parser.add_argument("--model", type=str, default="gpt-4o-mini")
+    parser.add_argument(
+        "--max-conv-turn", type=int, default=3, help="STORM conversation turns."
+    )
+    parser.add_argument(
+        "--max-perspective", type=int, default=3, help="STORM perspectives."
+    )
+    parser.add_argument(
+        "--num-turns", type=int, default=3, help="Co-STORM turns per session."
+    )
+    parser.add_argument(
+        "--server-url",
+        type=str,
+        default="",
+        help="URL of a running fake server. If empty, one is started in-process.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="",
+        help="Directory for STORM outputs. Defaults to a temporary directory.",
+    )
+    parser.add_argument(
+        "--output", type=str, default="", help="Path to write the report as JSON."
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="If set, serve live Prometheus metrics on this port during the run.",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    server_url = args.server_url.rstrip("/")
+    if not server_url:
+        server = FakeServer(get_server_config(args)).start()
+        server_url = server.url
+    # the OpenAI embedding client used by Co-STORM reads its configuration from the environment
+    os.environ["ENCODER_API_TYPE"] = "openai"
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ["OPENAI_API_BASE"] = f"{server_url}/v1"
+    temp_dir = None
+    if not args.output_dir:
+        temp_dir = tempfile.TemporaryDirectory()
+        args.output_dir = temp_dir.name
+
+    from knowledge_storm.metrics import REGISTRY, start_metrics_server
+
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = start_metrics_server(port=args.metrics_port)
+        print(f"Serving metrics at http://127.0.0.1:{args.metrics_port}/metrics")
+
+    run_job = run_storm_job if args.mode == "storm" else run_costorm_job
+    job_results = []
+
+    def run_and_record(job_idx: int):
+        start = time.perf_counter()
+        try:
+            stage_times = run_job(job_idx, args, server_url)
+            error = None
+        except Exception:
+            stage_times = {}
+            error = traceback.format_exc()
+            print(f"Job {job_idx} failed:\n{error}")
+        job_results.append(
+            {
+                "job": job_idx,
+                "latency_seconds": time.perf_counter() - start,
+                "stage_seconds": stage_times,
+                "error": error,
+            }
+        )
+
+    monitor = ResourceMonitor().start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run_and_record, range(args.num_jobs)))
+    wall_time = time.perf_counter() - start
+    monitor.stop()
+
+    succeeded = [result for result in job_results if result["error"] is None]
+    stage_latencies = defaultdict(list)
+    for result in succeeded:
+        stage_latencies["total"].append(result["latency_seconds"])
+        for stage_name, seconds in result["stage_seconds"].items():
+            stage_latencies[stage_name].append(seconds)
+    report = {
+        "mode": args.mode,
+        "num_jobs": args.num_jobs,
+        "concurrency": args.concurrency,
+        "max_thread_num": args.max_thread_num,
+        "num_failed": len(job_results) - len(succeeded),
+        "wall_time_seconds": wall_time,
+        "throughput_jobs_per_minute": len(succeeded) / wall_time * 60,
+        "stage_latency_seconds": {
+            stage_name: {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)}
+            for stage_name, latencies in stage_latencies.items()
+        },
+        "peak_thread_count": monitor.peak_thread_count,
+        "peak_rss_mb": ResourceMonitor.get_peak_rss_mb(),
+        "server_stats": server.get_stats() if server is not None else None,
+        "client_metrics": REGISTRY.snapshot(),
+    }
+
+    print(
+        f"{args.mode}: {len(succeeded)}/{args.num_jobs} jobs succeeded in "
+        f"{wall_time:.1f}s ({report['throughput_jobs_per_minute']:.2f} jobs/min), "
+        f"concurrency {args.concurrency}, max_thread_num {args.max_thread_num}"
+    )
+    print(f"{'stage':<40}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}")
+    for stage_name, latency in report["stage_latency_seconds"].items():
+        print(
+            f"{stage_name:<40}{latency['p50']:>10.2f}"
+            f"{latency['p95']:>10.2f}{latency['p99']:>10.2f}"
+        )
+    print(f"peak threads: {report['peak_thread_count']}")
+    if report["peak_rss_mb"] is not None:
+        print(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+    if report["server_stats"] is not None:
+        print(f"server requests: {json.dumps(report['server_stats'])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if server is not None:
+        server.stop()
+    if temp_dir is not None:
+        temp_dir.cleanup()
+    if report["num_failed"] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
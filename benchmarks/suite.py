@@ -0,0 +1,368 @@
+"""
+Offline microbenchmark suite for the CPU hot paths of STORM and Co-STORM.
+
+Every case builds synthetic data at a given scale and times one operation on it. Running the cases at several
+scales shows how their cost grows, and `--output` writes the measurements as JSON for charting or for comparing
+two revisions. No network access or API keys are needed: retrieval uses a local hashing encoder instead of a
+sentence transformer and no LM is ever called.
+
+Usage:
+    python benchmarks/suite.py --scales 100,1000,10000
+    python benchmarks/suite.py --cases knowledge_base.reorganize,format_search_results --output results.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from knowledge_storm.collaborative_storm.modules.collaborative_storm_utils import (
+    format_search_results,
+)
+from knowledge_storm.dataclass import KnowledgeBase
+from knowledge_storm.interface import Information
+from knowledge_storm.logging_wrapper import LoggingWrapper
+from knowledge_storm.storm_wiki.modules.storm_dataclass import (
+    DialogueTurn,
+    StormArticle,
+    StormInformationTable,
+)
+from knowledge_storm.utils import ArticleTextProcessing
+
+WORDS = [f"word{i}" for i in range(2000)]
+
+
+class HashingEncoder:
+    """Local stand-in for SentenceTransformer that embeds hashed bags of words."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        embedding = np.zeros(self.dim, dtype=np.float32)
+        for word in text.split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            embedding[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+        return embedding
+
+    def encode(self, texts, show_progress_bar=False):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(text) for text in texts])
+
+
+class NoLMConfig:
+    """LM configuration without LMs, for timing the LoggingWrapper bookkeeping alone."""
+
+    def collect_and_reset_lm_usage(self):
+        return {}
+
+    def collect_and_reset_lm_history(self):
+        return []
+
+
+def make_sentence(rng: random.Random, num_citations: int) -> str:
+    citations = "".join(
+        f"[{rng.randint(1, num_citations)}]" for _ in range(rng.randint(0, 2))
+    )
+    return " ".join(rng.choices(WORDS, k=rng.randint(8, 25))) + "." + citations
+
+
+def make_article_text(rng: random.Random, num_sections: int, num_citations: int):
+    sections = []
+    for section_idx in range(num_sections):
+        paragraphs = [
+            " ".join(make_sentence(rng, num_citations) for _ in range(5))
+            for _ in range(3)
+        ]
+        sections.append(f"# Section {section_idx}\n" + "\n\n".join(paragraphs))
+    return "\n\n".join(sections)
+
+
+def make_outline(num_sections: int, num_subsections: int = 3) -> str:
+    lines = []
+    for section_idx in range(num_sections):
+        lines.append(f"# Section {section_idx}")
+        for subsection_idx in range(num_subsections):
+            lines.append(f"## Subsection {section_idx}.{subsection_idx}")
+    return "\n".join(lines)
+
+
+def make_information(rng: random.Random, idx: int, num_urls: int) -> Information:
+    url_id = rng.randrange(num_urls)
+    return Information(
+        url=f"https://example.com/page/{url_id}",
+        description="",
+        snippets=[" ".join(rng.choices(WORDS, k=60)) for _ in range(3)],
+        title=f"Title of page {url_id}",
+        meta={"question": f"question {idx % 50}", "query": f"query {idx % 200}"},
+    )
+
+
+def make_conversations(rng: random.Random, num_turns: int, num_urls: int):
+    conversations = []
+    for persona_idx in range(max(1, num_turns // 20)):
+        turns = []
+        for turn_idx in range(min(20, num_turns)):
+            turns.append(
+                DialogueTurn(
+                    agent_utterance=make_sentence(rng, 3),
+                    user_utterance=f"question {turn_idx}",
+                    search_queries=[f"query {turn_idx}"],
+                    search_results=[
+                        make_information(rng, turn_idx, num_urls) for _ in range(3)
+                    ],
+                )
+            )
+        conversations.append((f"persona {persona_idx}", turns))
+    return conversations
+
+
+def make_knowledge_base(num_sections: int) -> KnowledgeBase:
+    # the trigger count is never reached, so reorganize never calls the LM
+    knowledge_base = KnowledgeBase(
+        topic="benchmark",
+        knowledge_base_lm=None,
+        node_expansion_trigger_count=10**9,
+    )
+    knowledge_base.insert_from_outline_string(make_outline(num_sections))
+    return knowledge_base
+
+
+def get_leaf_paths(knowledge_base: KnowledgeBase) -> List[str]:
+    return [
+        " -> ".join(node.get_path_from_root())
+        for node in knowledge_base.get_all_leaf_nodes()
+    ]
+
+
+# Each case maps a scale to a function that runs the timed operation once. Setup happens before the returned
+# function is called and is not timed.
+
+
+def case_clean_up_section(scale: int) -> Callable:
+    text = make_article_text(random.Random(0), scale, num_citations=50)
+    return lambda: ArticleTextProcessing.clean_up_section(text)
+
+
+def case_update_citation_index(scale: int) -> Callable:
+    text = make_article_text(random.Random(0), 20, num_citations=scale)
+    citation_map = {idx: scale + 1 - idx for idx in range(1, scale + 1)}
+    return lambda: ArticleTextProcessing.update_citation_index(text, citation_map)
+
+
+def case_limit_word_count(scale: int) -> Callable:
+    text = make_article_text(random.Random(0), scale, num_citations=50)
+    max_word_count = len(text.split()) // 2
+    return lambda: ArticleTextProcessing.limit_word_count_preserve_newline(
+        text, max_word_count
+    )
+
+
+def case_parse_article_into_dict(scale: int) -> Callable:
+    text = make_article_text(random.Random(0), scale, num_citations=50)
+    return lambda: ArticleTextProcessing.parse_article_into_dict(text)
+
+
+def case_clean_up_outline(scale: int) -> Callable:
+    outline = make_outline(scale) + "\n# References\n## See also\n# Summary"
+    return lambda: ArticleTextProcessing.clean_up_outline(outline, topic="benchmark")
+
+
+def case_article_from_outline_str(scale: int) -> Callable:
+    outline = make_outline(scale)
+    return lambda: StormArticle.from_outline_str("benchmark", outline)
+
+
+def case_article_update_section(scale: int) -> Callable:
+    rng = random.Random(0)
+    article = StormArticle.from_outline_str("benchmark", make_outline(scale))
+    sections = [
+        (
+            make_article_text(rng, 1, num_citations=10).replace(
+                "# Section 0", f"# Section {section_idx}"
+            ),
+            [make_information(rng, idx, scale * 5) for idx in range(10)],
+        )
+        for section_idx in range(scale)
+    ]
+
+    def run():
+        for section_content, info_list in sections:
+            article.update_section(
+                current_section_content=section_content,
+                current_section_info_list=info_list,
+            )
+
+    return run
+
+
+def case_article_reorder_reference_index(scale: int) -> Callable:
+    rng = random.Random(0)
+    article = StormArticle.from_outline_str("benchmark", make_outline(scale))
+    for section_idx in range(scale):
+        article.update_section(
+            current_section_content=make_article_text(rng, 1, 10).replace(
+                "# Section 0", f"# Section {section_idx}"
+            ),
+            current_section_info_list=[
+                make_information(rng, idx, scale * 5) for idx in range(10)
+            ],
+        )
+    return article.reorder_reference_index
+
+
+def case_information_table_construct(scale: int) -> Callable:
+    conversations = make_conversations(random.Random(0), scale, num_urls=scale)
+    return lambda: StormInformationTable(conversations)
+
+
+def case_information_table_retrieve(scale: int) -> Callable:
+    table = StormInformationTable(
+        make_conversations(random.Random(0), scale, num_urls=scale)
+    )
+    table.prepare_table_for_retrieval(encoder=HashingEncoder())
+    queries = [" ".join(random.Random(idx).choices(WORDS, k=8)) for idx in range(5)]
+    return lambda: table.retrieve_information(queries, search_top_k=10)
+
+
+def case_knowledge_base_insert(scale: int) -> Callable:
+    rng = random.Random(0)
+    knowledge_base = make_knowledge_base(max(1, scale // 10))
+    leaf_paths = get_leaf_paths(knowledge_base)
+    infos = [make_information(rng, idx, scale) for idx in range(scale)]
+
+    def run():
+        for idx, info in enumerate(infos):
+            knowledge_base.insert_information(
+                path=leaf_paths[idx % len(leaf_paths)], information=info
+            )
+
+    return run
+
+
+def case_knowledge_base_find(scale: int) -> Callable:
+    knowledge_base = make_knowledge_base(scale)
+    leaf_paths = get_leaf_paths(knowledge_base)
+    return lambda: [knowledge_base.find_node_by_path(path) for path in leaf_paths]
+
+
+def case_knowledge_base_reorganize(scale: int) -> Callable:
+    rng = random.Random(0)
+    knowledge_base = make_knowledge_base(scale)
+    # half of the leaves get information, the others are trimmed by reorganize
+    for idx, path in enumerate(get_leaf_paths(knowledge_base)[::2]):
+        knowledge_base.insert_information(
+            path=path, information=make_information(rng, idx, scale)
+        )
+    return knowledge_base.reorganize
+
+
+def case_information_hash(scale: int) -> Callable:
+    rng = random.Random(0)
+    infos = [make_information(rng, idx, max(1, scale // 4)) for idx in range(scale)]
+    return lambda: set(infos)
+
+
+def case_format_search_results(scale: int) -> Callable:
+    rng = random.Random(0)
+    infos = [make_information(rng, idx, scale) for idx in range(scale)]
+    return lambda: format_search_results(
+        infos, info_max_num_tokens=scale * 100, mode="extensive"
+    )
+
+
+def case_logging_wrapper(scale: int) -> Callable:
+    logging_wrapper = LoggingWrapper(NoLMConfig())
+
+    def run():
+        with logging_wrapper.log_pipeline_stage("benchmark"):
+            for idx in range(scale):
+                with logging_wrapper.log_event(f"event {idx % 10}"):
+                    with logging_wrapper.log_event("nested event"):
+                        pass
+
+    return run
+
+
+CASES: Dict[str, Callable[[int], Callable]] = {
+    "text_processing.clean_up_section": case_clean_up_section,
+    "text_processing.update_citation_index": case_update_citation_index,
+    "text_processing.limit_word_count": case_limit_word_count,
+    "text_processing.parse_article_into_dict": case_parse_article_into_dict,
+    "text_processing.clean_up_outline": case_clean_up_outline,
+    "storm_article.from_outline_str": case_article_from_outline_str,
+    "storm_article.update_section": case_article_update_section,
+    "storm_article.reorder_reference_index": case_article_reorder_reference_index,
+    "information_table.construct": case_information_table_construct,
+    "information_table.retrieve": case_information_table_retrieve,
+    "knowledge_base.insert": case_knowledge_base_insert,
+    "knowledge_base.find": case_knowledge_base_find,
+    "knowledge_base.reorganize": case_knowledge_base_reorganize,
+    "information.hash": case_information_hash,
+    "format_search_results": case_format_search_results,
+    "logging_wrapper.log_event": case_logging_wrapper,
+}
+
+
+def run_case(case: Callable[[int], Callable], scale: int, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        # cases may mutate their data, so each repetition gets a fresh setup
+        run = case(scale)
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        type=str,
+        default="10,100,1000",
+        help="Comma-separated scales to run every case at.",
+    )
+    parser.add_argument(
+        "--cases",
+        type=str,
+        default="",
+        help=f"Comma-separated cases to run. Defaults to all of: {', '.join(CASES)}.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output", type=str, default="", help="Path to write the results as JSON."
+    )
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    case_names = args.cases.split(",") if args.cases else list(CASES)
+    for case_name in case_names:
+        if case_name not in CASES:
+            parser.error(f"Unknown case {case_name}.")
+
+    results = []
+    print(f"{'case':<42}{'scale':>8}{'median (ms)':>14}{'min (ms)':>12}")
+    for case_name in case_names:
+        for scale in scales:
+            timings = run_case(CASES[case_name], scale, args.repeat)
+            results.append(
+                {"case": case_name, "scale": scale, "timings_seconds": timings}
+            )
+            median_ms = statistics.median(timings) * 1000
+            min_ms = min(timings) * 1000
+            print(f"{case_name:<42}{scale:>8}{median_ms:>14.2f}{min_ms:>12.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Microbenchmark for the citation and outline text processing in `ArticleTextProcessing`.
+
+Compares `knowledge_storm.utils.ArticleTextProcessing` against the previous implementations
+(one DOTALL regex pass per stripped outline section and two str.replace passes per remapped citation)
+on large generated articles.
+
+Usage:
+    python benchmarks/text_processing.py --num-sections 200 --num-citations 300
+"""
+
+import argparse
+import random
+import re
+import time
+
+from knowledge_storm.utils import ArticleTextProcessing
+
+
+class LegacyArticleTextProcessing:
+    """Copy of the ArticleTextProcessing methods before patterns were precompiled and merged."""
+
+    @staticmethod
+    def clean_up_outline(outline, topic=""):
+        output_lines = []
+        current_level = 0
+        for line in outline.split("\n"):
+            stripped_line = line.strip()
+            if topic != "" and f"# {topic.lower()}" in stripped_line.lower():
+                output_lines = []
+            if stripped_line.startswith("#"):
+                current_level = stripped_line.count("#")
+                output_lines.append(stripped_line)
+            elif stripped_line.startswith("-"):
+                subsection_header = (
+                    "#" * (current_level + 1) + " " + stripped_line[1:].strip()
+                )
+                output_lines.append(subsection_header)
+        outline = "\n".join(output_lines)
+        for section_name in [
+            "See also",
+            "See Also",
+            "Notes",
+            "References",
+            "External links",
+            "External Links",
+            "Bibliography",
+            "Further reading",
+            "Further Reading",
+            "Summary",
+            "Appendices",
+            "Appendix",
+        ]:
+            outline = re.sub(
+                rf"#[#]? {section_name}.*?(?=##|$)", "", outline, flags=re.DOTALL
+            )
+        outline = re.sub(r"\[.*?\]", "", outline)
+        return outline
+
+    @staticmethod
+    def update_citation_index(s, citation_map):
+        for original_citation in citation_map:
+            s = s.replace(
+                f"[{original_citation}]", f"__PLACEHOLDER_{original_citation}__"
+            )
+        for original_citation, unify_citation in citation_map.items():
+            s = s.replace(f"__PLACEHOLDER_{original_citation}__", f"[{unify_citation}]")
+        return s
+
+
+def make_article(num_sections: int, num_citations: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(2000)]
+    sections = []
+    for section_idx in range(num_sections):
+        sentences = []
+        for _ in range(rng.randint(20, 40)):
+            citations = "".join(
+                f"[{rng.randint(1, num_citations)}]" for _ in range(rng.randint(0, 3))
+            )
+            sentences.append(
+                " ".join(rng.choices(words, k=rng.randint(8, 25))) + "." + citations
+            )
+        # an uncompleted last sentence, as produced when generation hits the token limit
+        sentences.append(" ".join(rng.choices(words, k=6)))
+        sections.append(f"## Section {section_idx}\n\n" + " ".join(sentences))
+    return "\n\n".join(sections)
+
+
+def make_outline(num_sections: int, seed: int = 0):
+    rng = random.Random(seed)
+    extra_sections = ["See also", "References", "External links", "Summary"]
+    lines = []
+    for section_idx in range(num_sections):
+        lines.append(f"## Section {section_idx} [{rng.randint(1, 9)}]")
+        for subsection_idx in range(rng.randint(1, 4)):
+            lines.append(f"- Subsection {section_idx}.{subsection_idx}")
+        if section_idx % 10 == 9:
+            lines.append(f"## {rng.choice(extra_sections)}")
+            lines.append("- Item")
+    return "\n".join(lines)
+
+
+def timeit(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-sections", type=int, default=200)
+    parser.add_argument("--num-citations", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    article = make_article(args.num_sections, args.num_citations)
+    outline = make_outline(args.num_sections)
+    citation_indices = list(range(1, args.num_citations + 1))
+    shuffled_indices = citation_indices[:]
+    random.Random(0).shuffle(shuffled_indices)
+    citation_map = dict(zip(citation_indices, shuffled_indices))
+
+    cases = [
+        (
+            "update_citation_index",
+            lambda impl: impl.update_citation_index(article, citation_map),
+        ),
+        ("clean_up_outline", lambda impl: impl.clean_up_outline(outline)),
+    ]
+    print(
+        f"article: {len(article)} chars, {args.num_citations} citations; "
+        f"outline: {len(outline)} chars"
+    )
+    print(f"{'operation':<32}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name, case in cases:
+        before, before_result = timeit(
+            lambda: case(LegacyArticleTextProcessing), args.repeat
+        )
+        after, after_result = timeit(lambda: case(ArticleTextProcessing), args.repeat)
+        if name != "clean_up_outline":
+            assert before_result == after_result, f"{name} output changed"
+        print(
+            f"{name:<32}{before * 1000:>14.2f}{after * 1000:>14.2f}"
+            f"{before / after:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -152,6 +152,10 @@ def main(args):
     log_dump = costorm_runner.dump_logging_and_reset()
     with open(os.path.join(args.output_dir, "log.json"), "w") as f:
         json.dump(log_dump, f, indent=2)
+    # Save trace, open it in https://ui.perfetto.dev to inspect the critical path
+    costorm_runner.logging_wrapper.export_chrome_trace(
+        os.path.join(args.output_dir, "trace.json")
+    )
 
 
 if __name__ == '__main__':
@@ -6,5 +6,13 @@ from .lm import *
 from .rm import *
 from .utils import *
 from .dataclass import *
+from .prompt_budget import *
+from .metrics import *
+from .lm_history import *
+from .lm_batching import *
+from .singleflight import *
+from .lm_pool import *
+from .hedging import *
+from .deadline import *
 
 __version__ = "1.0.1"
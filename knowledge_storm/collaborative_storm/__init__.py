@@ -1,2 +1,5 @@
 from .modules import *
 from .engine import *
+from .checkpoint import *
+from .session_manager import *
+from .warmstart_store import *
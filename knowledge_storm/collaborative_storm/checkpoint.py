@@ -0,0 +1,200 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+import dspy
+
+from .engine import CollaborativeStormLMConfigs, CoStormRunner
+from .modules.callback import BaseCallbackHandler
+from ..dataclass import ConversationTurn, KnowledgeNode
+from ..interface import Information
+
+
+class CoStormCheckpointLog:
+    """
+    Append-only checkpoint log for a CoStormRunner session.
+
+    The log is a JSON lines file. The first record is a full snapshot (`CoStormRunner.to_dict()`), and every
+    following checkpoint appends a delta holding only what changed since the previous checkpoint: new conversation
+    turns, newly cited information and the knowledge base tree mutations journaled by the KnowledgeBase. A checkpoint
+    therefore costs O(turn) instead of O(session). Turns that restructure the tree (e.g. reorganize) store the tree
+    structure without the information payload.
+
+    After `compaction_interval` deltas, the log is rewritten atomically as a single snapshot.
+
+    Usage:
+        checkpoint_log = CoStormCheckpointLog("session.jsonl")
+        costorm_runner.warm_start()
+        checkpoint_log.checkpoint(costorm_runner)
+        costorm_runner.step()
+        checkpoint_log.checkpoint(costorm_runner)
+        ...
+        costorm_runner = CoStormCheckpointLog.load("session.jsonl")
+    """
+
+    def __init__(self, path: str, compaction_interval: int = 20):
+        self.path = path
+        self.compaction_interval = compaction_interval
+        self._runner: Optional[CoStormRunner] = None
+        self._knowledge_base = None
+        self._num_deltas = 0
+        self._conversation_history = None
+        self._num_conversation_turns = 0
+        self._warmstart_conv_archive = None
+        self._num_warmstart_turns = 0
+        self._experts_string = None
+
+    def checkpoint(self, costorm_runner: CoStormRunner):
+        """Append the changes of the runner since the last checkpoint, writing a snapshot when needed."""
+        if (
+            self._runner is not costorm_runner
+            or self._knowledge_base is not costorm_runner.knowledge_base
+            or self._num_deltas >= self.compaction_interval
+        ):
+            self.compact(costorm_runner)
+            return
+        delta = self._get_delta(costorm_runner)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(delta) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._num_deltas += 1
+
+    def compact(self, costorm_runner: CoStormRunner):
+        """Rewrite the log as a single snapshot of the runner."""
+        # start journaling before taking the snapshot so that no mutation is missed
+        costorm_runner.knowledge_base.enable_mutation_log()
+        record = {"type": "snapshot", "runner": costorm_runner.to_dict()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._runner = costorm_runner
+        self._knowledge_base = costorm_runner.knowledge_base
+        self._num_deltas = 0
+        self._mark_checkpointed(costorm_runner)
+
+    def _mark_checkpointed(self, costorm_runner: CoStormRunner):
+        self._conversation_history = costorm_runner.conversation_history
+        self._num_conversation_turns = len(costorm_runner.conversation_history)
+        self._warmstart_conv_archive = costorm_runner.warmstart_conv_archive
+        self._num_warmstart_turns = len(costorm_runner.warmstart_conv_archive)
+        self._experts_string = json.dumps(
+            costorm_runner.discourse_manager.serialize_experts()
+        )
+
+    @staticmethod
+    def _get_turns_delta(turns: List[ConversationTurn], last_turns, num_last_turns):
+        start = num_last_turns
+        if turns is not last_turns or len(turns) < num_last_turns:
+            start = 0
+        return {"start": start, "turns": [turn.to_dict() for turn in turns[start:]]}
+
+    def _get_delta(self, costorm_runner: CoStormRunner) -> Dict:
+        knowledge_base = costorm_runner.knowledge_base
+        mutation_log, needs_tree_snapshot = knowledge_base.pop_mutation_log()
+        new_info_uuids = knowledge_base.pop_new_info_uuids()
+        delta = {
+            "type": "delta",
+            "conversation_history": self._get_turns_delta(
+                costorm_runner.conversation_history,
+                self._conversation_history,
+                self._num_conversation_turns,
+            ),
+            "warmstart_conv_archive": self._get_turns_delta(
+                costorm_runner.warmstart_conv_archive,
+                self._warmstart_conv_archive,
+                self._num_warmstart_turns,
+            ),
+            "new_info": {
+                uuid: knowledge_base.info_uuid_to_info_dict[uuid].to_dict()
+                for uuid in new_info_uuids
+            },
+            "next_turn_moderator_override": costorm_runner.discourse_manager.next_turn_moderator_override,
+        }
+        experts_string = json.dumps(
+            costorm_runner.discourse_manager.serialize_experts()
+        )
+        if experts_string != self._experts_string:
+            delta["experts"] = json.loads(experts_string)
+        if needs_tree_snapshot:
+            delta["tree"] = knowledge_base.root.to_dict()
+            delta["placements"] = {
+                uuid: info.meta.get("placement")
+                for uuid, info in knowledge_base.info_uuid_to_info_dict.items()
+            }
+        else:
+            delta["mutation_log"] = mutation_log
+        self._mark_checkpointed(costorm_runner)
+        return delta
+
+    @staticmethod
+    def _apply_delta(costorm_runner: CoStormRunner, delta: Dict):
+        for attr_name in ["conversation_history", "warmstart_conv_archive"]:
+            turns_delta = delta[attr_name]
+            setattr(
+                costorm_runner,
+                attr_name,
+                getattr(costorm_runner, attr_name)[: turns_delta["start"]]
+                + [ConversationTurn.from_dict(turn) for turn in turns_delta["turns"]],
+            )
+        if "experts" in delta:
+            costorm_runner.discourse_manager.experts = []
+            costorm_runner.discourse_manager.deserialize_experts(delta["experts"])
+        costorm_runner.discourse_manager.next_turn_moderator_override = delta[
+            "next_turn_moderator_override"
+        ]
+        knowledge_base = costorm_runner.knowledge_base
+        for uuid, info_dict in delta["new_info"].items():
+            knowledge_base.restore_information(
+                citation_uuid=int(uuid), information=Information.from_dict(info_dict)
+            )
+        if "tree" in delta:
+            knowledge_base.root = KnowledgeNode.from_dict(delta["tree"])
+            for uuid, placement in delta["placements"].items():
+                knowledge_base.info_uuid_to_info_dict[int(uuid)].meta[
+                    "placement"
+                ] = placement
+        else:
+            knowledge_base.apply_mutation_log(delta["mutation_log"])
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        lm_config: Optional[CollaborativeStormLMConfigs] = None,
+        rm: Optional[dspy.Retrieve] = None,
+        callback_handler: BaseCallbackHandler = None,
+    ) -> CoStormRunner:
+        """
+        Restore a CoStormRunner from the log by loading the last snapshot and replaying the deltas after it.
+        A truncated last record (e.g. the process stopped while writing it) is ignored.
+        `lm_config`, `rm` and `callback_handler` are passed to `CoStormRunner.from_dict`.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [line for line in f.read().split("\n") if line.strip()]
+        records = []
+        for idx, line in enumerate(lines):
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                if idx == len(lines) - 1:
+                    break
+                raise
+        snapshot_indices = [
+            idx for idx, record in enumerate(records) if record["type"] == "snapshot"
+        ]
+        if not snapshot_indices:
+            raise ValueError(f"No snapshot found in checkpoint log {path}.")
+        last_snapshot_idx = snapshot_indices[-1]
+        costorm_runner = CoStormRunner.from_dict(
+            records[last_snapshot_idx]["runner"],
+            lm_config=lm_config,
+            rm=rm,
+            callback_handler=callback_handler,
+        )
+        for record in records[last_snapshot_idx + 1 :]:
+            cls._apply_delta(costorm_runner, record)
+        return costorm_runner
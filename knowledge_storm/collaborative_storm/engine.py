@@ -1,3 +1,5 @@
+import concurrent.futures
+import copy
 import dspy
 import os
 from dataclasses import dataclass, field, asdict
@@ -13,6 +15,7 @@ from .modules.co_storm_agents import (
 )
 from .modules.expert_generation import GenerateExpertModule
 from .modules.warmstart_hierarchical_chat import WarmStartModule
+from .warmstart_store import WarmStartSnapshotStore
 from ..dataclass import ConversationTurn, KnowledgeBase
 from ..interface import LMConfigs, Agent
 from ..logging_wrapper import LoggingWrapper
@@ -165,11 +168,8 @@ class CollaborativeStormLMConfigs(LMConfigs):
             if "_lm" in attr_name and hasattr(
                 getattr(self, attr_name), "get_usage_and_reset"
             ):
-                usage = getattr(self, attr_name).get_usage_and_reset()
-                if any(
-                    value["prompt_tokens"] != 0 or value["completion_tokens"] != 0
-                    for value in usage.values()
-                ):
+                usage = self.get_lm_usage_and_reset(getattr(self, attr_name))
+                if any(any(counts.values()) for counts in usage.values()):
                     lm_usage[attr_name] = usage
         return lm_usage
 
@@ -211,6 +211,20 @@ class RunnerArgument:
         default=5,
         metadata={"help": "Maximum number of parallel thread for retriever"},
     )
+    retrieve_min_query_fraction: float = field(
+        default=1.0,
+        metadata={
+            "help": "Return search results once this fraction of the search queries for a question have answered, "
+            "dropping the slower ones. Lower it for more predictable turn latency. 1.0 waits for every query."
+        },
+    )
+    retrieve_timeout: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "Time budget in seconds for the search queries for a question. Queries without results by then "
+            "are dropped. None for no budget."
+        },
+    )
     max_search_queries_per_turn: int = field(
         default=3,
         metadata={"help": "Maximum number of search queries to consider in each turn."},
@@ -254,6 +268,41 @@ class RunnerArgument:
             "help": "Trigger node expansion for node that contain more than N snippets"
         },
     )
+    placement_similarity_threshold: float = field(
+        default=0.7,
+        metadata={
+            "help": "Place information into the nearest knowledge base node without LM call "
+            "if the embedding similarity is at least this value."
+        },
+    )
+    placement_margin_threshold: float = field(
+        default=0.1,
+        metadata={
+            "help": "Place information into the nearest knowledge base node without LM call "
+            "only if its similarity leads the second candidate by at least this margin."
+        },
+    )
+    incremental_knowledge_base_summary: bool = field(
+        default=False,
+        metadata={
+            "help": "If True, refresh the knowledge base summary from the previous summary and the newly added nodes "
+            "instead of summarizing the full mind map when nodes were only added."
+        },
+    )
+    background_reorganize: bool = field(
+        default=False,
+        metadata={
+            "help": "If True, reorganize a snapshot of the knowledge base in the background instead of before the turn is returned. "
+            "The reorganized mind map is swapped in at a later turn with the insertions made meanwhile replayed on it."
+        },
+    )
+    speculative_next_turn: bool = field(
+        default=False,
+        metadata={
+            "help": "If True, generate the next system turn in the background right after a turn is returned. "
+            "The result is used if the user advances the conversation and discarded if the user injects an utterance."
+        },
+    )
     disable_moderator: bool = field(
         default=False,
         metadata={"help": "If True, disable moderator."},
@@ -316,6 +365,60 @@ class TurnPolicySpec:
     agent: Agent = None
 
 
+class SpeculativeRetrievalCache(dspy.Retrieve):
+    """
+    Wraps a retrieval module so that search results of a speculative turn can be reused by the turn that replaces it.
+
+    Instances created over the same `results` dict share cached results. Cached results are consumed on the first
+    lookup of an identical query. Only instances with `record=True` (i.e. the ones used for speculation) store results.
+    """
+
+    def __init__(self, rm: dspy.Retrieve, results: Dict, record: bool = False):
+        super().__init__(k=getattr(rm, "k", 3))
+        self.rm = rm
+        self.results = results
+        self.record = record
+
+    def get_usage_and_reset(self):
+        if hasattr(self.rm, "get_usage_and_reset"):
+            return self.rm.get_usage_and_reset()
+        return {}
+
+    def forward(
+        self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
+    ):
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        key = (tuple(queries), tuple(sorted(exclude_urls)))
+        cached_results = self.results.pop(key, None)
+        if cached_results is not None:
+            # Retriever modifies the returned results in place
+            return copy.deepcopy(cached_results)
+        results = self.rm(query_or_queries=query_or_queries, exclude_urls=exclude_urls)
+        if self.record:
+            self.results[key] = copy.deepcopy(results)
+        return results
+
+
+@dataclass
+class SpeculativeTurn:
+    """
+    A system turn generated in the background before the user asks for it.
+
+    Attributes:
+        conversation_history (List[ConversationTurn]): The conversation history the turn was generated from.
+        agent (Agent): The agent chosen by the turn policy when the speculation started.
+        future (concurrent.futures.Future): Resolves to the generated ConversationTurn, or None if generation failed.
+    """
+
+    conversation_history: List[ConversationTurn]
+    agent: Agent
+    future: concurrent.futures.Future
+
+
 class DiscourseManager:
     def __init__(
         self,
@@ -507,27 +610,58 @@ class CoStormRunner:
         logging_wrapper: LoggingWrapper,
         rm: Optional[dspy.Retrieve] = None,
         callback_handler: BaseCallbackHandler = None,
+        warm_start_store: Optional[WarmStartSnapshotStore] = None,
     ):
         self.runner_argument = runner_argument
         self.lm_config = lm_config
         self.logging_wrapper = logging_wrapper
         self.callback_handler = callback_handler
+        self.warm_start_store = warm_start_store
         if rm is None:
             self.rm = BingSearch(k=runner_argument.retrieve_top_k)
         else:
             self.rm = rm
+        self.speculative_discourse_manager = None
+        self._speculation: Optional[SpeculativeTurn] = None
+        self._speculation_executor = None
+        self._reorganize_future: Optional[concurrent.futures.Future] = None
+        self._reorganize_snapshot: Optional[KnowledgeBase] = None
+        self._reorganize_executor = None
+        discourse_manager_rm = self.rm
+        if self.runner_argument.speculative_next_turn:
+            # speculative turns run on their own agents so that they do not share logging
+            # state or trigger callbacks for a turn the user has not asked for yet.
+            # The LM clients are shared, so their usage is left to the runner's logging wrapper.
+            self._speculative_retrieval_results = {}
+            discourse_manager_rm = SpeculativeRetrievalCache(
+                rm=self.rm, results=self._speculative_retrieval_results
+            )
+            self.speculative_discourse_manager = DiscourseManager(
+                lm_config=self.lm_config,
+                runner_argument=self.runner_argument,
+                logging_wrapper=LoggingWrapper(lm_config=None),
+                rm=SpeculativeRetrievalCache(
+                    rm=self.rm,
+                    results=self._speculative_retrieval_results,
+                    record=True,
+                ),
+                callback_handler=None,
+            )
         self.conversation_history = []
         self.warmstart_conv_archive = []
         self.knowledge_base = KnowledgeBase(
             topic=self.runner_argument.topic,
             knowledge_base_lm=self.lm_config.knowledge_base_lm,
             node_expansion_trigger_count=self.runner_argument.node_expansion_trigger_count,
+            placement_similarity_threshold=self.runner_argument.placement_similarity_threshold,
+            placement_margin_threshold=self.runner_argument.placement_margin_threshold,
+            incremental_summary=self.runner_argument.incremental_knowledge_base_summary,
         )
         self.discourse_manager = DiscourseManager(
             lm_config=self.lm_config,
             runner_argument=self.runner_argument,
             logging_wrapper=self.logging_wrapper,
-            rm=self.rm,
+            rm=discourse_manager_rm,
             callback_handler=callback_handler,
         )
 
@@ -542,18 +676,41 @@ class CoStormRunner:
                 turn.to_dict() for turn in self.warmstart_conv_archive
             ],
             "experts": self.discourse_manager.serialize_experts(),
+            "next_turn_moderator_override": self.discourse_manager.next_turn_moderator_override,
             "knowledge_base": self.knowledge_base.to_dict(),
         }
 
     @classmethod
-    def from_dict(cls, data):
-        # FIXME: does not use the lm_config data but naively use default setting
-        lm_config = CollaborativeStormLMConfigs()
-        lm_config.init(lm_type=os.getenv("OPENAI_API_TYPE"))
+    def from_dict(
+        cls,
+        data,
+        lm_config: Optional[CollaborativeStormLMConfigs] = None,
+        rm: Optional[dspy.Retrieve] = None,
+        callback_handler: BaseCallbackHandler = None,
+        warm_start_store: Optional[WarmStartSnapshotStore] = None,
+    ):
+        """
+        Constructs a CoStormRunner instance from a dictionary representation.
+
+        Args:
+            data (dict): The dictionary representation produced by `to_dict`.
+            lm_config (CollaborativeStormLMConfigs, optional): LM configurations to use. LM clients are stateless
+                and can be shared across runners. If None, use the default setting for `OPENAI_API_TYPE`.
+            rm (dspy.Retrieve, optional): Retrieval module to use. Can be shared across runners.
+            callback_handler (BaseCallbackHandler, optional): Callback handler of the restored runner.
+            warm_start_store (WarmStartSnapshotStore, optional): Warm start snapshot store of the restored runner.
+        """
+        if lm_config is None:
+            # FIXME: does not use the lm_config data but naively use default setting
+            lm_config = CollaborativeStormLMConfigs()
+            lm_config.init(lm_type=os.getenv("OPENAI_API_TYPE"))
         costorm_runner = cls(
             lm_config=lm_config,
             runner_argument=RunnerArgument.from_dict(data["runner_argument"]),
             logging_wrapper=LoggingWrapper(lm_config),
+            rm=rm,
+            callback_handler=callback_handler,
+            warm_start_store=warm_start_store,
         )
         costorm_runner.conversation_history = [
             ConversationTurn.from_dict(turn) for turn in data["conversation_history"]
@@ -563,13 +720,52 @@ class CoStormRunner:
             for turn in data.get("warmstart_conv_archive", [])
         ]
         costorm_runner.discourse_manager.deserialize_experts(data["experts"])
-        costorm_runner.knowledge_base = KnowledgeBase.from_dict(
-            data=data["knowledge_base"],
-            knowledge_base_lm=costorm_runner.lm_config.knowledge_base_lm,
-            node_expansion_trigger_count=costorm_runner.runner_argument.node_expansion_trigger_count,
+        costorm_runner.discourse_manager.next_turn_moderator_override = data.get(
+            "next_turn_moderator_override", False
+        )
+        costorm_runner.knowledge_base = costorm_runner._knowledge_base_from_dict(
+            data["knowledge_base"]
         )
         return costorm_runner
 
+    def _knowledge_base_from_dict(self, data: Dict) -> KnowledgeBase:
+        return KnowledgeBase.from_dict(
+            data=data,
+            knowledge_base_lm=self.lm_config.knowledge_base_lm,
+            node_expansion_trigger_count=self.runner_argument.node_expansion_trigger_count,
+            placement_similarity_threshold=self.runner_argument.placement_similarity_threshold,
+            placement_margin_threshold=self.runner_argument.placement_margin_threshold,
+            incremental_summary=self.runner_argument.incremental_knowledge_base_summary,
+        )
+
+    def _get_warm_start_snapshot(self) -> Dict:
+        return {
+            "conversation_history": [
+                turn.to_dict() for turn in self.conversation_history
+            ],
+            "warmstart_conv_archive": [
+                turn.to_dict() for turn in self.warmstart_conv_archive
+            ],
+            "experts": self.discourse_manager.serialize_experts(),
+            "knowledge_base": self.knowledge_base.to_dict(),
+        }
+
+    def _restore_warm_start_snapshot(self, snapshot: Dict):
+        self.conversation_history = [
+            ConversationTurn.from_dict(turn)
+            for turn in snapshot["conversation_history"]
+        ]
+        self.warmstart_conv_archive = [
+            ConversationTurn.from_dict(turn)
+            for turn in snapshot["warmstart_conv_archive"]
+        ]
+        self.discourse_manager.experts = []
+        self.discourse_manager.deserialize_experts(snapshot["experts"])
+        self.discourse_manager.next_turn_moderator_override = True
+        self.knowledge_base = self._knowledge_base_from_dict(snapshot["knowledge_base"])
+        # snapshots are shared by topics that only differ in case and whitespace
+        self.knowledge_base.topic = self.runner_argument.topic
+
     def warm_start(self):
         """
         Warm start co-storm system to conduct background information search in order to build shared conceptual space with user.
@@ -578,11 +774,28 @@ class CoStormRunner:
 
         It will also generate a first draft of report and use it to produce an engaging and concise conversation presented to the
         user to catch up with system's knowledge about the topic.
+
+        If a `warm_start_store` is provided, a matching snapshot is loaded instead when available, and the result of a
+        fresh warm start is saved to the store.
         """
+        use_warm_start_store = (
+            self.warm_start_store is not None
+            and not self.runner_argument.rag_only_baseline_mode
+        )
         with self.logging_wrapper.log_pipeline_stage(
             pipeline_stage=f"warm start stage"
         ):
-            if not self.runner_argument.rag_only_baseline_mode:
+            snapshot = None
+            if use_warm_start_store:
+                with self.logging_wrapper.log_event("warm start: load snapshot"):
+                    snapshot = self.warm_start_store.load(
+                        runner_argument=self.runner_argument,
+                        lm_config=self.lm_config,
+                        rm=self.rm,
+                    )
+                    if snapshot is not None:
+                        self._restore_warm_start_snapshot(snapshot)
+            if snapshot is None and not self.runner_argument.rag_only_baseline_mode:
                 warm_start_module = WarmStartModule(
                     lm_config=self.lm_config,
                     runner_argument=self.runner_argument,
@@ -608,7 +821,18 @@ class CoStormRunner:
                 )
                 self.warmstart_conv_archive = warmstart_conv
                 self.knowledge_base.reorganize()
-            else:
+                self.logging_wrapper.add_placement_stats(
+                    self.knowledge_base.collect_and_reset_placement_stats()
+                )
+                if use_warm_start_store:
+                    with self.logging_wrapper.log_event("warm start: save snapshot"):
+                        self.warm_start_store.save(
+                            runner_argument=self.runner_argument,
+                            lm_config=self.lm_config,
+                            snapshot=self._get_warm_start_snapshot(),
+                            rm=self.rm,
+                        )
+            elif snapshot is None:
                 if self.knowledge_base is None:
                     self.knowledge_base = KnowledgeBase(
                         topic=self.runner_argument.topic
@@ -624,6 +848,161 @@ class CoStormRunner:
                     allow_create_new_node=True,
                     insert_under_root=self.runner_argument.rag_only_baseline_mode,
                 )
+        self._start_speculation()
+
+    def _get_speculative_agent(self, agent: Agent) -> Agent:
+        speculative_discourse_manager = self.speculative_discourse_manager
+        if agent is self.discourse_manager.moderator:
+            return speculative_discourse_manager.moderator
+        if agent is self.discourse_manager.general_knowledge_provider:
+            return speculative_discourse_manager.general_knowledge_provider
+        speculative_discourse_manager.experts = []
+        speculative_discourse_manager.deserialize_experts(
+            [
+                {
+                    "topic": agent.topic,
+                    "role_name": agent.role_name,
+                    "role_description": agent.role_description,
+                }
+            ]
+        )
+        return speculative_discourse_manager.experts[0]
+
+    def _generate_speculative_utterance(
+        self, agent: Agent, conversation_history: List[ConversationTurn]
+    ) -> Optional[ConversationTurn]:
+        logging_wrapper = self.speculative_discourse_manager.logging_wrapper
+        cur_turn_name = f"conv turn: {len(conversation_history) + 1}"
+        conv_turn = None
+        try:
+            with logging_wrapper.log_pipeline_stage(
+                pipeline_stage=f"{cur_turn_name} speculative stage"
+            ):
+                with logging_wrapper.log_event(f"{cur_turn_name}: generate utterance"):
+                    conv_turn = agent.generate_utterance(
+                        knowledge_base=self.knowledge_base,
+                        conversation_history=conversation_history,
+                    )
+        except Exception as e:
+            print(f"Error occurred during speculative turn generation: {e}")
+            return None
+        return conv_turn
+
+    def _start_speculation(self):
+        """Start generating the next system turn in the background if speculation is enabled."""
+        if (
+            not self.runner_argument.speculative_next_turn
+            or self.runner_argument.rag_only_baseline_mode
+            or not self.conversation_history
+        ):
+            return
+        turn_policy = self.discourse_manager.get_next_turn_policy(
+            conversation_history=self.conversation_history, dry_run=True
+        )
+        conversation_history = list(self.conversation_history)
+        if self._speculation_executor is None:
+            # a single worker keeps speculative turns in order
+            self._speculation_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1
+            )
+        future = self._speculation_executor.submit(
+            self._generate_speculative_utterance,
+            self._get_speculative_agent(turn_policy.agent),
+            conversation_history,
+        )
+        self._speculation = SpeculativeTurn(
+            conversation_history=conversation_history,
+            agent=turn_policy.agent,
+            future=future,
+        )
+
+    def _wait_for_speculation(self) -> Optional[SpeculativeTurn]:
+        """
+        Wait for the pending speculative turn and move its logs into the runner's logging wrapper.
+        The knowledge base must not be modified while a speculative turn reads it.
+        """
+        speculation = self._speculation
+        self._speculation = None
+        if speculation is None or speculation.future.cancelled():
+            return None
+        speculation.future.result()
+        self.logging_wrapper.merge_logging_and_reset(
+            self.speculative_discourse_manager.logging_wrapper
+        )
+        return speculation
+
+    def _discard_speculation(self):
+        """
+        Drop the pending speculative turn because the conversation changed. A turn that has not started is cancelled.
+        A running one finishes on the single speculation worker before the next one starts, so its logs are merged
+        when the next speculative turn is waited for.
+        """
+        if self._speculation is not None:
+            self._speculation.future.cancel()
+            self._speculation = None
+
+    def _is_speculation_valid(
+        self, speculation: Optional[SpeculativeTurn], turn_policy: TurnPolicySpec
+    ) -> bool:
+        return (
+            speculation is not None
+            and speculation.agent is turn_policy.agent
+            and len(speculation.conversation_history) == len(self.conversation_history)
+            and all(
+                a is b
+                for a, b in zip(
+                    speculation.conversation_history, self.conversation_history
+                )
+            )
+            and speculation.future.result() is not None
+        )
+
+    def _start_background_reorganize(self):
+        """Reorganize a snapshot of the knowledge base in the background."""
+        self._finish_background_reorganize(wait=True)
+        if self._reorganize_executor is None:
+            self._reorganize_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1
+            )
+        self._reorganize_snapshot = self.knowledge_base.get_reorganize_snapshot()
+        self._reorganize_future = self._reorganize_executor.submit(
+            self._reorganize_snapshot.reorganize
+        )
+
+    def _finish_background_reorganize(self, wait: bool = False):
+        """
+        Swap in the reorganized knowledge base if the background reorganization is done, or after waiting for it if `wait`.
+        No speculative turn may read the knowledge base during the swap.
+        """
+        if self._reorganize_future is None:
+            return
+        if not wait and not self._reorganize_future.done():
+            return
+        future, snapshot = self._reorganize_future, self._reorganize_snapshot
+        self._reorganize_future = None
+        self._reorganize_snapshot = None
+        try:
+            future.result()
+        except Exception as e:
+            print(
+                f"Error occurred during background knowledge base reorganization: {e}"
+            )
+            self.knowledge_base.discard_reorganize_snapshot()
+            return
+        self.knowledge_base.apply_reorganized_snapshot(snapshot)
+
+    def close(self):
+        """
+        Finish the pending speculative turn and background reorganization, and shut down their worker threads.
+        Call before serializing a runner that is released from memory. The runner can still be used afterwards.
+        """
+        self._wait_for_speculation()
+        self._finish_background_reorganize(wait=True)
+        for executor in [self._speculation_executor, self._reorganize_executor]:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._speculation_executor = None
+        self._reorganize_executor = None
 
     def generate_report(self) -> str:
         """
@@ -633,6 +1012,8 @@ class CoStormRunner:
         Returns:
             str: A string representing the report, with "#" "##" indicating hierarchical sections and [1][2] indicating references.
         """
+        self._wait_for_speculation()
+        self._finish_background_reorganize(wait=True)
         with self.logging_wrapper.log_pipeline_stage("report generation stage"):
             with self.logging_wrapper.log_event(
                 "report generation stage: generate report"
@@ -676,6 +1057,12 @@ class CoStormRunner:
             4. Knowledge Base Update
                 - Inserts the new turn into the `knowledge_base`, optionally allowing the creation of new nodes or inserting under the root based on the `rag_only_baseline_mode` flag.
                 - If the turn policy specifies, it reorganizes the `knowledge_base` to maintain optimal structure and relevance.
+                  With `background_reorganize`, the reorganization runs on a snapshot and is swapped in at a later turn.
+
+            5. Speculation
+                - If `speculative_next_turn` is enabled, the next system utterance is generated in the background once this turn is returned.
+                  The next call without `user_utterance` uses it if the conversation did not change in between. Otherwise it is discarded
+                  and its search results are reused for identical queries.
         """
         last_conv_turn = self.conversation_history[-1]
         cur_turn_name = f"conv turn: {len(self.conversation_history) + 1}"
@@ -684,6 +1071,7 @@ class CoStormRunner:
         ):
             conv_turn = None
             if user_utterance:
+                self._discard_speculation()
                 self.discourse_manager.next_turn_moderator_override = False
                 conv_turn = ConversationTurn(
                     role="Guest",
@@ -692,6 +1080,8 @@ class CoStormRunner:
                 )
                 self.conversation_history.append(conv_turn)
             else:
+                speculation = self._wait_for_speculation()
+                self._finish_background_reorganize()
                 with self.logging_wrapper.log_event(
                     f"{cur_turn_name}: get turn policy"
                 ):
@@ -707,10 +1097,17 @@ class CoStormRunner:
                 with self.logging_wrapper.log_event(
                     f"{cur_turn_name}: generate utterance"
                 ):
-                    conv_turn = turn_policy.agent.generate_utterance(
-                        knowledge_base=self.knowledge_base,
-                        conversation_history=self.conversation_history,
-                    )
+                    if not simulate_user and self._is_speculation_valid(
+                        speculation, turn_policy
+                    ):
+                        conv_turn = speculation.future.result()
+                    else:
+                        conv_turn = turn_policy.agent.generate_utterance(
+                            knowledge_base=self.knowledge_base,
+                            conversation_history=self.conversation_history,
+                        )
+                    if self.runner_argument.speculative_next_turn:
+                        self._speculative_retrieval_results.clear()
 
                 if turn_policy.should_update_experts_list:
                     with self.logging_wrapper.log_event(
@@ -741,5 +1138,12 @@ class CoStormRunner:
                     ):
                         if self.callback_handler is not None:
                             self.callback_handler.on_mindmap_reorg_start()
-                        self.knowledge_base.reorganize()
+                        if self.runner_argument.background_reorganize:
+                            self._start_background_reorganize()
+                        else:
+                            self.knowledge_base.reorganize()
+                self.logging_wrapper.add_placement_stats(
+                    self.knowledge_base.collect_and_reset_placement_stats()
+                )
+        self._start_speculation()
         return conv_turn
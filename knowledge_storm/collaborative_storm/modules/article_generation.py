@@ -1,9 +1,10 @@
 import dspy
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Set, Union
 
 from .collaborative_storm_utils import clean_up_section
 from ...dataclass import KnowledgeBase, KnowledgeNode
+from ...deadline import DeadlineThreadPoolExecutor, as_completed_within_deadline
+from ...prompt_budget import PromptPacker
 
 
 class ArticleGenerationModule(dspy.Module):
@@ -21,20 +22,17 @@ class ArticleGenerationModule(dspy.Module):
         self,
         all_citation_index: Set[int],
         knowledge_base: KnowledgeBase,
-        max_words: int = 1500,
+        max_tokens: int = 2000,
     ):
         information = []
-        cur_word_count = 0
         for index in sorted(list(all_citation_index)):
             info = knowledge_base.info_uuid_to_info_dict[index]
             snippet = info.snippets[0]
-            info_text = f"[{index}]: {snippet} (Question: {info.meta['question']}. Query: {info.meta['query']})"
-            cur_snippet_length = len(info_text.split())
-            if cur_snippet_length + cur_word_count > max_words:
-                break
-            cur_word_count += cur_snippet_length
-            information.append(info_text)
-        return "\n".join(information)
+            information.append(
+                f"[{index}]: {snippet} (Question: {info.meta['question']}. Query: {info.meta['query']})"
+            )
+        packer = PromptPacker.for_lm(self.engine, max_tokens=max_tokens)
+        return "\n".join(information[: len(packer.select(information))])
 
     def gen_section(
         self, topic: str, node: KnowledgeNode, knowledge_base: KnowledgeBase
@@ -77,15 +75,15 @@ class ArticleGenerationModule(dspy.Module):
             path = " -> ".join(node.get_path_from_root())
             return path, node_gen_paragraph
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
+        with DeadlineThreadPoolExecutor("node_generation", max_workers=5) as executor:
             # Submit all tasks
             future_to_node = {
                 executor.submit(_node_generate_paragraph, node): node
                 for node in all_nodes
             }
 
-            # Collect the results as they complete
-            for future in as_completed(future_to_node):
+            # Collect the results as they complete; nodes not written by the deadline are left empty
+            for future in as_completed_within_deadline(future_to_node, "nodes"):
                 path, node_gen_paragraph = future.result()
                 node_to_paragraph[path] = node_gen_paragraph
 
@@ -94,7 +92,7 @@ class ArticleGenerationModule(dspy.Module):
             if cur_root is not None:
                 hash_tag = "#" * level + " "
                 cur_path = " -> ".join(cur_root.get_path_from_root())
-                node_gen_paragraph = node_to_paragraph[cur_path]
+                node_gen_paragraph = node_to_paragraph.get(cur_path, "")
                 to_return.append(f"{hash_tag}{cur_root.name}\n{node_gen_paragraph}")
                 for child in cur_root.children:
                     to_return.extend(helper(child, level + 1))
@@ -1,8 +1,7 @@
 import dspy
 from itertools import zip_longest
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Optional, TYPE_CHECKING
+from typing import Dict, List, Optional, TYPE_CHECKING
 
 from .callback import BaseCallbackHandler
 from .collaborative_storm_utils import (
@@ -13,7 +12,7 @@ from .costorm_expert_utterance_generator import CoStormExpertUtteranceGeneration
 from .grounded_question_generation import GroundedQuestionGenerationModule
 from .simulate_user import GenSimulatedUserUtterance
 from ...dataclass import ConversationTurn, KnowledgeBase
-from ...encoder import get_text_embeddings
+from ...encoder import get_normalized_text_embedding_matrix
 from ...interface import Agent, Information, LMConfigs
 from ...logging_wrapper import LoggingWrapper
 
@@ -187,58 +186,69 @@ class Moderator(Agent):
 
     def _get_conv_turn_unused_information(
         self, conv_turn: ConversationTurn, knowledge_base: KnowledgeBase
-    ):
-        # extract all snippets from raw retrieved information
-        raw_retrieved_info: List[Information] = conv_turn.raw_retrieved_info
-        raw_retrieved_single_snippet_info: List[Information] = []
-        for info in raw_retrieved_info:
+    ) -> List[Information]:
+        # extract all snippets from raw retrieved information that are not cited
+        unused_information: List[Information] = []
+        for info in conv_turn.raw_retrieved_info:
             for snippet_idx in range(len(info.snippets)):
-                raw_retrieved_single_snippet_info.append(
-                    extract_storm_info_snippet(info, snippet_index=snippet_idx)
+                snippet_info = extract_storm_info_snippet(
+                    info, snippet_index=snippet_idx
                 )
-        # get all cited information
-        cited_info = list(knowledge_base.info_uuid_to_info_dict.values())
-        cited_info_hash_set = set([hash(info) for info in cited_info])
-        cited_snippets = [info.snippets[0] for info in cited_info]
-        # get list of unused information
-        unused_information: List[Information] = [
-            info
-            for info in raw_retrieved_single_snippet_info
-            if hash(info) not in cited_info_hash_set
-        ]
+                if not knowledge_base.is_information_cited(snippet_info):
+                    unused_information.append(snippet_info)
+        return unused_information
+
+    def _rank_conv_turn_unused_information(
+        self,
+        conv_turn: ConversationTurn,
+        unused_information: List[Information],
+        text_to_embedding: Dict[str, np.ndarray],
+        cited_snippets_embedding: np.ndarray,
+    ) -> List[Information]:
         if not unused_information:
             return []
-        # extract snippets to get embeddings
-        unused_information_snippets = [info.snippets[0] for info in unused_information]
-        # get embeddings
-        cache = knowledge_base.embedding_cache
-        unused_snippets_embeddings, _ = get_text_embeddings(
-            unused_information_snippets, embedding_cache=cache, max_workers=100
-        )
-        claim_embedding, _ = get_text_embeddings(
-            conv_turn.claim_to_make, embedding_cache=cache
-        )
-        query_embedding, _ = get_text_embeddings(
-            conv_turn.queries, embedding_cache=cache
+        # all embeddings are L2-normalized so dot product equals cosine similarity
+        unused_snippets_embeddings = np.array(
+            [text_to_embedding[info.snippets[0]] for info in unused_information]
         )
-        cited_snippets_embedding, _ = get_text_embeddings(
-            cited_snippets, embedding_cache=cache
+        embedding_dim = unused_snippets_embeddings.shape[1]
+        if embedding_dim == 0:
+            return unused_information
+        query_embedding = np.array(
+            [text_to_embedding[query] for query in conv_turn.queries]
+        ).reshape(-1, embedding_dim)
+        claim_embedding = np.array(
+            [text_to_embedding[conv_turn.claim_to_make]]
+            if conv_turn.claim_to_make
+            else []
+        ).reshape(-1, embedding_dim)
+        if cited_snippets_embedding.shape[1] != embedding_dim:
+            cited_snippets_embedding = np.zeros((0, embedding_dim))
+        # calculate similarity against queries, claim and cited snippets in one pass
+        similarity = (
+            unused_snippets_embeddings
+            @ np.vstack([query_embedding, claim_embedding, cited_snippets_embedding]).T
         )
-        # calculate similarity
-        query_similarities = cosine_similarity(
-            unused_snippets_embeddings, query_embedding
+        num_queries, num_claims = len(query_embedding), len(claim_embedding)
+        query_similarities = similarity[:, :num_queries]
+        claim_similarity = similarity[:, num_queries : num_queries + num_claims]
+        cited_similarities = similarity[:, num_queries + num_claims :]
+        num_unused = len(unused_information)
+        max_query_similarity = (
+            np.max(query_similarities, axis=1) if num_queries else np.zeros(num_unused)
         )
-        max_query_similarity = np.max(query_similarities, axis=1)
-        cited_snippets_similarity = np.max(
-            cosine_similarity(unused_snippets_embeddings, cited_snippets_embedding),
-            axis=1,
+        cited_snippets_similarity = (
+            np.max(cited_similarities, axis=1)
+            if cited_similarities.shape[1]
+            else np.zeros(num_unused)
         )
         cited_snippets_similarity = np.clip(cited_snippets_similarity, 0, 1)
         # use claim similarity to filter out "real" not useful data
-        claim_similarity = cosine_similarity(
-            unused_snippets_embeddings, claim_embedding.reshape(1, -1)
-        ).flatten()
-        claim_similarity = np.where(claim_similarity >= 0.25, 1.0, 0.0)
+        claim_similarity = (
+            np.where(claim_similarity.flatten() >= 0.25, 1.0, 0.0)
+            if num_claims
+            else np.ones(num_unused)
+        )
         # calculate score: snippet that is close to topic but far from query
         query_sim_weight = 0.5
         cited_snippets_sim_weight = 1 - query_sim_weight
@@ -256,29 +266,50 @@ class Moderator(Agent):
         conversation_history: List[ConversationTurn],
         last_n_conv_turn: int = 2,
     ):
-        # get last N conv turn and batch encode all related strings
+        # get last N conv turn and their unused information
         considered_conv_turn = []
-        batch_snippets = [self.topic]
         for conv_turn in reversed(conversation_history):
             if len(considered_conv_turn) == last_n_conv_turn:
                 break
             if conv_turn.utterance_type == "Questioning":
                 break
             considered_conv_turn.append(conv_turn)
-            batch_snippets.extend(
-                sum([info.snippets for info in conv_turn.raw_retrieved_info], [])
+        unused_information_per_turn = [
+            self._get_conv_turn_unused_information(
+                conv_turn=conv_turn, knowledge_base=knowledge_base
             )
-            batch_snippets.append(conv_turn.claim_to_make)
-            batch_snippets.extend(conv_turn.queries)
-        cache = knowledge_base.embedding_cache
-        get_text_embeddings(batch_snippets, embedding_cache=cache, max_workers=300)
+            for conv_turn in considered_conv_turn
+        ]
+
+        # batch encode all related strings in one fetch
+        batch_texts = []
+        for conv_turn, unused_information in zip(
+            considered_conv_turn, unused_information_per_turn
+        ):
+            batch_texts.extend(info.snippets[0] for info in unused_information)
+            if conv_turn.claim_to_make:
+                batch_texts.append(conv_turn.claim_to_make)
+            batch_texts.extend(conv_turn.queries)
+        batch_texts = list(dict.fromkeys(batch_texts))
+        batch_embeddings = get_normalized_text_embedding_matrix(
+            batch_texts,
+            max_workers=300,
+            embedding_cache=knowledge_base.embedding_cache,
+        )
+        text_to_embedding = dict(zip(batch_texts, batch_embeddings))
+        cited_snippets_embedding = knowledge_base.get_cited_snippets_embedding()
 
         # get sorted unused snippets for each turn
         sorted_snippets = []
-        for conv_turn in considered_conv_turn:
+        for conv_turn, unused_information in zip(
+            considered_conv_turn, unused_information_per_turn
+        ):
             sorted_snippets.append(
-                self._get_conv_turn_unused_information(
-                    conv_turn=conv_turn, knowledge_base=knowledge_base
+                self._rank_conv_turn_unused_information(
+                    conv_turn=conv_turn,
+                    unused_information=unused_information,
+                    text_to_embedding=text_to_embedding,
+                    cited_snippets_embedding=cited_snippets_embedding,
                 )
             )
 
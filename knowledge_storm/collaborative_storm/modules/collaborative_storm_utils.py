@@ -3,12 +3,13 @@ import os
 import re
 import sys
 import toml
-from typing import List, Tuple, Dict, Optional, TYPE_CHECKING
+from typing import List, Tuple, Dict, Optional, Union, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from ..engine import RunnerArgument
 from ...interface import Information, Retriever, LMConfigs
 from ...logging_wrapper import LoggingWrapper
+from ...prompt_budget import PromptPacker
 from ...rm import BingSearch
 
 
@@ -35,52 +36,51 @@ def extract_storm_info_snippet(info: Information, snippet_index: int) -> Informa
 
 def format_search_results(
     searched_results: List[Information],
-    info_max_num_words: int = 1000,
+    info_max_num_tokens: int = 1300,
     mode: str = "brief",
+    lm: Optional[Union[dspy.dsp.LM, dspy.dsp.HFModel]] = None,
 ) -> Tuple[str, Dict[int, Information]]:
     """
-    Constructs a string from a list of search results with a specified word limit and returns a mapping of indices to Information.
+    Constructs a string from a list of search results within a token budget and returns a mapping of indices to Information.
 
     Args:
         searched_results (List[Information]): List of Information objects to process.
-        info_max_num_words (int, optional): Maximum number of words allowed in the output string. Defaults to 1000.
+        info_max_num_tokens (int, optional): Maximum number of tokens allowed in the output string. Defaults to 1300.
         mode (str, optional): Mode of summarization. 'brief' takes only the first snippet of each Information.
-                                'extensive' adds snippets iteratively until the word limit is reached. Defaults to 'brief'.
+                                'extensive' adds snippets iteratively until the token budget is reached. Defaults to 'brief'.
+        lm (optional): The LM the output is sent to. If provided, the budget is capped by its context window.
 
     Returns:
         Tuple[str, Dict[int, Information]]:
-            - Formatted string with search results, constrained by the word limit.
+            - Formatted string with search results, constrained by the token budget.
             - Dictionary mapping indices to the corresponding Information objects.
     """
-    total_length = 0
-
-    extracted_snippet_queue = []
     max_snippets = (
         max(len(info.snippets) for info in searched_results) if searched_results else 0
     )
     max_snippets = 1 if mode == "brief" else max_snippets
-    abort = False
+    # the i-th snippets of all results come before the (i+1)-th snippets
+    candidates = []
     included_snippets = set()
     for i in range(max_snippets):
         for info in searched_results:
-            if i < len(info.snippets) and not abort:
-                cur_snippet = info.snippets[i]
-                cur_snippet_len = len(info.snippets[i].split())
-                if total_length + cur_snippet_len > info_max_num_words:
-                    abort = True
-                    break
-                if cur_snippet not in included_snippets:
-                    included_snippets.add(cur_snippet)
-                    info = extract_storm_info_snippet(info, snippet_index=i)
-                    extracted_snippet_queue.append(info)
-                    total_length += cur_snippet_len
-    output = []
-    index_mapping = {}
-    for idx, info in enumerate(extracted_snippet_queue):
-        output.append(f"[{idx + 1}]: {info.snippets[0]}")
-        index_mapping[idx + 1] = info
-    assert -1 not in index_mapping
-    return "\n".join(output), index_mapping
+            if i < len(info.snippets) and info.snippets[i] not in included_snippets:
+                included_snippets.add(info.snippets[i])
+                candidates.append((info, i))
+    segments = [
+        f"[{idx + 1}]: {info.snippets[i]}" for idx, (info, i) in enumerate(candidates)
+    ]
+    if lm is not None:
+        packer = PromptPacker.for_lm(lm, max_tokens=info_max_num_tokens)
+    else:
+        packer = PromptPacker(max_tokens=info_max_num_tokens)
+    # candidates are selected in order, so the selected ones keep their indices
+    num_selected = len(packer.select(segments))
+    index_mapping = {
+        idx + 1: extract_storm_info_snippet(info, snippet_index=i)
+        for idx, (info, i) in enumerate(candidates[:num_selected])
+    }
+    return "\n".join(segments[:num_selected]), index_mapping
 
 
 def extract_cited_storm_info(
@@ -251,7 +251,12 @@ def _get_answer_question_module_instance(
     # configure retriever
     if rm is None:
         rm = BingSearch(k=runner_argument.retrieve_top_k)
-    retriever = Retriever(rm=rm, max_thread=runner_argument.max_search_thread)
+    retriever = Retriever(
+        rm=rm,
+        max_thread=runner_argument.max_search_thread,
+        min_query_fraction=runner_argument.retrieve_min_query_fraction,
+        timeout=runner_argument.retrieve_timeout,
+    )
     # return AnswerQuestionModule instance
     return AnswerQuestionModule(
         retriever=retriever,
@@ -9,6 +9,7 @@ from .collaborative_storm_utils import (
     separate_citations,
 )
 from ...logging_wrapper import LoggingWrapper
+from ...prompt_budget import count_tokens
 from ...utils import ArticleTextProcessing
 from ...interface import Information
 
@@ -62,11 +63,15 @@ class AnswerQuestionModule(dspy.Module):
         self.retriever = retriever
         self.max_search_queries = max_search_queries
         self.logging_wrapper = logging_wrapper
+        self.model_name = (getattr(question_answering_lm, "kwargs", None) or {}).get(
+            "model"
+        )
 
     def retrieve_information(self, topic, question):
         # decompose question to queries
         with self.logging_wrapper.log_event(
-            f"AnswerQuestionModule.question_to_query ({hash(question)})"
+            f"AnswerQuestionModule.question_to_query ({hash(question)})",
+            model=self.model_name,
         ):
             with dspy.settings.context(lm=self.question_answering_lm):
                 queries = self.question_to_query(topic=topic, question=question).queries
@@ -84,6 +89,14 @@ class AnswerQuestionModule(dspy.Module):
             searched_results: List[Information] = self.retriever.retrieve(
                 list(set(queries)), exclude_urls=[]
             )
+            self.logging_wrapper.add_span_attributes(
+                result_count=len(searched_results),
+                bytes=sum(
+                    len(snippet.encode("utf-8"))
+                    for storm_info in searched_results
+                    for snippet in storm_info.snippets
+                ),
+            )
         # update storm information meta to include the question
         for storm_info in searched_results:
             storm_info.meta["question"] = question
@@ -124,13 +137,15 @@ class AnswerQuestionModule(dspy.Module):
             callback_handler.on_expert_information_collection_end(searched_results)
         # format information string for answer generation
         info_text, index_to_information_mapping = format_search_results(
-            searched_results, mode=mode
+            searched_results, mode=mode, lm=self.question_answering_lm
         )
         answer = "Sorry, there is insufficient information to answer the question."
         # generate answer to the question
         if info_text:
             with self.logging_wrapper.log_event(
-                f"AnswerQuestionModule.answer_question ({hash(question)})"
+                f"AnswerQuestionModule.answer_question ({hash(question)})",
+                model=self.model_name,
+                info_tokens=count_tokens(info_text, self.model_name),
             ):
                 with dspy.settings.context(
                     lm=self.question_answering_lm, show_guidelines=False
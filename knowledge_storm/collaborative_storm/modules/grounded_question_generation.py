@@ -86,7 +86,7 @@ class GroundedQuestionGenerationModule(dspy.Module):
         unused_snippets: List[Information],
     ):
         information, index_to_information_mapping = format_search_results(
-            unused_snippets, info_max_num_words=1000
+            unused_snippets, info_max_num_tokens=1300, lm=self.engine
         )
         summary = knowledge_base.get_knowledge_base_summary()
         last_utterance, _ = extract_and_remove_citations(last_conv_turn.utterance)
@@ -1,6 +1,7 @@
 import dspy
 import numpy as np
 import re
+import threading
 import traceback
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -51,10 +52,37 @@ class InsertInformationCandidateChoice(dspy.Signature):
 
 
 class InsertInformationModule(dspy.Module):
-    def __init__(self, engine: Union[dspy.dsp.LM, dspy.dsp.HFModel]):
+    def __init__(
+        self,
+        engine: Union[dspy.dsp.LM, dspy.dsp.HFModel],
+        placement_similarity_threshold: float = 0.7,
+        placement_margin_threshold: float = 0.1,
+    ):
+        """
+        Args:
+            engine: The LM used for placement decisions.
+            placement_similarity_threshold: Minimum cosine similarity between the information intent and
+                the top ranked node for the information to be placed by embedding ranking alone.
+            placement_margin_threshold: Minimum similarity gap between the top and the second ranked node
+                for the information to be placed by embedding ranking alone.
+        """
         self.engine = engine
         self.insert_info = dspy.ChainOfThought(InsertInformation)
         self.candidate_choosing = dspy.Predict(InsertInformationCandidateChoice)
+        self.placement_similarity_threshold = placement_similarity_threshold
+        self.placement_margin_threshold = placement_margin_threshold
+        self.placement_stats = {"embedding_only_count": 0, "lm_choice_count": 0}
+        self._placement_stats_lock = threading.Lock()
+
+    def _add_placement_stats(self, key: str):
+        with self._placement_stats_lock:
+            self.placement_stats[key] += 1
+
+    def get_placement_stats_and_reset(self) -> Dict[str, int]:
+        with self._placement_stats_lock:
+            placement_stats = self.placement_stats
+            self.placement_stats = {"embedding_only_count": 0, "lm_choice_count": 0}
+        return placement_stats
 
     def _construct_intent(self, question: str, query: str):
         intent = ""
@@ -151,15 +179,27 @@ class InsertInformationModule(dspy.Module):
         outlines: List[str],
         question: str,
         query: str,
+        embedding_cache: Optional[Dict[str, np.ndarray]] = None,
     ):
         if encoded_outline is not None and encoded_outline.size > 0:
-            encoded_query, token_usage = get_text_embeddings(f"{question}, {query}")
+            encoded_query, token_usage = get_text_embeddings(
+                f"{question}, {query}", embedding_cache=embedding_cache
+            )
             sim = cosine_similarity([encoded_query], encoded_outline)[0]
-            sorted_indices = np.argsort(sim)
-            sorted_outlines = np.array(outlines)[sorted_indices[::-1]]
-            return sorted_outlines
+            sorted_indices = np.argsort(sim)[::-1]
+            sorted_outlines = np.array(outlines)[sorted_indices]
+            return sorted_outlines, sim[sorted_indices]
         else:
-            return outlines
+            return outlines, None
+
+    def _is_confident_embedding_placement(self, sorted_sim: Optional[np.ndarray]):
+        if sorted_sim is None or len(sorted_sim) == 0:
+            return False
+        if sorted_sim[0] < self.placement_similarity_threshold:
+            return False
+        if len(sorted_sim) == 1:
+            return True
+        return sorted_sim[0] - sorted_sim[1] >= self.placement_margin_threshold
 
     def _parse_selected_index(self, string: str):
         match = re.search(r"\[(\d+)\]", string)
@@ -178,10 +218,19 @@ class InsertInformationModule(dspy.Module):
         encoded_outlines: np.ndarray,
         outlines: List[str],
         top_N_candidates: int = 5,
+        embedding_cache: Optional[Dict[str, np.ndarray]] = None,
     ):
-        sorted_candidates = self._get_sorted_embed_sim_section(
-            encoded_outlines, outlines, question, query
+        sorted_candidates, sorted_sim = self._get_sorted_embed_sim_section(
+            encoded_outlines, outlines, question, query, embedding_cache
         )
+        # skip the LM call when the nearest node is a clear winner
+        if self._is_confident_embedding_placement(sorted_sim):
+            self._add_placement_stats("embedding_only_count")
+            return dspy.Prediction(
+                information_placement=sorted_candidates[0],
+                note=f"Embedding only placement with similarity {sorted_sim[0]:.4f}",
+            )
+        self._add_placement_stats("lm_choice_count")
         considered_candidates = sorted_candidates[
             : min(len(sorted_candidates), top_N_candidates)
         ]
@@ -209,6 +258,22 @@ class InsertInformationModule(dspy.Module):
                         )
             return None
 
+    def prefetch_intent_embeddings(
+        self,
+        information: List[Information],
+        embedding_cache: Dict[str, np.ndarray],
+    ):
+        """
+        Encodes the intents of information ahead of insertion so that embedding ranking during placement is served from the cache.
+        """
+        intents = [
+            f"{question}, {query}"
+            for question, query in self._info_list_to_intent_mapping(information)
+        ]
+        intents = [intent for intent in intents if intent not in embedding_cache]
+        if intents:
+            get_text_embeddings(intents, embedding_cache=embedding_cache)
+
     def _info_list_to_intent_mapping(self, information_list: List[Information]):
         intent_to_placement_dict = {}
         for info in information_list:
@@ -244,6 +309,7 @@ class InsertInformationModule(dspy.Module):
                         encoded_outlines=encoded_outlines,
                         outlines=outlines,
                         top_N_candidates=8,
+                        embedding_cache=knowledge_base.embedding_cache,
                     )
                 if candidate_placement is None:
                     candidate_placement = self.layer_by_layer_navigation_placement(
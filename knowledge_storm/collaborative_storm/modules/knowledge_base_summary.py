@@ -1,5 +1,5 @@
 import dspy
-from typing import Union
+from typing import List, Optional, Union
 from ...dataclass import KnowledgeBase
 
 
@@ -13,12 +13,40 @@ class KnowledgeBaseSummmary(dspy.Signature):
     output = dspy.OutputField(prefix="Now give brief summary:\n", format=str)
 
 
+class UpdateKnowledgeBaseSummary(dspy.Signature):
+    """Your job is to keep a brief summary of what's been discussed in a roundtable conversation up to date. Contents are thematically organized into hierarchical sections.
+    You will be presented with the previous summary and the sections added since then, where each new section is given as its path from the top-level section.
+    Update the previous summary so that it also covers the new sections. Keep it brief.
+    """
+
+    topic = dspy.InputField(prefix="topic: ", format=str)
+    previous_summary = dspy.InputField(prefix="Previous summary: \n", format=str)
+    new_sections = dspy.InputField(prefix="New sections: \n", format=str)
+    output = dspy.OutputField(
+        prefix="Now give the updated brief summary:\n", format=str
+    )
+
+
 class KnowledgeBaseSummaryModule(dspy.Module):
     def __init__(self, engine: Union[dspy.dsp.LM, dspy.dsp.HFModel]):
         self.engine = engine
         self.gen_summary = dspy.Predict(KnowledgeBaseSummmary)
+        self.update_summary = dspy.Predict(UpdateKnowledgeBaseSummary)
 
-    def forward(self, knowledge_base: KnowledgeBase):
+    def forward(
+        self,
+        knowledge_base: KnowledgeBase,
+        previous_summary: Optional[str] = None,
+        new_node_paths: Optional[List[str]] = None,
+    ):
+        if previous_summary is not None and new_node_paths is not None:
+            with dspy.settings.context(lm=self.engine, show_guidelines=False):
+                summary = self.update_summary(
+                    topic=knowledge_base.topic,
+                    previous_summary=previous_summary,
+                    new_sections="\n".join(new_node_paths),
+                ).output
+            return summary
         structure = knowledge_base.get_node_hierarchy_string(
             include_indent=False,
             include_full_path=False,
@@ -10,14 +10,20 @@ The synthesized conversation is presented to the user to help them quickly catch
 
 import dspy
 import concurrent.futures
+import logging
 from threading import Lock
-from typing import List, Optional, Union, TYPE_CHECKING
+from typing import Callable, List, Optional, Union, TYPE_CHECKING
 
 from .callback import BaseCallbackHandler
 from .collaborative_storm_utils import _get_answer_question_module_instance
 from .expert_generation import GenerateExpertModule
 from .grounded_question_answering import AnswerQuestionModule
 from ...dataclass import ConversationTurn, KnowledgeBase
+from ...deadline import (
+    DeadlineThreadPoolExecutor,
+    as_completed_within_deadline,
+    get_remaining_seconds,
+)
 from ...interface import LMConfigs
 from ...logging_wrapper import LoggingWrapper
 from ...storm_wiki.modules.outline_generation import WritePageOutline
@@ -27,6 +33,8 @@ from ...utils import ArticleTextProcessing as AP
 if TYPE_CHECKING:
     from ..engine import RunnerArgument
 
+logger = logging.getLogger(__name__)
+
 
 class WarmStartModerator(dspy.Signature):
     """
@@ -72,8 +80,17 @@ class ReportToConversation(dspy.Module):
         self.engine = engine
         self.section_to_conv_transcript = dspy.Predict(SectionToConvTranscript)
 
-    def forward(self, knowledge_base: KnowledgeBase):
+    def forward(self, knowledge_base: KnowledgeBase, synthesize_sections: bool = False):
+        """
+        Args:
+            knowledge_base (KnowledgeBase): The knowledge base whose sections are turned into conversation.
+            synthesize_sections (bool): If True, write the report section of each node right before turning it
+                into conversation instead of relying on a previous `knowledge_base.to_report()` call.
+        """
+
         def process_node(node, topic):
+            if synthesize_sections:
+                knowledge_base.synthesize_section(node)
             with dspy.settings.context(lm=self.engine, show_guidelines=False):
                 output = self.section_to_conv_transcript(
                     topic=topic,
@@ -89,11 +106,11 @@ class ReportToConversation(dspy.Module):
         nodes = [node for node in nodes if node.name != "root" and node.content]
         topic = knowledge_base.topic
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        with DeadlineThreadPoolExecutor("report_to_conversation") as executor:
             future_to_node = {
                 executor.submit(process_node, node, topic): node for node in nodes
             }
-            for future in concurrent.futures.as_completed(future_to_node):
+            for future in as_completed_within_deadline(future_to_node, "sections"):
                 node = future_to_node[future]
                 question, answer = future.result()
                 conversations.append(
@@ -180,7 +197,16 @@ class WarmStartConversation(dspy.Module):
             cited_info=answer.cited_info,
         )
 
-    def forward(self, topic: str):
+    def forward(
+        self,
+        topic: str,
+        on_turn: Optional[Callable[[ConversationTurn], None]] = None,
+    ):
+        """
+        Args:
+            topic (str): The topic to research.
+            on_turn (Callable, optional): Called with each conversation turn as soon as it is produced.
+        """
         with self.logging_wrapper.log_event(
             "warm start, perspective guided QA: identify experts"
         ):
@@ -188,6 +214,8 @@ class WarmStartConversation(dspy.Module):
             experts, background_seeking_dialogue = self.generate_warmstart_experts(
                 topic=topic
             )
+        if on_turn is not None:
+            on_turn(background_seeking_dialogue)
         # init list to store the dialogue history
         conversation_history: List[ConversationTurn] = []
         lock = Lock()
@@ -197,7 +225,9 @@ class WarmStartConversation(dspy.Module):
             expert_name, expert_descriptoin = expert.split(":")
             for idx in range(self.max_turn_per_experts):
                 with self.logging_wrapper.log_event(
-                    f"warm start, perspective guided QA: expert {expert_name}; turn {idx + 1}"
+                    f"warm start, perspective guided QA: expert {expert_name}; turn {idx + 1}",
+                    expert=expert_name,
+                    turn=idx + 1,
                 ):
                     try:
                         with lock:
@@ -236,18 +266,25 @@ class WarmStartConversation(dspy.Module):
                             )
                         with lock:
                             conversation_history.append(conversation_turn)
+                        if on_turn is not None:
+                            on_turn(conversation_turn)
                     except Exception as e:
                         print(f"Error processing expert {expert}: {e}")
 
         # multi-thread conversation
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread
+        with DeadlineThreadPoolExecutor(
+            "warm_start_conversation", max_workers=self.max_thread
         ) as executor:
+            # keep the expert turns nested under the enclosing event in the trace
+            process_expert_in_span = self.logging_wrapper.bind_span_context(
+                process_expert
+            )
             futures = [
-                executor.submit(process_expert, expert)
+                executor.submit(process_expert_in_span, expert)
                 for expert in experts[: min(len(experts), self.max_num_experts)]
             ]
-            concurrent.futures.wait(futures)
+            # experts still talking at the deadline are left out
+            concurrent.futures.wait(futures, timeout=get_remaining_seconds())
 
         conversation_history = [background_seeking_dialogue] + conversation_history
 
@@ -298,9 +335,15 @@ class GenerateWarmStartOutlineModule(dspy.Module):
         with dspy.settings.context(lm=self.engine):
             return self.draft_outline(topic=topic).outline
 
-    def forward(self, topic: str, conv: List[ConversationTurn]):
+    def forward(
+        self,
+        topic: str,
+        conv: List[ConversationTurn],
+        draft_outline: Optional[str] = None,
+    ):
         discussion_history = self.extract_questions_and_queries(conv)
-        draft_outline = self.get_draft_outline(topic=topic)
+        if draft_outline is None:
+            draft_outline = self.get_draft_outline(topic=topic)
         with dspy.settings.context(lm=self.engine):
             outline = self.gen_outline(
                 topic=topic, draft=draft_outline, conv=discussion_history
@@ -309,6 +352,13 @@ class GenerateWarmStartOutlineModule(dspy.Module):
         return dspy.Prediction(outline=outline, draft_outline=draft_outline)
 
 
+def _log_prefetch_error(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(
+            f"Failed to prefetch warm start embeddings: {future.exception()}"
+        )
+
+
 class WarmStartModule:
     def __init__(
         self,
@@ -359,15 +409,42 @@ class WarmStartModule:
         """
         warm_start_conversation_history: List[ConversationTurn] = []
         warm_start_experts = None
-        # get warm start conversations
-        with self.logging_wrapper.log_event("warm start: perspective guided QA"):
-            if self.callback_handler is not None:
-                self.callback_handler.on_warmstart_update(
-                    message="Start getting familiar with the topic by chatting with multiple LLM experts (Step 1 / 4)"
+        draft_outline_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # prefetches only warm the embedding cache, so outline generation does not wait for them
+        prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            # the draft outline only depends on the topic, write it during the research
+            draft_outline_future = draft_outline_executor.submit(
+                self.warmstart_outline_gen_module.get_draft_outline, topic=topic
+            )
+
+            # encode the intents of collected information as each turn lands so that
+            # the insertion after outline generation mostly reads cached embeddings
+            def prefetch_turn_embeddings(conv_turn: ConversationTurn):
+                prefetch_future = prefetch_executor.submit(
+                    knowledge_base.prefetch_conv_turn_embeddings, conv_turn
+                )
+                prefetch_future.add_done_callback(_log_prefetch_error)
+
+            # get warm start conversations
+            with self.logging_wrapper.log_event("warm start: perspective guided QA"):
+                if self.callback_handler is not None:
+                    self.callback_handler.on_warmstart_update(
+                        message="Start getting familiar with the topic by chatting with multiple LLM experts (Step 1 / 4)"
+                    )
+                warm_start_result = self.warmstart_conv(
+                    topic=topic, on_turn=prefetch_turn_embeddings
                 )
-            warm_start_result = self.warmstart_conv(topic=topic)
-            warm_start_conversation_history = warm_start_result.conversation_history
-            warm_start_experts = warm_start_result.experts
+                warm_start_conversation_history = warm_start_result.conversation_history
+                warm_start_experts = warm_start_result.experts
+            try:
+                draft_outline = draft_outline_future.result()
+            except Exception as e:
+                print(f"Error generating draft outline: {e}")
+                draft_outline = None
+        finally:
+            draft_outline_executor.shutdown(wait=False)
+            prefetch_executor.shutdown(wait=False)
 
         # get warm start conv outline
         with self.logging_wrapper.log_event("warm start: outline generation"):
@@ -376,7 +453,9 @@ class WarmStartModule:
                     "Organizing collected information (Step 2 / 4)"
                 )
             warm_start_outline_output = self.warmstart_outline_gen_module(
-                topic=topic, conv=warm_start_conversation_history
+                topic=topic,
+                conv=warm_start_conversation_history,
+                draft_outline=draft_outline,
             )
         # init knowledge base
         with self.logging_wrapper.log_event("warm start: insert into knowledge base"):
@@ -397,10 +476,10 @@ class WarmStartModule:
             self.callback_handler.on_warmstart_update(
                 "Synthesizing background information discussion utterances (Step 4 / 4)"
             )
-        knowledge_base.to_report()
-
-        # generate engaging conversations
-        engaging_conversations = self.report_to_conversation(knowledge_base)
+        # turn each section into engaging conversation as soon as it is written
+        engaging_conversations = self.report_to_conversation(
+            knowledge_base, synthesize_sections=True
+        )
         return (
             warm_start_conversation_history,
             engaging_conversations,
@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import dspy
+
+from .engine import CoStormRunner, CollaborativeStormLMConfigs, RunnerArgument
+from .modules.callback import BaseCallbackHandler
+from .warmstart_store import WarmStartSnapshotStore
+from ..dataclass import ConversationTurn
+from ..logging_wrapper import LoggingWrapper
+
+
+class CoStormSessionManager:
+    """
+    Hosts multiple Co-STORM sessions in one process.
+
+    Active sessions are kept in memory in least recently used order. When the number of sessions in memory exceeds
+    `max_active_sessions`, or their estimated size exceeds `memory_budget_bytes`, the least recently used idle sessions
+    are spilled to `spill_dir` with `CoStormRunner.to_dict` and rehydrated with `CoStormRunner.from_dict` on next access.
+
+    LM clients, the retrieval module and the optional warm start snapshot store are shared by all sessions instead of
+    being rebuilt per runner.
+    Since LM usage is collected per LM client, the usage reported by each session's LoggingWrapper is only exact when
+    sessions do not step concurrently. Logs that are not dumped with `dump_logging_and_reset` are dropped on spill.
+    """
+
+    def __init__(
+        self,
+        lm_config: CollaborativeStormLMConfigs,
+        spill_dir: str,
+        rm: Optional[dspy.Retrieve] = None,
+        max_active_sessions: int = 32,
+        memory_budget_bytes: Optional[int] = None,
+        warm_start_store: Optional[WarmStartSnapshotStore] = None,
+    ):
+        self.lm_config = lm_config
+        self.rm = rm
+        self.warm_start_store = warm_start_store
+        self.spill_dir = spill_dir
+        self.max_active_sessions = max_active_sessions
+        self.memory_budget_bytes = memory_budget_bytes
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._sessions: "OrderedDict[str, CoStormRunner]" = OrderedDict()
+        self._session_bytes: Dict[str, int] = {}
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._callback_handlers: Dict[str, Optional[BaseCallbackHandler]] = {}
+        self._lock = threading.Lock()
+
+    def _get_spill_path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def create_session(
+        self,
+        session_id: str,
+        runner_argument: RunnerArgument,
+        callback_handler: Optional[BaseCallbackHandler] = None,
+    ) -> CoStormRunner:
+        with self._lock:
+            if session_id in self._session_locks:
+                raise ValueError(f"Session {session_id} already exists.")
+            costorm_runner = CoStormRunner(
+                lm_config=self.lm_config,
+                runner_argument=runner_argument,
+                logging_wrapper=LoggingWrapper(self.lm_config),
+                rm=self.rm,
+                callback_handler=callback_handler,
+                warm_start_store=self.warm_start_store,
+            )
+            self._session_locks[session_id] = threading.Lock()
+            self._callback_handlers[session_id] = callback_handler
+            self._sessions[session_id] = costorm_runner
+            self._session_bytes[session_id] = 0
+        return costorm_runner
+
+    def has_session(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._session_locks
+
+    def list_active_sessions(self) -> List[str]:
+        with self._lock:
+            return list(self._sessions.keys())
+
+    @contextmanager
+    def session(self, session_id: str):
+        """
+        Gives exclusive access to the runner of a session, rehydrating it from disk if it was spilled.
+        Other idle sessions may be spilled when the access ends.
+        """
+        with self._lock:
+            if session_id not in self._session_locks:
+                raise KeyError(f"Session {session_id} does not exist.")
+            session_lock = self._session_locks[session_id]
+        with session_lock:
+            costorm_runner = self._acquire(session_id)
+            try:
+                yield costorm_runner
+            finally:
+                session_bytes = self._estimate_session_bytes(costorm_runner)
+                with self._lock:
+                    self._session_bytes[session_id] = session_bytes
+        self._spill_over_budget_sessions()
+
+    def warm_start(self, session_id: str):
+        with self.session(session_id) as costorm_runner:
+            costorm_runner.warm_start()
+
+    def step(
+        self,
+        session_id: str,
+        user_utterance: str = "",
+        simulate_user: bool = False,
+        simulate_user_intent: str = "",
+    ) -> ConversationTurn:
+        with self.session(session_id) as costorm_runner:
+            return costorm_runner.step(
+                user_utterance=user_utterance,
+                simulate_user=simulate_user,
+                simulate_user_intent=simulate_user_intent,
+            )
+
+    def generate_report(self, session_id: str) -> str:
+        with self.session(session_id) as costorm_runner:
+            return costorm_runner.generate_report()
+
+    def dump_logging_and_reset(self, session_id: str):
+        with self.session(session_id) as costorm_runner:
+            return costorm_runner.dump_logging_and_reset()
+
+    def spill(self, session_id: str):
+        """Writes the session to disk and releases it from memory."""
+        with self._lock:
+            session_lock = self._session_locks[session_id]
+        with session_lock:
+            self._spill(session_id)
+
+    def close_session(self, session_id: str):
+        """Removes the session from memory and disk."""
+        with self._lock:
+            session_lock = self._session_locks[session_id]
+        with session_lock:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+                self._session_bytes.pop(session_id, None)
+                self._session_locks.pop(session_id, None)
+                self._callback_handlers.pop(session_id, None)
+            if os.path.exists(self._get_spill_path(session_id)):
+                os.remove(self._get_spill_path(session_id))
+
+    def _acquire(self, session_id: str) -> CoStormRunner:
+        # the caller holds the session lock
+        with self._lock:
+            costorm_runner = self._sessions.get(session_id)
+            if costorm_runner is not None:
+                self._sessions.move_to_end(session_id)
+                return costorm_runner
+            callback_handler = self._callback_handlers[session_id]
+        with open(self._get_spill_path(session_id), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        costorm_runner = CoStormRunner.from_dict(
+            data,
+            lm_config=self.lm_config,
+            rm=self.rm,
+            callback_handler=callback_handler,
+            warm_start_store=self.warm_start_store,
+        )
+        with self._lock:
+            self._sessions[session_id] = costorm_runner
+        return costorm_runner
+
+    def _spill(self, session_id: str):
+        # the caller holds the session lock
+        with self._lock:
+            costorm_runner = self._sessions.get(session_id)
+        if costorm_runner is None:
+            return
+        # pending background work would otherwise be lost or keep the runner alive
+        costorm_runner.close()
+        spill_path = self._get_spill_path(session_id)
+        tmp_path = f"{spill_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(costorm_runner.to_dict(), f)
+        os.replace(tmp_path, spill_path)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._session_bytes[session_id] = 0
+
+    def _is_over_budget(self) -> bool:
+        if len(self._sessions) > self.max_active_sessions:
+            return True
+        return (
+            self.memory_budget_bytes is not None
+            and sum(self._session_bytes.values()) > self.memory_budget_bytes
+        )
+
+    def _spill_over_budget_sessions(self):
+        with self._lock:
+            candidates = list(self._sessions.keys())
+        for session_id in candidates:
+            with self._lock:
+                if not self._is_over_budget():
+                    return
+                session_lock = self._session_locks.get(session_id)
+            # skip sessions that are in use
+            if session_lock is None or not session_lock.acquire(blocking=False):
+                continue
+            try:
+                self._spill(session_id)
+            finally:
+                session_lock.release()
+
+    @staticmethod
+    def _estimate_session_bytes(costorm_runner: CoStormRunner) -> int:
+        """Rough size of a session, dominated by collected text and cached embeddings."""
+        knowledge_base = costorm_runner.knowledge_base
+        num_bytes = sum(
+            len(snippet)
+            for info in knowledge_base.info_uuid_to_info_dict.values()
+            for snippet in info.snippets
+        )
+        num_bytes += sum(
+            getattr(embedding, "nbytes", 0)
+            for embedding in knowledge_base.embedding_cache.values()
+        )
+        for turn in costorm_runner.conversation_history:
+            num_bytes += len(turn.utterance or "") + len(turn.raw_utterance or "")
+            num_bytes += sum(
+                len(snippet)
+                for info in turn.raw_retrieved_info
+                for snippet in info.snippets
+            )
+        return num_bytes
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional
+
+import dspy
+
+if TYPE_CHECKING:
+    from .engine import CollaborativeStormLMConfigs, RunnerArgument
+
+
+class WarmStartSnapshotStore:
+    """
+    Stores the outcome of Co-STORM warm start so that new sessions on the same topic can skip it.
+
+    A snapshot holds the knowledge base (including the report sections synthesized during warm start), the warm start
+    conversation and the experts. Snapshots are keyed by the normalized topic, the runner arguments that affect warm
+    start, the LM configurations and the retrieval module's class and search settings, and expire after `ttl_seconds`. Every `load` builds new objects, so each session
+    works on its own fork of the snapshot. Up to `max_memory_entries` recently used snapshots are also kept parsed in
+    memory.
+
+    Usage:
+        warm_start_store = WarmStartSnapshotStore("warm_start_snapshots")
+        costorm_runner = CoStormRunner(..., warm_start_store=warm_start_store)
+        costorm_runner.warm_start()  # loads a matching snapshot or runs warm start and saves it
+    """
+
+    # runner arguments that change the outcome of warm start
+    WARM_START_ARGUMENT_FIELDS = (
+        "retrieve_top_k",
+        "max_search_queries",
+        "max_search_thread",
+        "retrieve_min_query_fraction",
+        "retrieve_timeout",
+        "warmstart_max_num_experts",
+        "warmstart_max_turn_per_experts",
+        "warmstart_max_thread",
+        "node_expansion_trigger_count",
+        "placement_similarity_threshold",
+        "placement_margin_threshold",
+        "rag_only_baseline_mode",
+    )
+    # retrieval module attributes that change search results; credentials and usage counters are left out
+    RM_CONFIG_FIELDS = (
+        "k",
+        "endpoint",
+        "base_url",
+        "params",
+        "query_params",
+        "collection_name",
+        "searxng_api_url",
+    )
+
+    def __init__(
+        self,
+        store_dir: str,
+        ttl_seconds: float = 24 * 60 * 60,
+        max_memory_entries: int = 32,
+    ):
+        self.store_dir = store_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        os.makedirs(self.store_dir, exist_ok=True)
+        # parsed snapshots in least recently used order, so that repeated loads do not read and parse the file again
+        self._memory_cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_topic(topic: str) -> str:
+        return re.sub(r"\s+", " ", topic).strip().lower()
+
+    @classmethod
+    def get_rm_config(cls, rm: Optional[dspy.Retrieve]) -> Optional[Dict]:
+        if rm is None:
+            return None
+        return {
+            "type": f"{type(rm).__module__}.{type(rm).__qualname__}",
+            **{
+                field_name: getattr(rm, field_name)
+                for field_name in cls.RM_CONFIG_FIELDS
+                if hasattr(rm, field_name)
+            },
+        }
+
+    def get_key(
+        self,
+        runner_argument: "RunnerArgument",
+        lm_config: "CollaborativeStormLMConfigs",
+        rm: Optional[dspy.Retrieve] = None,
+    ) -> str:
+        runner_argument_dict = runner_argument.to_dict()
+        key_data = {
+            "topic": self.normalize_topic(runner_argument.topic),
+            "runner_argument": {
+                field_name: runner_argument_dict.get(field_name)
+                for field_name in self.WARM_START_ARGUMENT_FIELDS
+            },
+            "lm_config": lm_config.to_dict(),
+            "rm": self.get_rm_config(rm),
+        }
+        key_string = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.store_dir, f"{key}.json")
+
+    def _is_expired(self, record: Dict) -> bool:
+        return time.time() - record["created_at"] > self.ttl_seconds
+
+    def _cache_in_memory(self, key: str, record: Dict):
+        # the caller holds the lock
+        self._memory_cache[key] = record
+        self._memory_cache.move_to_end(key)
+        while len(self._memory_cache) > self.max_memory_entries:
+            self._memory_cache.popitem(last=False)
+
+    def _evict_expired_from_memory(self):
+        # the caller holds the lock
+        for key in list(self._memory_cache.keys()):
+            if self._is_expired(self._memory_cache[key]):
+                del self._memory_cache[key]
+
+    def load(
+        self,
+        runner_argument: "RunnerArgument",
+        lm_config: "CollaborativeStormLMConfigs",
+        rm: Optional[dspy.Retrieve] = None,
+    ) -> Optional[Dict]:
+        """
+        Returns the snapshot matching the runner arguments, LM configurations and retrieval module, or None if there is
+        no valid one. The returned dict is shared; build new objects from it instead of modifying it.
+        """
+        key = self.get_key(runner_argument, lm_config, rm)
+        path = self._get_path(key)
+        with self._lock:
+            record = self._memory_cache.get(key)
+            if record is None and os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"Error loading warm start snapshot {path}: {e}")
+                    return None
+            if record is None:
+                return None
+            if self._is_expired(record):
+                self._memory_cache.pop(key, None)
+                if os.path.exists(path):
+                    os.remove(path)
+                return None
+            self._cache_in_memory(key, record)
+            return record["snapshot"]
+
+    def save(
+        self,
+        runner_argument: "RunnerArgument",
+        lm_config: "CollaborativeStormLMConfigs",
+        snapshot: Dict,
+        rm: Optional[dspy.Retrieve] = None,
+    ):
+        key = self.get_key(runner_argument, lm_config, rm)
+        record = {
+            "created_at": time.time(),
+            "topic": runner_argument.topic,
+            "snapshot": snapshot,
+        }
+        path = self._get_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._evict_expired_from_memory()
+            self._cache_in_memory(key, record)
+
+    def evict_expired(self):
+        """Removes expired snapshots from memory and disk."""
+        with self._lock:
+            self._evict_expired_from_memory()
+            for file_name in os.listdir(self.store_dir):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(self.store_dir, file_name)
+                if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
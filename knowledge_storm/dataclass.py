@@ -1,11 +1,13 @@
+import copy
 import dspy
 import numpy as np
 import re
 import threading
 from typing import Set, Dict, List, Optional, Union, Tuple
 
-from .encoder import get_text_embeddings
+from .encoder import get_text_embeddings, get_normalized_text_embedding_matrix
 from .interface import Information
+from .utils import ArticleTextProcessing
 
 
 class ConversationTurn:
@@ -310,12 +312,19 @@ class KnowledgeBase:
         topic: str,
         knowledge_base_lm: Union[dspy.dsp.LM, dspy.dsp.HFModel],
         node_expansion_trigger_count: int,
+        placement_similarity_threshold: float = 0.7,
+        placement_margin_threshold: float = 0.1,
+        incremental_summary: bool = False,
     ):
         """
         Initializes a KnowledgeBase instance.
 
         Args:
             topic (str): The topic of the knowledge base
+            placement_similarity_threshold (float): Minimum similarity for placing information by embedding ranking without LM call.
+            placement_margin_threshold (float): Minimum similarity margin over the second candidate for placing information by embedding ranking without LM call.
+            incremental_summary (bool): If True, refresh the knowledge base summary from the previous summary and the newly added nodes
+                when the structure only grew since the last summary.
             expand_node_module (dspy.Module): The module that organize knowledge base in place.
                 The module should accept knowledge base as param. E.g. expand_node_module(self)
             article_generation_module (dspy.Module): The module that generate report from knowledge base.
@@ -335,7 +344,9 @@ class KnowledgeBase:
         self.topic: str = topic
 
         self.information_insert_module = InsertInformationModule(
-            engine=knowledge_base_lm
+            engine=knowledge_base_lm,
+            placement_similarity_threshold=placement_similarity_threshold,
+            placement_margin_threshold=placement_margin_threshold,
         )
         self.expand_node_module = ExpandNodeModule(
             engine=knowledge_base_lm,
@@ -357,6 +368,29 @@ class KnowledgeBase:
         self.info_uuid_to_info_dict: Dict[int, Information] = {}
         self.info_hash_to_uuid_dict: Dict[int, int] = {}
         self._lock = threading.Lock()
+        # normalized embeddings of cited snippets, extended lazily with newly cited information; the first
+        # `_cited_snippets_embedding_size` rows are filled and the capacity is doubled when it runs out
+        self._cited_snippets_embedding: Optional[np.ndarray] = None
+        self._cited_snippets_embedding_size = 0
+        self._pending_cited_info_uuids: List[int] = []
+        self._cited_snippets_embedding_lock = threading.Lock()
+        # journal of tree mutations consumed by incremental checkpointing, disabled when None
+        self._mutation_log: Optional[List[Tuple]] = None
+        self._mutation_log_needs_tree_snapshot = False
+        # uuids of information cited since the last `pop_new_info_uuids`, journaled along with the mutations
+        self._new_info_uuids: List[int] = []
+        # bumped whenever nodes are added, removed or moved; the summary is cached per version
+        self._structure_version = 0
+        self.incremental_summary = incremental_summary
+        self._summary_cache: Optional[Tuple[int, str, Set[str]]] = None
+        self._summary_lock = threading.Lock()
+        # mutations made while a snapshot is reorganized in the background, None if disabled
+        self._reorganize_journal: Optional[List[Tuple]] = None
+
+    @property
+    def structure_version(self) -> int:
+        """Version of the tree structure. Inserting information under existing nodes does not change it."""
+        return self._structure_version
 
     def to_dict(self):
         info_uuid_to_info_dict = {
@@ -375,11 +409,17 @@ class KnowledgeBase:
         data: Dict,
         knowledge_base_lm: Union[dspy.dsp.LM, dspy.dsp.HFModel],
         node_expansion_trigger_count: int,
+        placement_similarity_threshold: float = 0.7,
+        placement_margin_threshold: float = 0.1,
+        incremental_summary: bool = False,
     ):
         knowledge_base = cls(
             topic=data["topic"],
             knowledge_base_lm=knowledge_base_lm,
             node_expansion_trigger_count=node_expansion_trigger_count,
+            placement_similarity_threshold=placement_similarity_threshold,
+            placement_margin_threshold=placement_margin_threshold,
+            incremental_summary=incremental_summary,
         )
         knowledge_base.root = KnowledgeNode.from_dict(data["tree"])
         knowledge_base.info_hash_to_uuid_dict = {
@@ -391,8 +431,147 @@ class KnowledgeBase:
             for key, value in data["info_uuid_to_info_dict"].items()
         }
         knowledge_base.info_uuid_to_info_dict = info_uuid_to_info_dict
+        knowledge_base._pending_cited_info_uuids = sorted(info_uuid_to_info_dict)
         return knowledge_base
 
+    def enable_mutation_log(self):
+        """
+        Starts journaling tree mutations. Node creations and information insertions are recorded as operations
+        that can be replayed with `apply_mutation_log`. Bulk restructuring (e.g. reorganize) is recorded as a flag
+        telling the consumer to store a full tree snapshot instead.
+        """
+        with self._lock:
+            self._mutation_log = []
+            self._mutation_log_needs_tree_snapshot = False
+            self._new_info_uuids = []
+
+    def pop_mutation_log(self) -> Tuple[List[Tuple], bool]:
+        """
+        Returns the journaled operations since the last call and whether a full tree snapshot is needed, then resets the journal.
+        """
+        with self._lock:
+            mutation_log = self._mutation_log or []
+            needs_tree_snapshot = self._mutation_log_needs_tree_snapshot
+            if self._mutation_log is not None:
+                self._mutation_log = []
+            self._mutation_log_needs_tree_snapshot = False
+        return mutation_log, needs_tree_snapshot
+
+    def pop_new_info_uuids(self) -> List[int]:
+        """
+        Returns the uuids of the information cited since the last call while the mutation log is enabled, then resets
+        them. Call it after `pop_mutation_log` so that every information referenced by the popped operations is included.
+        """
+        with self._lock:
+            new_info_uuids = self._new_info_uuids
+            self._new_info_uuids = []
+        return new_info_uuids
+
+    def apply_mutation_log(self, mutation_log: List[Tuple]):
+        """
+        Replays journaled operations produced by `pop_mutation_log`.
+        Information referenced by the operations must already be in `info_uuid_to_info_dict`.
+        """
+        for operation in mutation_log:
+            if operation[0] == "add_node":
+                _, parent_path, node_name, duplicate_handling = operation
+                parent_node = self.find_node_by_path(
+                    path=parent_path, missing_node_handling="create"
+                )
+                self.insert_node(
+                    node_name,
+                    parent_node=parent_node,
+                    duplicate_handling=duplicate_handling,
+                )
+            elif operation[0] == "insert":
+                _, path, citation_uuid = operation
+                self.insert_information(
+                    path=path,
+                    information=self.info_uuid_to_info_dict[citation_uuid],
+                    missing_node_handling="create",
+                )
+            else:
+                raise ValueError(f"Unknown mutation log operation: {operation[0]}")
+
+    def restore_information(self, citation_uuid: int, information: Information):
+        """
+        Registers already cited information (e.g. loaded from a checkpoint) without placing it in the tree.
+        """
+        with self._lock:
+            information.citation_uuid = citation_uuid
+            if citation_uuid not in self.info_uuid_to_info_dict:
+                self._pending_cited_info_uuids.append(citation_uuid)
+                self._log_new_info(citation_uuid)
+            self.info_uuid_to_info_dict[citation_uuid] = information
+            self.info_hash_to_uuid_dict[hash(information)] = citation_uuid
+
+    def _log_new_info(self, citation_uuid: int):
+        if self._mutation_log is not None:
+            self._new_info_uuids.append(citation_uuid)
+
+    def _log_mutation(self, operation: Tuple):
+        if self._mutation_log is not None:
+            self._mutation_log.append(operation)
+        if self._reorganize_journal is not None:
+            self._reorganize_journal.append(operation)
+
+    def get_reorganize_snapshot(self) -> "KnowledgeBase":
+        """
+        Returns a copy of the knowledge base that can be reorganized off the critical path with `snapshot.reorganize()`.
+
+        The copy owns its tree and information objects and shares the LM modules and the embedding cache. Until the snapshot
+        is applied with `apply_reorganized_snapshot` or dropped with `discard_reorganize_snapshot`, node creations and
+        information insertions on this knowledge base are journaled so that they can be replayed on the reorganized tree.
+        """
+        with self._lock:
+            snapshot = copy.copy(self)
+            snapshot.root = KnowledgeNode.from_dict(self.root.to_dict())
+            snapshot.info_uuid_to_info_dict = {}
+            for citation_uuid, info in self.info_uuid_to_info_dict.items():
+                info_copy = Information.from_dict(info.to_dict())
+                info_copy.citation_uuid = citation_uuid
+                snapshot.info_uuid_to_info_dict[citation_uuid] = info_copy
+            snapshot.info_hash_to_uuid_dict = dict(self.info_hash_to_uuid_dict)
+            snapshot._lock = threading.Lock()
+            snapshot._cited_snippets_embedding = None
+            snapshot._cited_snippets_embedding_size = 0
+            snapshot._pending_cited_info_uuids = []
+            snapshot._cited_snippets_embedding_lock = threading.Lock()
+            snapshot._mutation_log = None
+            snapshot._mutation_log_needs_tree_snapshot = False
+            snapshot._new_info_uuids = []
+            snapshot._summary_cache = None
+            snapshot._summary_lock = threading.Lock()
+            snapshot._reorganize_journal = None
+            self._reorganize_journal = []
+        return snapshot
+
+    def apply_reorganized_snapshot(self, snapshot: "KnowledgeBase"):
+        """
+        Swaps in the tree of a snapshot returned by `get_reorganize_snapshot` and replays the mutations made since the
+        snapshot was taken. Insertions under nodes that were removed by the reorganization recreate those nodes.
+        """
+        with self._lock:
+            reorganize_journal = self._reorganize_journal or []
+            self._reorganize_journal = None
+            self.root = snapshot.root
+            self._mark_structure_changed()
+        self.apply_mutation_log(reorganize_journal)
+        self.update_all_info_path()
+
+    def discard_reorganize_snapshot(self):
+        """Stops journaling mutations for a snapshot that will not be applied."""
+        with self._lock:
+            self._reorganize_journal = None
+
+    def _log_structure_change(self):
+        if self._mutation_log is not None:
+            self._mutation_log_needs_tree_snapshot = True
+
+    def _mark_structure_changed(self):
+        self._structure_version += 1
+        self._log_structure_change()
+
     def get_knowledge_base_structure_embedding(
         self, root: Optional[KnowledgeNode] = None
     ) -> Tuple[np.ndarray, List[str]]:
@@ -483,13 +662,19 @@ class KnowledgeBase:
             duplicate_handling (str): How to handle duplicate nodes. Options are "skip", "none", and "raise error".
         """
         if parent_node is None:
-            return self.root.add_child(
-                new_node_name, duplicate_handling=duplicate_handling
-            )
-        else:
-            return parent_node.add_child(
-                new_node_name, duplicate_handling=duplicate_handling
+            parent_node = self.root
+        self._structure_version += 1
+        self._log_mutation(
+            (
+                "add_node",
+                " -> ".join(parent_node.get_path_from_root()),
+                new_node_name,
+                duplicate_handling,
             )
+        )
+        return parent_node.add_child(
+            new_node_name, duplicate_handling=duplicate_handling
+        )
 
     def find_node(self, current_node, node_name):
         """
@@ -662,6 +847,7 @@ class KnowledgeBase:
                 if missing_node_handling == "abort":
                     return
                 elif missing_node_handling == "create":
+                    self._structure_version += 1
                     new_node = current_node.add_child(child_node_name=name)
                     current_node = new_node
                 elif missing_node_handling == "raise error":
@@ -705,18 +891,102 @@ class KnowledgeBase:
                 )
                 information.citation_uuid = info_citation_uuid
                 self.info_hash_to_uuid_dict[information_hash] = info_citation_uuid
+                if info_citation_uuid not in self.info_uuid_to_info_dict:
+                    self._pending_cited_info_uuids.append(info_citation_uuid)
+                    self._log_new_info(info_citation_uuid)
                 self.info_uuid_to_info_dict[info_citation_uuid] = information
             if target_node is not None:
                 self.info_uuid_to_info_dict[information.citation_uuid].meta[
                     "placement"
                 ] = " -> ".join(target_node.get_path_from_root())
                 target_node.insert_information(information.citation_uuid)
+                self._log_mutation(
+                    (
+                        "insert",
+                        " -> ".join(target_node.get_path_from_root()),
+                        information.citation_uuid,
+                    )
+                )
+
+    def is_information_cited(self, information: Information) -> bool:
+        """
+        Checks whether the information has been inserted into the knowledge base.
+        The lookup uses the hash index maintained by `insert_information` and takes constant time.
+        """
+        return hash(information) in self.info_hash_to_uuid_dict
+
+    def get_cited_snippets_embedding(self) -> np.ndarray:
+        """
+        Returns the L2-normalized embeddings of the first snippet of all cited information.
+
+        The matrix is maintained incrementally. Only information inserted since the last call is encoded and
+        appended to a buffer whose capacity grows geometrically, so the amortized cost of each call does not grow with
+        the size of the knowledge base. Information whose embedding could not be computed is encoded again in the next
+        call. The returned matrix is a view of the buffer and must not be modified.
+
+        Returns:
+            np.ndarray: The 2D array of normalized embeddings with one row per cited information.
+        """
+        with self._cited_snippets_embedding_lock:
+            with self._lock:
+                pending_uuids = self._pending_cited_info_uuids
+                self._pending_cited_info_uuids = []
+                pending_snippets = [
+                    self.info_uuid_to_info_dict[uuid].snippets[0]
+                    for uuid in pending_uuids
+                ]
+            if pending_snippets:
+                new_embedding = get_normalized_text_embedding_matrix(
+                    pending_snippets,
+                    max_workers=100,
+                    embedding_cache=self.embedding_cache,
+                )
+                # failed embeddings are zero rows; retry them in the next call
+                encoded = np.any(new_embedding != 0, axis=1)
+                failed_uuids = [
+                    uuid for uuid, ok in zip(pending_uuids, encoded) if not ok
+                ]
+                if failed_uuids:
+                    with self._lock:
+                        self._pending_cited_info_uuids = (
+                            failed_uuids + self._pending_cited_info_uuids
+                        )
+                self._append_cited_snippets_embedding(new_embedding[encoded])
+            if self._cited_snippets_embedding is None:
+                return np.zeros((0, 0))
+            return self._cited_snippets_embedding[: self._cited_snippets_embedding_size]
+
+    def _append_cited_snippets_embedding(self, new_embedding: np.ndarray):
+        if len(new_embedding) == 0:
+            return
+        size = self._cited_snippets_embedding_size
+        if self._cited_snippets_embedding is None:
+            self._cited_snippets_embedding = np.zeros(
+                (max(len(new_embedding), 16), new_embedding.shape[1])
+            )
+        elif size + len(new_embedding) > len(self._cited_snippets_embedding):
+            # rows up to `size` are never written again, so earlier views stay valid
+            buffer = np.zeros(
+                (
+                    max(
+                        2 * len(self._cited_snippets_embedding),
+                        size + len(new_embedding),
+                    ),
+                    self._cited_snippets_embedding.shape[1],
+                )
+            )
+            buffer[:size] = self._cited_snippets_embedding[:size]
+            self._cited_snippets_embedding = buffer
+        self._cited_snippets_embedding[size : size + len(new_embedding)] = new_embedding
+        self._cited_snippets_embedding_size = size + len(new_embedding)
 
     def trim_empty_leaf_nodes(self):
         """
         Trims all leaf nodes that do not have any content. Iteratively does it until all leaf nodes have at least one content.
         """
 
+        self._mark_structure_changed()
+
         def trim_node(node):
             if not node.children and not node.content:
                 return True
@@ -755,6 +1025,8 @@ class KnowledgeBase:
         Iteratively does this from leaf nodes back to the root.
         """
 
+        self._mark_structure_changed()
+
         def merge_node(node):
             # Recursively merge children first
             for child in node.children:
@@ -803,27 +1075,65 @@ class KnowledgeBase:
             old_idx: info.citation_uuid
             for old_idx, info in conv_turn.cited_info.items()
         }
-
-        for old_idx, new_idx in old_to_new_citation_idx_mapping.items():
-            conv_turn.utterance = conv_turn.utterance.replace(
-                f"[{old_idx}]", f"[_{new_idx}_]"
-            )
-            conv_turn.raw_utterance = conv_turn.raw_utterance.replace(
-                f"[{old_idx}]", f"[_{new_idx}_]"
-            )
-        for _, new_idx in old_to_new_citation_idx_mapping.items():
-            conv_turn.utterance = conv_turn.utterance.replace(
-                f"[_{new_idx}_]", f"[{new_idx}]"
-            )
-            conv_turn.utterance.replace("[-1]", "")
-            conv_turn.raw_utterance = conv_turn.raw_utterance.replace(
-                f"[_{new_idx}_]", f"[{new_idx}]"
-            )
-            conv_turn.raw_utterance.replace("[-1]", "")
+        conv_turn.utterance = ArticleTextProcessing.update_citation_index(
+            conv_turn.utterance, old_to_new_citation_idx_mapping
+        )
+        conv_turn.raw_utterance = ArticleTextProcessing.update_citation_index(
+            conv_turn.raw_utterance, old_to_new_citation_idx_mapping
+        )
         conv_turn.cited_info = None
 
+    def prefetch_conv_turn_embeddings(self, conv_turn: ConversationTurn):
+        """
+        Encodes the intents of the information cited in a turn before the turn is inserted, e.g. while the outline the
+        information will be placed into is still being generated.
+        """
+        if conv_turn is None or not conv_turn.cited_info:
+            return
+        self.information_insert_module.prefetch_intent_embeddings(
+            information=list(conv_turn.cited_info.values()),
+            embedding_cache=self.embedding_cache,
+        )
+
+    def collect_and_reset_placement_stats(self):
+        return self.information_insert_module.get_placement_stats_and_reset()
+
     def get_knowledge_base_summary(self):
-        return self.gen_summary_module(self)
+        """
+        Returns a brief summary of the knowledge base.
+
+        The summary only depends on the tree structure, so it is cached per `structure_version` and regenerated only after
+        nodes are added or removed. In incremental mode, a structure that only grew is summarized from the previous summary
+        and the new nodes instead of the full tree.
+        """
+        with self._summary_lock:
+            structure_version = self._structure_version
+            if self._summary_cache is not None:
+                cached_version, cached_summary, cached_node_paths = self._summary_cache
+                if cached_version == structure_version:
+                    return cached_summary
+            node_paths = {
+                " -> ".join(node.get_path_from_root()[1:])
+                for node in self.collect_all_nodes()
+                if node is not self.root
+            }
+            if (
+                self.incremental_summary
+                and self._summary_cache is not None
+                and cached_node_paths.issubset(node_paths)
+            ):
+                new_node_paths = [
+                    path for path in node_paths if path not in cached_node_paths
+                ]
+                summary = self.gen_summary_module(
+                    self,
+                    previous_summary=cached_summary,
+                    new_node_paths=sorted(new_node_paths),
+                )
+            else:
+                summary = self.gen_summary_module(self)
+            self._summary_cache = (structure_version, summary, node_paths)
+        return summary
 
     def reorganize(self):
         """
@@ -835,6 +1145,7 @@ class KnowledgeBase:
         2.Bottom-Up Cleaning: Cleans the knowledge base by removing empty leaf nodes (nodes with no supporting information)
           and merging nodes that have only a single child, simplifying the structure and maintaining clarity.
         """
+        self._mark_structure_changed()
         # pre-processing
         self.trim_empty_leaf_nodes()
         self.merge_single_child_nodes()
@@ -846,4 +1157,16 @@ class KnowledgeBase:
         self.update_all_info_path()
 
     def to_report(self):
+        # article generation caches synthesized section text on the nodes
+        self._log_structure_change()
         return self.article_generation_module(knowledge_base=self)
+
+    def synthesize_section(self, node: KnowledgeNode) -> str:
+        """
+        Writes the report section of a single node, as `to_report` does for every node, so that consumers of a section do
+        not have to wait for the full report.
+        """
+        self._log_structure_change()
+        return self.article_generation_module.gen_section(
+            topic=self.topic, node=node, knowledge_base=self
+        )
@@ -0,0 +1,227 @@
+"""
+Deadlines and cooperative cancellation for the STORM and Co-STORM pipelines.
+
+`deadline_scope(seconds)` sets a deadline for the enclosed code. Scopes nest, with the earlier deadline winning, so a
+per-stage deadline never outlives the per-run one. `STORMWikiRunner` sets them from the `run_timeout` and `stage_timeout`
+arguments; for Co-STORM, wrap `CoStormRunner.warm_start`, `step` or `generate_report` in a scope. The deadline is
+carried into worker threads by `DeadlineThreadPoolExecutor`. Within it:
+
+- LM wrappers, retrievers and `WebPageHelper` bound their HTTP timeouts and retry backoff by the remaining time.
+- LM calls raise `DeadlineExceeded` once the deadline passes, even if the endpoint is stuck. At most
+  `MAX_DEADLINE_CALL_THREADS` such calls run at a time, so abandoned calls cannot pile up threads.
+- Stages collect the tasks that finished in time with `as_completed_within_deadline` and continue without the rest.
+
+Cancellation is cooperative. Tasks that have not started are cancelled. Running tasks are abandoned and stop at their
+next deadline check, or when their bounded HTTP timeout fires, so a stuck endpoint cannot pin a worker indefinitely.
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from concurrent.futures import as_completed, wait
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+from .metrics import DEADLINE_EXCEEDED, InstrumentedThreadPoolExecutor
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when work is started or still running after the deadline of its scope."""
+
+
+class Deadline:
+    """A point in time (on the monotonic clock) by which the work of a scope should be done."""
+
+    def __init__(self, expires_at: float, name: str = ""):
+        self.expires_at = expires_at
+        self.name = name
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            DEADLINE_EXCEEDED.labels(scope=self.name).inc()
+            raise DeadlineExceeded(f"Deadline of {self.name or 'scope'} exceeded.")
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "storm_deadline", default=None
+)
+# the deadline that the enclosing `run_within_deadline` call already enforces, e.g. for the replicas of an LM pool
+_enforced_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "storm_enforced_deadline", default=None
+)
+
+# upper bound on the threads of LM calls under a deadline, including abandoned calls still waiting for their HTTP timeout
+MAX_DEADLINE_CALL_THREADS = 64
+_deadline_call_slots = threading.BoundedSemaphore(MAX_DEADLINE_CALL_THREADS)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def get_remaining_seconds() -> Optional[float]:
+    """Returns the seconds left before the current deadline, or None if there is no deadline."""
+    deadline = _current_deadline.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def check_deadline():
+    """Raises `DeadlineExceeded` if the current deadline has passed."""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], name: str = ""):
+    """
+    Runs the enclosed code with a deadline `seconds` from now, or the enclosing deadline if that is earlier. With
+    `seconds=None`, the enclosing deadline (if any) is kept. Yields the effective deadline.
+    """
+    parent = _current_deadline.get()
+    if seconds is None:
+        yield parent
+        return
+    deadline = Deadline(time.monotonic() + seconds, name)
+    if parent is not None and parent.expires_at <= deadline.expires_at:
+        deadline = parent
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def get_timeout(default: Optional[float] = None) -> Optional[float]:
+    """Returns the timeout for an HTTP request: `default` (None for no timeout) bounded by the time left."""
+    remaining = get_remaining_seconds()
+    if remaining is None:
+        return default
+    # HTTP clients reject a timeout of 0
+    remaining = max(remaining, 0.01)
+    return remaining if default is None else min(default, remaining)
+
+
+def backoff_max_time(default: float) -> Callable[[], float]:
+    """Returns a `max_time` for `backoff.on_exception` that stops retrying at the current deadline."""
+
+    def max_time():
+        remaining = get_remaining_seconds()
+        return default if remaining is None else min(default, remaining)
+
+    return max_time
+
+
+def run_within_deadline(func: Callable, *args, **kwargs):
+    """
+    Calls `func(*args, **kwargs)`. With a deadline, runs it on a separate thread and raises `DeadlineExceeded` if the
+    deadline passes first, abandoning the call so that the caller is not held by a stuck endpoint. The abandoned thread
+    ends when the call returns, which the HTTP timeout bounded by `get_timeout` ensures for most LM clients. The dspy
+    OpenAI clients are left at the OpenAI client's own timeout, since dspy caches responses by their request kwargs.
+
+    Calls nested in a call that already enforces the same deadline run inline. At most `MAX_DEADLINE_CALL_THREADS` calls
+    run on their own thread at a time; further calls wait for a free slot until the deadline. The threads are daemon
+    threads so that a stuck request does not keep the interpreter from exiting.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None or _enforced_deadline.get() is deadline:
+        return func(*args, **kwargs)
+    deadline.check()
+    if not _deadline_call_slots.acquire(timeout=deadline.remaining()):
+        DEADLINE_EXCEEDED.labels(scope=deadline.name).inc()
+        raise DeadlineExceeded(f"Deadline of {deadline.name or 'scope'} exceeded.")
+    future = Future()
+    context = contextvars.copy_context()
+    context.run(_enforced_deadline.set, deadline)
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(func, *args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            _deadline_call_slots.release()
+
+    try:
+        threading.Thread(target=run, daemon=True).start()
+    except BaseException:
+        _deadline_call_slots.release()
+        raise
+    done, _ = wait([future], timeout=deadline.remaining())
+    if not done:
+        DEADLINE_EXCEEDED.labels(scope=deadline.name).inc()
+        raise DeadlineExceeded(f"Deadline of {deadline.name or 'scope'} exceeded.")
+    return future.result()
+
+
+def deadline_lm_call(func):
+    """Decorates the `__call__` of an LM client so that it returns by the current deadline."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return run_within_deadline(func, self, *args, **kwargs)
+
+    return wrapper
+
+
+class DeadlineThreadPoolExecutor(InstrumentedThreadPoolExecutor):
+    """
+    A thread pool whose tasks run in a copy of the submitting context, so they inherit its deadline. When used as a
+    context manager past the deadline, it does not wait for running tasks on exit, and it cancels the queued ones.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        deadline = _current_deadline.get()
+        if deadline is not None and deadline.expired():
+            self.shutdown(wait=False, cancel_futures=True)
+            return False
+        return super().__exit__(exc_type, exc_val, exc_tb)
+
+
+def as_completed_within_deadline(
+    futures: Iterable[Future],
+    description: str = "tasks",
+    timeout: Optional[float] = None,
+    cancel_pending: bool = True,
+) -> Iterator[Future]:
+    """
+    Like `concurrent.futures.as_completed`, but stops at the current deadline, or after `timeout` seconds if that is
+    earlier. Skips tasks that were cancelled or raised `DeadlineExceeded`, cancels the tasks that have not finished in
+    time (unless `cancel_pending` is False), and prints how many were dropped.
+    """
+    futures = list(futures)
+    remaining = get_remaining_seconds()
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    dropped_cnt = 0
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            if future.cancelled() or isinstance(future.exception(), DeadlineExceeded):
+                dropped_cnt += 1
+                continue
+            yield future
+    except FutureTimeoutError:
+        for future in futures:
+            if not future.done():
+                if cancel_pending:
+                    future.cancel()
+                dropped_cnt += 1
+        deadline = _current_deadline.get()
+        if deadline is not None and deadline.expired():
+            DEADLINE_EXCEEDED.labels(scope=deadline.name).inc()
+    if dropped_cnt:
+        print(
+            f"Out of time: continuing without {dropped_cnt} of {len(futures)} {description}."
+        )
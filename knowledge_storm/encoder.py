@@ -3,7 +3,9 @@ import os
 from typing import List, Tuple, Union, Optional, Dict, Literal
 import numpy as np
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import as_completed
+
+from .metrics import InstrumentedThreadPoolExecutor, record_cache_lookup, track_request
 
 
 class EmbeddingModel:
@@ -15,11 +17,18 @@ class EmbeddingModel:
 
 
 class OpenAIEmbeddingModel(EmbeddingModel):
-    def __init__(self, model: str = "text-embedding-3-small", api_key: str = None):
+    def __init__(
+        self,
+        model: str = "text-embedding-3-small",
+        api_key: str = None,
+        api_base: str = None,
+    ):
         if not api_key:
             api_key = os.getenv("OPENAI_API_KEY")
+        if not api_base:
+            api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 
-        self.url = "https://api.openai.com/v1/embeddings"
+        self.url = f"{api_base.rstrip('/')}/embeddings"
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}",
@@ -106,23 +115,33 @@ def get_text_embeddings(
         )
 
     def fetch_embedding(text: str) -> Tuple[str, np.ndarray, int]:
-        if embedding_cache is not None and text in embedding_cache:
-            return (
-                text,
-                embedding_cache[text],
-                0,
-            )  # Returning 0 tokens since no API call is made
-        embedding, token_usage = embedding_model.get_embedding(text)
+        if embedding_cache is not None:
+            cache_hit = text in embedding_cache
+            record_cache_lookup("embedding", cache_hit)
+            if cache_hit:
+                return (
+                    text,
+                    embedding_cache[text],
+                    0,
+                )  # Returning 0 tokens since no API call is made
+        with track_request(
+            "embedding", type(embedding_model).__name__, embedding_model.model
+        ):
+            embedding, token_usage = embedding_model.get_embedding(text)
         return text, embedding, token_usage
 
     if isinstance(texts, str):
         _, embedding, tokens = fetch_embedding(texts)
+        if embedding_cache is not None:
+            embedding_cache[texts] = embedding
         return np.array(embedding), tokens
 
     embeddings = []
     total_tokens = 0
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with InstrumentedThreadPoolExecutor(
+        "embedding", max_workers=max_workers
+    ) as executor:
         futures = {executor.submit(fetch_embedding, text): text for text in texts}
 
         for future in as_completed(futures):
@@ -142,3 +161,38 @@ def get_text_embeddings(
     embeddings = [result[1] for result in embeddings]
 
     return np.array(embeddings), total_tokens
+
+
+def get_normalized_text_embedding_matrix(
+    texts: List[str],
+    max_workers: int = 5,
+    embedding_cache: Optional[Dict[str, np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Get L2-normalized text embeddings whose rows are aligned with the input texts.
+
+    All texts are fetched in one batch through `get_text_embeddings`. Texts whose embedding cannot be computed
+    are represented by zero rows so that the alignment with the input texts is preserved.
+
+    Args:
+        texts (List[str]): A list of text strings to embed.
+        max_workers (int): The maximum number of workers for parallel processing.
+        embedding_cache (Optional[Dict[str, np.ndarray]]): A cache to store previously computed embeddings.
+
+    Returns:
+        np.ndarray: The 2D array of normalized embeddings with one row per input text.
+    """
+    if embedding_cache is None:
+        embedding_cache = {}
+    if texts:
+        get_text_embeddings(
+            texts, max_workers=max_workers, embedding_cache=embedding_cache
+        )
+    embeddings = [embedding_cache.get(text) for text in texts]
+    dim = next((len(embedding) for embedding in embeddings if embedding is not None), 0)
+    matrix = np.zeros((len(texts), dim))
+    for idx, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[idx] = embedding
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
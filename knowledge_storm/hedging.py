@@ -0,0 +1,174 @@
+"""
+Hedged LM requests to cut tail latency.
+
+Section writing in STORM and node generation in Co-STORM wait for the slowest of many parallel LM calls, so one
+straggler sets the latency of the whole stage. With a `HedgingPolicy` set on an LM client (`lm.hedging_policy = ...`),
+a call that has not returned after a high percentile of the recent call latencies sends a duplicate request. For an
+`LMEndpointPool` the duplicate is routed like any other call, which usually sends it to another replica. The first
+successful response wins. The other attempt is cancelled if it has not started, and otherwise abandoned: its response
+is discarded when it arrives, since a blocking HTTP call cannot be interrupted from another thread. Duplicates are
+capped at a fraction of all calls so that a slow backend is not overloaded further.
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Dict, Optional
+
+from .metrics import HEDGED_REQUESTS
+
+
+def _start_attempt(call: Callable) -> Future:
+    """Runs `call` on a new daemon thread with a copy of the current context. Returns its future."""
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(call))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class HedgingPolicy:
+    """
+    Decides when to send a duplicate of a slow LM call. Use one policy per LM client, since the hedge delay is derived
+    from the latencies of the calls it sees.
+
+    Args:
+        percentile (float): A duplicate is sent once a call has taken longer than this percentile of recent latencies.
+        min_delay_seconds (float): Lower bound of the hedge delay.
+        max_hedge_ratio (float): Duplicates sent may not exceed this fraction of all calls.
+        min_samples (int): No duplicates are sent until this many latencies have been observed.
+        window_size (int): Number of recent latencies the percentile is computed over.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        min_delay_seconds: float = 1.0,
+        max_hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        window_size: int = 500,
+    ):
+        if not 0 < percentile < 100:
+            raise ValueError("percentile must be between 0 and 100.")
+        self.percentile = percentile
+        self.min_delay_seconds = min_delay_seconds
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self.call_count = 0
+        self.hedged_count = 0
+        self.hedge_win_count = 0
+        # counts since the last `get_counts_and_reset`, for the usage stats
+        self._hedged_since_reset = 0
+        self._hedge_wins_since_reset = 0
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def get_hedge_delay(self) -> Optional[float]:
+        """Returns how long to wait before sending a duplicate, or None if there are too few samples yet."""
+        with self._lock:
+            if len(self._latencies) < max(self.min_samples, 1):
+                return None
+            latencies = sorted(self._latencies)
+        idx = min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)
+        return max(latencies[idx], self.min_delay_seconds)
+
+    def _try_acquire_budget(self) -> bool:
+        with self._lock:
+            if self.hedged_count + 1 > self.max_hedge_ratio * self.call_count:
+                return False
+            self.hedged_count += 1
+            self._hedged_since_reset += 1
+            return True
+
+    def run(self, call: Callable, provider: str = ""):
+        """Runs `call`, sending a duplicate if it is slow. Returns the first successful result."""
+        with self._lock:
+            self.call_count += 1
+        delay = self.get_hedge_delay()
+        start = time.perf_counter()
+        if delay is None:
+            result = call()
+            self.record_latency(time.perf_counter() - start)
+            return result
+        primary = _start_attempt(call)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._try_acquire_budget():
+            if not done:
+                HEDGED_REQUESTS.labels(provider=provider, event="skipped").inc()
+            result = primary.result()
+            self.record_latency(time.perf_counter() - start)
+            return result
+
+        HEDGED_REQUESTS.labels(provider=provider, event="sent").inc()
+        hedge_start = time.perf_counter()
+        hedge = _start_attempt(call)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in (primary, hedge):
+                if attempt not in done:
+                    continue
+                if attempt.exception() is not None:
+                    first_error = first_error or attempt.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                if attempt is hedge:
+                    HEDGED_REQUESTS.labels(provider=provider, event="won").inc()
+                    with self._lock:
+                        self.hedge_win_count += 1
+                        self._hedge_wins_since_reset += 1
+                    self.record_latency(time.perf_counter() - hedge_start)
+                else:
+                    self.record_latency(time.perf_counter() - start)
+                return attempt.result()
+        raise first_error
+
+    def get_counts_and_reset(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {
+                "hedged_requests": self._hedged_since_reset,
+                "hedge_wins": self._hedge_wins_since_reset,
+            }
+            self._hedged_since_reset = 0
+            self._hedge_wins_since_reset = 0
+        return counts
+
+
+def hedge_lm_call(func):
+    """Decorates the `__call__` of an LM client to apply its `hedging_policy`, if one is set."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        policy = getattr(self, "hedging_policy", None)
+        if policy is None:
+            return func(self, *args, **kwargs)
+        return policy.run(
+            lambda: func(self, *args, **kwargs), provider=type(self).__name__
+        )
+
+    return wrapper
+
+
+def get_hedge_counts_and_reset(lm) -> Dict[str, int]:
+    """Returns the duplicates sent and won by an LM client since the last reset."""
+    policy = getattr(lm, "hedging_policy", None)
+    if policy is None:
+        return {}
+    return policy.get_counts_and_reset()
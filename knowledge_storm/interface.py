@@ -1,14 +1,27 @@
-import concurrent.futures
+import copy
 import dspy
 import functools
 import hashlib
 import json
 import logging
+import math
+import sys
+import threading
 import time
 from abc import ABC, abstractmethod
 from collections import OrderedDict
-from typing import Dict, List, Optional, Union, TYPE_CHECKING
+from concurrent.futures import Future
+from typing import Dict, Hashable, List, Optional, Union, TYPE_CHECKING
 
+from .deadline import (
+    DeadlineThreadPoolExecutor,
+    as_completed_within_deadline,
+    deadline_scope,
+)
+from .hedging import get_hedge_counts_and_reset
+from .lm_history import LMHistoryBuffer, LMHistorySink
+from .metrics import PARTIAL_RETRIEVALS, STRAGGLER_QUERIES
+from .singleflight import SingleFlight, get_coalesced_count_and_reset, make_request_key
 from .utils import ArticleTextProcessing
 
 logging.basicConfig(
@@ -38,12 +51,84 @@ class InformationTable(ABC):
         pass
 
 
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class _VersionedList(list):
+    """List that counts in-place mutations so that derived values can be cached safely."""
+
+    __slots__ = ("version",)
+
+    def __init__(self, iterable=()):
+        super().__init__(iterable)
+        self.version = 0
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+class _VersionedDict(dict):
+    """Dictionary that counts in-place mutations so that derived values can be cached safely."""
+
+    __slots__ = ("version",)
+
+    def __init__(self, mapping=None):
+        super().__init__(mapping if mapping is not None else {})
+        self.version = 0
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+
+def _count_mutation(base, method_name):
+    method = getattr(base, method_name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+for _method_name in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(_VersionedList, _method_name, _count_mutation(list, _method_name))
+for _method_name in (
+    "__setitem__",
+    "__delitem__",
+    "__ior__",
+    "pop",
+    "popitem",
+    "clear",
+    "update",
+    "setdefault",
+):
+    setattr(_VersionedDict, _method_name, _count_mutation(dict, _method_name))
+
+
 class Information:
     """Class to represent detailed information.
 
     Inherits from Information to include a unique identifier (URL), and extends
     it with a description, snippets, and title of the storm information.
 
+    The hash is computed once and cached. Assigning `url`, `snippets` or `meta`, or mutating
+    the snippets list or the meta dictionary in place, invalidates the cached value.
+
     Attributes:
         description (str): Brief description.
         snippets (list): List of brief excerpts or snippets.
@@ -51,6 +136,17 @@ class Information:
         url (str): The unique URL (serving as UUID) of the information.
     """
 
+    __slots__ = (
+        "description",
+        "_snippets",
+        "_title",
+        "_url",
+        "_meta",
+        "citation_uuid",
+        "_hash",
+        "_hash_version",
+    )
+
     def __init__(self, url, description, snippets, title, meta=None):
         """Initialize the Information object with detailed attributes.
 
@@ -60,20 +156,61 @@ class Information:
             snippets (list): List of brief excerpts or snippet.
             title (str): The title or headline of the information.
         """
+        self._hash = None
         self.description = description
         self.snippets = snippets
         self.title = title
         self.url = url
-        self.meta = meta if meta is not None else {}
+        self.meta = meta
         self.citation_uuid = -1
 
-    def __hash__(self):
-        return hash(
-            (
-                self.url,
-                tuple(sorted(self.snippets)),
-            )
+    @property
+    def url(self):
+        return self._url
+
+    @url.setter
+    def url(self, value):
+        self._url = _intern(value)
+        self._hash = None
+
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        self._title = _intern(value)
+
+    @property
+    def snippets(self):
+        return self._snippets
+
+    @snippets.setter
+    def snippets(self, value):
+        self._snippets = _VersionedList(value)
+        self._hash = None
+
+    @property
+    def meta(self):
+        return self._meta
+
+    @meta.setter
+    def meta(self, value):
+        self._meta = _VersionedDict(value)
+        self._hash = None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(
+            url=state["url"],
+            description=state["description"],
+            snippets=state["snippets"],
+            title=state["title"],
+            meta=state["meta"],
         )
+        self.citation_uuid = state["citation_uuid"]
 
     def __eq__(self, other):
         if not isinstance(other, Information):
@@ -85,10 +222,16 @@ class Information:
         )
 
     def __hash__(self):
-        return int(
-            self._md5_hash((self.url, tuple(sorted(self.snippets)), self._meta_str())),
-            16,
-        )
+        hash_version = (self._snippets.version, self._meta.version)
+        if self._hash is None or self._hash_version != hash_version:
+            self._hash = int(
+                self._md5_hash(
+                    (self.url, tuple(sorted(self.snippets)), self._meta_str())
+                ),
+                16,
+            )
+            self._hash_version = hash_version
+        return self._hash
 
     def _meta_str(self):
         """Generate a string representation of relevant meta information."""
@@ -126,9 +269,9 @@ class Information:
         return {
             "url": self.url,
             "description": self.description,
-            "snippets": self.snippets,
+            "snippets": list(self.snippets),
             "title": self.title,
-            "meta": self.meta,
+            "meta": dict(self.meta),
             "citation_uuid": self.citation_uuid,
         }
 
@@ -264,11 +407,47 @@ class Retriever:
     This class should be extended to implement specific retrieval functionalities.
     Users can design their retriever modules as needed by implementing the retrieve method.
     The retrieval model/search engine used for each part should be declared with a suffix '_rm' in the attribute name.
+
+    By default `retrieve` waits for every query. For predictable latency, it can instead return partial results once
+    `min_query_fraction` of the queries have answered or after `timeout` seconds, whichever comes first. The queries
+    left out (stragglers) are dropped, or with `keep_late_results` keep running for calls that pass a
+    `late_results_key`. Their results are then kept under that key until `pop_late_results`, so concurrent callers
+    (e.g. the conversations of different personas) only get their own late results. Partial retrievals and stragglers
+    are counted in the rm usage and in the `storm_partial_retrievals_total` and `storm_straggler_queries_total` metrics.
+
+    Args:
+        rm (dspy.Retrieve): The retrieval module.
+        max_thread (int): Maximum number of queries searched in parallel.
+        min_query_fraction (float): Fraction of the queries (rounded up, at least one) after which `retrieve` returns.
+        timeout (float, optional): Time budget in seconds of a `retrieve` call, bounded by the current deadline.
+        keep_late_results (bool): If True, stragglers of calls with a `late_results_key` keep running and their
+            results are kept for `pop_late_results`.
     """
 
-    def __init__(self, rm: dspy.Retrieve, max_thread: int = 1):
+    def __init__(
+        self,
+        rm: dspy.Retrieve,
+        max_thread: int = 1,
+        min_query_fraction: float = 1.0,
+        timeout: Optional[float] = None,
+        keep_late_results: bool = False,
+    ):
+        if not 0 < min_query_fraction <= 1:
+            raise ValueError("min_query_fraction must be in (0, 1].")
         self.max_thread = max_thread
         self.rm = rm
+        self.min_query_fraction = min_query_fraction
+        self.timeout = timeout
+        self.keep_late_results = keep_late_results
+        # concurrent identical queries share one search; each caller gets its own copy of the results
+        self._singleflight = SingleFlight(
+            "rm", type(rm).__name__, copy_result=copy.deepcopy
+        )
+        self._late_results: Dict[Hashable, List[Information]] = {}
+        self._stats_lock = threading.Lock()
+        self._partial_retrieval_cnt = 0
+        self._straggler_query_cnt = 0
+        self._late_query_cnt = 0
 
     def collect_and_reset_rm_usage(self):
         combined_usage = []
@@ -283,15 +462,57 @@ class Retriever:
                 else:
                     name_to_usage[model_name] += query_cnt
 
+        coalesced_cnt = get_coalesced_count_and_reset(self)
+        if coalesced_cnt:
+            name_to_usage["coalesced_queries"] = coalesced_cnt
+        with self._stats_lock:
+            partial_stats = {
+                "partial_retrievals": self._partial_retrieval_cnt,
+                "straggler_queries": self._straggler_query_cnt,
+                "late_queries": self._late_query_cnt,
+            }
+            self._partial_retrieval_cnt = 0
+            self._straggler_query_cnt = 0
+            self._late_query_cnt = 0
+        name_to_usage.update({k: v for k, v in partial_stats.items() if v})
+
         return name_to_usage
 
+    def pop_late_results(
+        self, late_results_key: Hashable, close: bool = False
+    ) -> List[Information]:
+        """
+        Returns the results of the stragglers of `retrieve` calls with `late_results_key` that answered after their
+        call returned, and clears them. With `close`, the results of the remaining stragglers are dropped.
+        """
+        with self._stats_lock:
+            if close:
+                return self._late_results.pop(late_results_key, [])
+            late_results = self._late_results.get(late_results_key, [])
+            if late_results:
+                self._late_results[late_results_key] = []
+        return late_results
+
+    def _keep_late_result(self, late_results_key: Hashable, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._stats_lock:
+            if late_results_key not in self._late_results:
+                # closed by `pop_late_results`
+                return
+            self._late_results[late_results_key].extend(future.result())
+            self._late_query_cnt += 1
+
     def retrieve(
-        self, query: Union[str, List[str]], exclude_urls: List[str] = []
+        self,
+        query: Union[str, List[str]],
+        exclude_urls: List[str] = [],
+        late_results_key: Optional[Hashable] = None,
     ) -> List[Information]:
         queries = query if isinstance(query, list) else [query]
         to_return = []
 
-        def process_query(q):
+        def search(q):
             retrieved_data_list = self.rm(
                 query_or_queries=[q], exclude_urls=exclude_urls
             )
@@ -308,16 +529,81 @@ class Retriever:
                 local_to_return.append(storm_info)
             return local_to_return
 
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread
-        ) as executor:
-            results = list(executor.map(process_query, queries))
+        def process_query(q):
+            return self._singleflight.do(
+                make_request_key(q, sorted(exclude_urls)), search, q
+            )
 
-        for result in results:
-            to_return.extend(result)
+        quorum = max(math.ceil(self.min_query_fraction * len(queries)), 1)
+        keep_late_results = self.keep_late_results and late_results_key is not None
+        executor = DeadlineThreadPoolExecutor("retrieve", max_workers=self.max_thread)
+        future_to_idx = {
+            executor.submit(process_query, q): idx for idx, q in enumerate(queries)
+        }
+        results = {}
+        try:
+            for future in as_completed_within_deadline(
+                future_to_idx,
+                "search queries",
+                timeout=self.timeout,
+                cancel_pending=not keep_late_results,
+            ):
+                results[future_to_idx[future]] = future.result()
+                if len(results) >= quorum:
+                    break
+            # queries that answered while the quorum was being reached are not stragglers
+            for future, idx in future_to_idx.items():
+                if (
+                    idx not in results
+                    and future.done()
+                    and not future.cancelled()
+                    and future.exception() is None
+                ):
+                    results[idx] = future.result()
+        finally:
+            stragglers = [f for f, idx in future_to_idx.items() if idx not in results]
+            # do not wait for the stragglers; queued ones still run if their results are kept
+            executor.shutdown(wait=not stragglers, cancel_futures=not keep_late_results)
+
+        if stragglers:
+            self._record_partial_retrieval(
+                stragglers,
+                quorum_met=len(results) >= quorum,
+                late_results_key=late_results_key if keep_late_results else None,
+            )
+
+        for idx in sorted(results):
+            to_return.extend(results[idx])
 
         return to_return
 
+    def _record_partial_retrieval(
+        self,
+        stragglers: List[Future],
+        quorum_met: bool,
+        late_results_key: Optional[Hashable] = None,
+    ):
+        provider = type(self.rm).__name__
+        outcome = "dropped" if late_results_key is None else "kept"
+        PARTIAL_RETRIEVALS.labels(
+            provider=provider, reason="quorum" if quorum_met else "timeout"
+        ).inc()
+        STRAGGLER_QUERIES.labels(provider=provider, outcome=outcome).inc(
+            len(stragglers)
+        )
+        with self._stats_lock:
+            self._partial_retrieval_cnt += 1
+            self._straggler_query_cnt += len(stragglers)
+            if late_results_key is not None:
+                self._late_results.setdefault(late_results_key, [])
+        for future in stragglers:
+            if late_results_key is not None:
+                future.add_done_callback(
+                    functools.partial(self._keep_late_result, late_results_key)
+                )
+            else:
+                future.cancel()
+
 
 class KnowledgeCurationModule(ABC):
     """
@@ -440,22 +726,71 @@ class LMConfigs(ABC):
                     f"Language model for {attr_name} is not initialized. Please call set_{attr_name}()"
                 )
 
+    def set_history_sink(
+        self,
+        sink: Optional[LMHistorySink] = None,
+        max_history_per_lm: Optional[int] = 100,
+    ):
+        """
+        Bounds the call history of the language models that are currently set and streams it to `sink`.
+
+        Each language model keeps at most `max_history_per_lm` recent calls in memory (None for no limit, 0 to keep
+        none), which is also the most `collect_and_reset_lm_history` can return. Every call is written to `sink` as it
+        happens. Call this after all language models are set; models shared between attributes are configured once.
+        """
+        for attr_name in list(self.__dict__):
+            lm = getattr(self, attr_name)
+            if "_lm" in attr_name and hasattr(lm, "history"):
+                if (
+                    isinstance(lm.history, LMHistoryBuffer)
+                    and lm.history.sink is sink
+                    and lm.history.maxlen == max_history_per_lm
+                ):
+                    continue
+                history = LMHistoryBuffer(maxlen=max_history_per_lm, sink=sink)
+                for record in lm.history:
+                    history.append(record)
+                lm.history = history
+
     def collect_and_reset_lm_history(self):
         history = []
         for attr_name in self.__dict__:
             if "_lm" in attr_name and hasattr(getattr(self, attr_name), "history"):
-                history.extend(getattr(self, attr_name).history)
-                getattr(self, attr_name).history = []
+                lm_history = getattr(self, attr_name).history
+                history.extend(lm_history)
+                if isinstance(lm_history, LMHistoryBuffer):
+                    # keep the bounded buffer and its sink
+                    lm_history.clear()
+                else:
+                    getattr(self, attr_name).history = []
 
         return history
 
+    @staticmethod
+    def get_lm_usage_and_reset(lm) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the token usage of a language model by model name and resets it. The nonzero counts of calls that
+        shared the in-flight request of an identical call and of duplicates of slow calls are added to the usage.
+        """
+        usage = lm.get_usage_and_reset()
+        request_stats = {
+            "coalesced_requests": get_coalesced_count_and_reset(lm),
+            **get_hedge_counts_and_reset(lm),
+        }
+        request_stats = {k: v for k, v in request_stats.items() if v}
+        if request_stats and usage:
+            next(iter(usage.values())).update(request_stats)
+        return usage
+
     def collect_and_reset_lm_usage(self):
         combined_usage = []
         for attr_name in self.__dict__:
             if "_lm" in attr_name and hasattr(
                 getattr(self, attr_name), "get_usage_and_reset"
             ):
-                combined_usage.append(getattr(self, attr_name).get_usage_and_reset())
+                combined_usage.append(
+                    self.get_lm_usage_and_reset(getattr(self, attr_name))
+                )
 
         model_name_to_usage = {}
         for usage in combined_usage:
@@ -463,12 +798,11 @@ class LMConfigs(ABC):
                 if model_name not in model_name_to_usage:
                     model_name_to_usage[model_name] = tokens
                 else:
-                    model_name_to_usage[model_name]["prompt_tokens"] += tokens[
-                        "prompt_tokens"
-                    ]
-                    model_name_to_usage[model_name]["completion_tokens"] += tokens[
-                        "completion_tokens"
-                    ]
+                    # besides prompt and completion tokens, some models report e.g. prompt cache tokens
+                    for token_type, count in tokens.items():
+                        model_name_to_usage[model_name][token_type] = (
+                            model_name_to_usage[model_name].get(token_type, 0) + count
+                        )
 
         return model_name_to_usage
 
@@ -496,7 +830,10 @@ class Engine(ABC):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.time()
-            result = func(*args, **kwargs)
+            with deadline_scope(
+                self.get_stage_timeout(func.__name__), name=func.__name__
+            ):
+                result = func(*args, **kwargs)
             end_time = time.time()
             execution_time = end_time - start_time
             self.time[func.__name__] = execution_time
@@ -510,6 +847,10 @@ class Engine(ABC):
 
         return wrapper
 
+    def get_stage_timeout(self, stage: str) -> Optional[float]:
+        """Returns the time budget in seconds of a stage (a `run_` method), or None for no stage deadline."""
+        return None
+
     def apply_decorators(self):
         """Apply decorators to methods that need them."""
         methods_to_decorate = [
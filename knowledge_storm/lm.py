@@ -1,8 +1,10 @@
 import logging
 import os
 import random
+import re
 import threading
-from typing import Optional, Literal, Any
+from collections import deque
+from typing import Optional, Literal, Any, List
 
 import backoff
 import dspy
@@ -13,6 +15,13 @@ from dsp.modules.hf_client import send_hftgi_request_v01_wrapped
 from openai import OpenAI
 from transformers import AutoTokenizer
 
+from .deadline import backoff_max_time, deadline_lm_call, get_timeout
+from .hedging import hedge_lm_call
+from .lm_batching import MicroBatcher, generate_concurrently, split_completions_response
+from .metrics import record_lm_usage, record_retry, track_lm_call
+from .prompt_budget import count_tokens
+from .singleflight import coalesce_lm_call
+
 try:
     from anthropic import RateLimitError
 except ImportError:
@@ -41,6 +50,11 @@ class OpenAIModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -56,6 +70,10 @@ class OpenAIModel(dspy.OpenAI):
 
         return usage
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(
         self,
         prompt: str,
@@ -138,6 +156,11 @@ class DeepSeekModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -154,8 +177,8 @@ class DeepSeekModel(dspy.OpenAI):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
-        on_backoff=backoff_hdlr,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
         giveup=giveup_hdlr,
     )
     def _create_completion(self, prompt: str, **kwargs):
@@ -170,11 +193,18 @@ class DeepSeekModel(dspy.OpenAI):
             **kwargs,
         }
         response = requests.post(
-            f"{self.api_base}/v1/chat/completions", headers=headers, json=data
+            f"{self.api_base}/v1/chat/completions",
+            headers=headers,
+            json=data,
+            timeout=get_timeout(),
         )
         response.raise_for_status()
         return response.json()
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(
         self,
         prompt: str,
@@ -237,6 +267,11 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -252,6 +287,10 @@ class AzureOpenAIModel(dspy.AzureOpenAI):
 
         return usage
 
+    __call__ = coalesce_lm_call(
+        deadline_lm_call(hedge_lm_call(track_lm_call(dspy.AzureOpenAI.__call__)))
+    )
+
 
 class GroqModel(dspy.OpenAI):
     """A wrapper class for Groq API (https://console.groq.com/), compatible with dspy.OpenAI."""
@@ -282,6 +321,11 @@ class GroqModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -298,8 +342,8 @@ class GroqModel(dspy.OpenAI):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
-        on_backoff=backoff_hdlr,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
         giveup=giveup_hdlr,
     )
     def _create_completion(self, prompt: str, **kwargs):
@@ -333,11 +377,18 @@ class GroqModel(dspy.OpenAI):
             message.pop("name", None)
 
         response = requests.post(
-            f"{self.api_base}/chat/completions", headers=headers, json=data
+            f"{self.api_base}/chat/completions",
+            headers=headers,
+            json=data,
+            timeout=get_timeout(),
         )
         response.raise_for_status()
         return response.json()
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(
         self,
         prompt: str,
@@ -368,13 +419,25 @@ class GroqModel(dspy.OpenAI):
 
 
 class ClaudeModel(dspy.dsp.modules.lm.LM):
-    """Copied from dspy/dsp/modules/anthropic.py with the addition of tracking token usage."""
+    """Copied from dspy/dsp/modules/anthropic.py with the addition of tracking token usage and prompt caching.
+
+    With `prompt_caching`, stable prompt prefixes are marked with `cache_control` so that Anthropic serves them from
+    its prompt cache: the instructions, format guidelines and demos of a dspy prompt, and the part of the inputs that
+    is shared with a recent prompt (e.g. the same collected information across the sections of an article, or the same
+    knowledge base summary across Co-STORM turns). Prefixes shorter than `cache_min_tokens` are not marked because
+    Anthropic does not cache them, and cache writes cost more than regular input tokens.
+    """
+
+    # dspy joins the instructions, format guidelines, demos and the current example with this separator
+    DSPY_SECTION_SEPARATOR = "\n\n---\n\n"
 
     def __init__(
         self,
         model: str,
         api_key: Optional[str] = None,
         api_base: Optional[str] = None,
+        prompt_caching: bool = True,
+        cache_min_tokens: Optional[int] = None,
         **kwargs,
     ):
         super().__init__(model)
@@ -400,20 +463,51 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             "model": model,
         }
         self.history: list[dict[str, Any]] = []
-        self.client = Anthropic(api_key=api_key)
+        client_kwargs = {"api_key": api_key}
+        if api_base is not None:
+            # the client appends /v1/messages to the base URL
+            client_kwargs["base_url"] = re.sub(r"/v1/messages/?$", "", api_base)
+        self.client = Anthropic(**client_kwargs)
         self.model = model
 
+        self.prompt_caching = prompt_caching
+        # minimum cacheable prompt length of the Anthropic API
+        self.cache_min_tokens = cache_min_tokens or (
+            2048 if "haiku" in model.lower() else 1024
+        )
+        self._recent_prompts = deque(maxlen=16)
+        self._recent_prompts_lock = threading.Lock()
+
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_creation_tokens = 0
+        self.cache_read_tokens = 0
 
     def log_usage(self, response):
-        """Log the total tokens from the Anthropic API response."""
+        """Log the total tokens from the Anthropic API response.
+        `prompt_tokens` counts the input tokens that were neither written to nor read from the prompt cache.
+        """
         usage_data = response.usage
         if usage_data:
+            cache_creation_tokens = (
+                getattr(usage_data, "cache_creation_input_tokens", None) or 0
+            )
+            cache_read_tokens = (
+                getattr(usage_data, "cache_read_input_tokens", None) or 0
+            )
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.input_tokens
                 self.completion_tokens += usage_data.output_tokens
+                self.cache_creation_tokens += cache_creation_tokens
+                self.cache_read_tokens += cache_read_tokens
+            record_lm_usage(
+                self,
+                usage_data.input_tokens,
+                usage_data.output_tokens,
+                cache_read_tokens=cache_read_tokens,
+                cache_creation_tokens=cache_creation_tokens,
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -421,19 +515,76 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
             self.model: {
                 "prompt_tokens": self.prompt_tokens,
                 "completion_tokens": self.completion_tokens,
+                "cache_creation_input_tokens": self.cache_creation_tokens,
+                "cache_read_input_tokens": self.cache_read_tokens,
             }
         }
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self.cache_creation_tokens = 0
+        self.cache_read_tokens = 0
 
         return usage
 
+    def _get_cache_breakpoints(self, prompt: str) -> list[int]:
+        """Returns the lengths of the prompt prefixes to mark with cache_control, in increasing order."""
+        breakpoints = []
+        # the instructions, format guidelines and demos precede the last section of a dspy prompt
+        template_end = prompt.rfind(self.DSPY_SECTION_SEPARATOR)
+        if template_end > 0:
+            template_end += len(self.DSPY_SECTION_SEPARATOR)
+            if count_tokens(prompt[:template_end], self.model) >= self.cache_min_tokens:
+                breakpoints.append(template_end)
+        # inputs shared with a recent prompt, cut at a line boundary
+        with self._recent_prompts_lock:
+            recent_prompts = list(self._recent_prompts)
+            self._recent_prompts.append(prompt)
+        shared_length = max(
+            (len(os.path.commonprefix([prompt, p])) for p in recent_prompts), default=0
+        )
+        shared_length = prompt.rfind("\n", 0, shared_length) + 1
+        if (
+            shared_length > (breakpoints[-1] if breakpoints else 0)
+            and shared_length < len(prompt)
+            and count_tokens(prompt[:shared_length], self.model)
+            >= self.cache_min_tokens
+        ):
+            breakpoints.append(shared_length)
+        return breakpoints
+
+    def _build_message_content(self, prompt: str):
+        """Splits the prompt into text blocks with cache_control on its stable prefixes."""
+        if not self.prompt_caching:
+            return prompt
+        breakpoints = self._get_cache_breakpoints(prompt)
+        if not breakpoints:
+            return prompt
+        content = []
+        start = 0
+        for end in breakpoints:
+            content.append(
+                {
+                    "type": "text",
+                    "text": prompt[start:end],
+                    "cache_control": {"type": "ephemeral"},
+                }
+            )
+            start = end
+        if start < len(prompt):
+            content.append({"type": "text", "text": prompt[start:]})
+        return content
+
     def basic_request(self, prompt: str, **kwargs):
         raw_kwargs = kwargs
         kwargs = {**self.kwargs, **kwargs}
         # caching mechanism requires hashable kwargs
-        kwargs["messages"] = [{"role": "user", "content": prompt}]
+        kwargs["messages"] = [
+            {"role": "user", "content": self._build_message_content(prompt)}
+        ]
         kwargs.pop("n")
+        timeout = get_timeout()
+        if timeout is not None:
+            kwargs["timeout"] = timeout
         response = self.client.messages.create(**kwargs)
         # history = {
         #     "prompt": prompt,
@@ -453,6 +604,12 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
                 "usage": {
                     "input_tokens": response.usage.input_tokens,
                     "output_tokens": response.usage.output_tokens,
+                    "cache_creation_input_tokens": getattr(
+                        response.usage, "cache_creation_input_tokens", None
+                    ),
+                    "cache_read_input_tokens": getattr(
+                        response.usage, "cache_read_input_tokens", None
+                    ),
                 },
             },
             "kwargs": kwargs,
@@ -464,15 +621,19 @@ class ClaudeModel(dspy.dsp.modules.lm.LM):
     @backoff.on_exception(
         backoff.expo,
         (RateLimitError,),
-        max_time=1000,
+        max_time=backoff_max_time(1000),
         max_tries=8,
-        on_backoff=backoff_hdlr,
+        on_backoff=[backoff_hdlr, record_retry],
         giveup=giveup_hdlr,
     )
     def request(self, prompt: str, **kwargs):
         """Handles retrieval of completions from Anthropic whilst handling API errors."""
         return self.basic_request(prompt, **kwargs)
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(self, prompt, only_completed=True, return_sorted=False, **kwargs):
         """Retrieves completions from Anthropic.
 
@@ -507,6 +668,11 @@ class VLLMClient(dspy.dsp.LM):
     """A client compatible with vLLM HTTP server.
 
     vLLM HTTP server is designed to be compatible with the OpenAI API. Use OpenAI client to interact with the server.
+
+    Single calls go to the chat completions endpoint, which applies the chat template of the model. With
+    `raw_prompt_batching`, `batch_generate` instead sends a list of prompts to the completions endpoint in one request,
+    as raw text without the chat template, and `micro_batch_window_ms` coalesces concurrent calls (e.g. from the threads
+    generating the sections of an article) into such batched requests.
     """
 
     def __init__(
@@ -516,13 +682,26 @@ class VLLMClient(dspy.dsp.LM):
         model_type: Literal["chat", "text"] = "text",
         url="http://localhost",
         api_key="null",
+        max_batch_size: int = 16,
+        raw_prompt_batching: bool = False,
+        micro_batch_window_ms: Optional[float] = None,
         **kwargs,
     ):
-        """Check out https://docs.vllm.ai/en/latest/serving/openai_compatible_server.html for more information."""
+        """Check out https://docs.vllm.ai/en/latest/serving/openai_compatible_server.html for more information.
+
+        Args:
+            max_batch_size: Maximum number of prompts per batched request.
+            raw_prompt_batching: Send batched prompts to the completions endpoint as raw text. Only for text models
+                whose prompts do not need the chat template. Otherwise `batch_generate` sends the prompts concurrently
+                to the chat completions endpoint.
+            micro_batch_window_ms: If set, concurrent calls arriving within this window are sent as one batched
+                request. Requires `raw_prompt_batching`.
+        """
         super().__init__(model=model)
         # Store additional kwargs for the generate method.
         self.kwargs = {**self.kwargs, **kwargs}
         self.model = model
+        self.model_type = model_type
         self.base_url = f"{url}:{port}/v1/"
         if model_type == "chat":
             self.base_url += "chat/"
@@ -530,8 +709,27 @@ class VLLMClient(dspy.dsp.LM):
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self._token_usage_lock = threading.Lock()
+        if raw_prompt_batching and model_type == "chat":
+            raise ValueError(
+                "raw_prompt_batching requires model_type='text', since the chat endpoint takes a single conversation."
+            )
+        if micro_batch_window_ms is not None and not raw_prompt_batching:
+            raise ValueError(
+                "micro_batch_window_ms sends batched prompts to the completions endpoint without the chat template. "
+                "Set raw_prompt_batching=True to opt in."
+            )
+        self.max_batch_size = max_batch_size
+        self.raw_prompt_batching = raw_prompt_batching
+        self._micro_batcher = None
+        if micro_batch_window_ms is not None:
+            self._micro_batcher = MicroBatcher(
+                self._generate_batch, max_batch_size, micro_batch_window_ms
+            )
 
     def basic_request(self, prompt, **kwargs):
+        timeout = get_timeout()
+        if timeout is not None:
+            kwargs["timeout"] = timeout
         completion = self.client.chat.completions.create(
             **kwargs,
             messages=[{"role": "user", "content": prompt}],
@@ -541,8 +739,8 @@ class VLLMClient(dspy.dsp.LM):
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
-        on_backoff=backoff_hdlr,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
     )
     def request(self, prompt: str, **kwargs):
         return self.basic_request(prompt, **kwargs)
@@ -554,6 +752,9 @@ class VLLMClient(dspy.dsp.LM):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.prompt_tokens
                 self.completion_tokens += usage_data.completion_tokens
+            record_lm_usage(
+                self, usage_data.prompt_tokens, usage_data.completion_tokens
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -569,9 +770,67 @@ class VLLMClient(dspy.dsp.LM):
 
         return usage
 
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
+    )
+    def _generate_batch(self, prompts: List[str], **kwargs) -> List[List[str]]:
+        """Sends the prompts to the completions endpoint in one request. Records usage and history per prompt."""
+        timeout = get_timeout()
+        response = self.client.completions.create(
+            prompt=list(prompts),
+            **kwargs,
+            **({} if timeout is None else {"timeout": timeout}),
+        )
+        prompt_responses = split_completions_response(
+            response.model_dump(), prompts, n=kwargs.get("n", 1), model=self.model
+        )
+        completions = []
+        for prompt, prompt_response in zip(prompts, prompt_responses):
+            usage_data = prompt_response["usage"]
+            with self._token_usage_lock:
+                self.prompt_tokens += usage_data["prompt_tokens"]
+                self.completion_tokens += usage_data["completion_tokens"]
+            record_lm_usage(
+                self, usage_data["prompt_tokens"], usage_data["completion_tokens"]
+            )
+            self.history.append(
+                {"prompt": prompt, "response": prompt_response, "kwargs": kwargs}
+            )
+            completions.append(
+                [choice["text"] for choice in prompt_response["choices"]]
+            )
+        return completions
+
+    @track_lm_call
+    def batch_generate(self, prompts: List[str], **kwargs) -> List[List[str]]:
+        """Generates completions for each prompt, sending up to `max_batch_size` prompts per request.
+        Without `raw_prompt_batching`, the prompts are sent concurrently to the chat completions endpoint instead.
+        """
+        kwargs = {**self.kwargs, **kwargs}
+        if not self.raw_prompt_batching:
+            return generate_concurrently(self, prompts, self.max_batch_size, **kwargs)
+        completions = []
+        for start in range(0, len(prompts), self.max_batch_size):
+            completions.extend(
+                self._generate_batch(
+                    prompts[start : start + self.max_batch_size], **kwargs
+                )
+            )
+        return completions
+
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(self, prompt: str, **kwargs):
         kwargs = {**self.kwargs, **kwargs}
 
+        if self._micro_batcher is not None:
+            return self._micro_batcher.submit(prompt, **kwargs)
+
         try:
             response = self.request(prompt, **kwargs)
         except Exception as e:
@@ -605,6 +864,30 @@ class OllamaClient(dspy.OllamaLocal):
         # Store additional kwargs for the generate method.
         self.kwargs = {**self.kwargs, **kwargs}
 
+    def basic_request(self, prompt: str, **kwargs):
+        response = super().basic_request(prompt, **kwargs)
+        usage_data = response.get("usage")
+        if usage_data:
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
+        return response
+
+    __call__ = coalesce_lm_call(
+        deadline_lm_call(hedge_lm_call(track_lm_call(dspy.OllamaLocal.__call__)))
+    )
+
+    @track_lm_call
+    def batch_generate(
+        self, prompts: List[str], max_workers: int = 4, **kwargs
+    ) -> List[List[str]]:
+        """Generates completions for each prompt. The Ollama API takes one prompt per request, so the prompts are
+        sent concurrently; set OLLAMA_NUM_PARALLEL on the server to process them in parallel.
+        """
+        return generate_concurrently(self, prompts, max_workers, **kwargs)
+
 
 class TGIClient(dspy.HFClientTGI):
     def __init__(self, model, port, url, http_request_kwargs=None, **kwargs):
@@ -616,6 +899,19 @@ class TGIClient(dspy.HFClientTGI):
             **kwargs,
         )
 
+    @track_lm_call
+    def batch_generate(
+        self, prompts: List[str], max_workers: int = 8, **kwargs
+    ) -> List[List[str]]:
+        """Generates completions for each prompt. The TGI /generate endpoint takes one input per request and batches
+        concurrent requests on the server, so the prompts are sent concurrently.
+        """
+        return generate_concurrently(self, prompts, max_workers, **kwargs)
+
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def _generate(self, prompt, **kwargs):
         """Copied from dspy/dsp/modules/hf_client.py with the addition of removing hard-coded parameters."""
         kwargs = {**self.kwargs, **kwargs}
@@ -732,6 +1028,11 @@ class TogetherClient(dspy.HFModel):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -746,11 +1047,15 @@ class TogetherClient(dspy.HFModel):
 
         return usage
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     @backoff.on_exception(
         backoff.expo,
         ERRORS,
-        max_time=1000,
-        on_backoff=backoff_hdlr,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
     )
     def _generate(self, prompt, **kwargs):
         kwargs = {**self.kwargs, **kwargs}
@@ -799,7 +1104,9 @@ class TogetherClient(dspy.HFModel):
 
         headers = {"Authorization": f"Bearer {self.api_key}"}
 
-        with self.session.post(self.api_base, headers=headers, json=body) as resp:
+        with self.session.post(
+            self.api_base, headers=headers, json=body, timeout=get_timeout()
+        ) as resp:
             resp_json = resp.json()
             # Log the token usage from the Together API response.
             self.log_usage(resp_json)
@@ -818,7 +1125,11 @@ class TogetherClient(dspy.HFModel):
 
 
 class KamiwazaModel(dspy.OpenAI):
-    """A wrapper class for Kamiwaza API, compatible with OpenAI interface."""
+    """A wrapper class for Kamiwaza API, compatible with OpenAI interface.
+
+    For text models, `batch_generate` sends a list of prompts to the completions endpoint in one request, and with
+    `micro_batch_window_ms` concurrent calls are coalesced into such batched requests.
+    """
 
     def __init__(
         self,
@@ -826,9 +1137,17 @@ class KamiwazaModel(dspy.OpenAI):
         api_key: str = "na",
         api_base: str = "http://turbo.kamiwaza.ai:51222/v1",
         model_type: Literal["chat", "text"] = "chat",
+        max_batch_size: int = 16,
+        micro_batch_window_ms: Optional[float] = None,
         **kwargs,
     ):
-        """Initialize the Kamiwaza model with OpenAI-compatible interface."""
+        """Initialize the Kamiwaza model with OpenAI-compatible interface.
+
+        Args:
+            max_batch_size: Maximum number of prompts per batched request.
+            micro_batch_window_ms: If set, concurrent calls arriving within this window are sent as one batched
+                request. Only supported for text models, since the chat endpoint takes a single conversation.
+        """
         super().__init__(model=model, api_key=api_key, api_base=api_base, model_type=model_type, **kwargs)
         self._token_usage_lock = threading.Lock()
         self.prompt_tokens = 0
@@ -836,6 +1155,16 @@ class KamiwazaModel(dspy.OpenAI):
         self.model = model
         self.api_key = api_key
         self.api_base = api_base
+        self.max_batch_size = max_batch_size
+        self._batch_client = None
+        self._micro_batcher = None
+        if model_type == "text":
+            # dspy.OpenAI sends requests through the global openai client, which other models may reconfigure
+            self._batch_client = OpenAI(base_url=api_base, api_key=api_key)
+            if micro_batch_window_ms is not None:
+                self._micro_batcher = MicroBatcher(
+                    self._generate_batch, max_batch_size, micro_batch_window_ms
+                )
 
     def log_usage(self, response):
         """Log the total tokens from the Kamiwaza API response."""
@@ -844,6 +1173,11 @@ class KamiwazaModel(dspy.OpenAI):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.get("prompt_tokens", 0)
                 self.completion_tokens += usage_data.get("completion_tokens", 0)
+            record_lm_usage(
+                self,
+                usage_data.get("prompt_tokens", 0),
+                usage_data.get("completion_tokens", 0),
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -857,6 +1191,58 @@ class KamiwazaModel(dspy.OpenAI):
         self.completion_tokens = 0
         return usage
 
+    @backoff.on_exception(
+        backoff.expo,
+        ERRORS,
+        max_time=backoff_max_time(1000),
+        on_backoff=[backoff_hdlr, record_retry],
+    )
+    def _generate_batch(self, prompts: List[str], **kwargs) -> List[List[str]]:
+        """Sends the prompts to the completions endpoint in one request. Records usage and history per prompt."""
+        kwargs = {k: v for k, v in kwargs.items() if k != "model_type"}
+        timeout = get_timeout()
+        response = self._batch_client.completions.create(
+            prompt=list(prompts),
+            **kwargs,
+            **({} if timeout is None else {"timeout": timeout}),
+        )
+        prompt_responses = split_completions_response(
+            response.model_dump(), prompts, n=kwargs.get("n", 1), model=self.model
+        )
+        completions = []
+        for prompt, prompt_response in zip(prompts, prompt_responses):
+            self.log_usage(prompt_response)
+            self.history.append(
+                {"prompt": prompt, "response": prompt_response, "kwargs": kwargs}
+            )
+            # like dspy.OpenAI, drop completions cut off by max_tokens unless all of them are
+            choices = [
+                c for c in prompt_response["choices"] if c["finish_reason"] != "length"
+            ] or prompt_response["choices"]
+            completions.append([choice["text"] for choice in choices])
+        return completions
+
+    @track_lm_call
+    def batch_generate(self, prompts: List[str], **kwargs) -> List[List[str]]:
+        """Generates completions for each prompt, sending up to `max_batch_size` prompts per request.
+        Chat models, whose endpoint takes a single conversation, send the prompts concurrently instead.
+        """
+        if self._batch_client is None:
+            return generate_concurrently(self, prompts, self.max_batch_size, **kwargs)
+        kwargs = {**self.kwargs, **kwargs}
+        completions = []
+        for start in range(0, len(prompts), self.max_batch_size):
+            completions.extend(
+                self._generate_batch(
+                    prompts[start : start + self.max_batch_size], **kwargs
+                )
+            )
+        return completions
+
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(
         self,
         prompt: str,
@@ -865,6 +1251,8 @@ class KamiwazaModel(dspy.OpenAI):
         **kwargs,
     ) -> list[dict[str, Any]]:
         """Override the call method to ensure responses are JSON serializable."""
+        if self._micro_batcher is not None:
+            return self._micro_batcher.submit(prompt, **{**self.kwargs, **kwargs})
         response = super().__call__(prompt, only_completed, return_sorted, **kwargs)
         
         # Make the response history JSON serializable
@@ -944,6 +1332,11 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
             with self._token_usage_lock:
                 self.prompt_tokens += usage_data.prompt_token_count
                 self.completion_tokens += usage_data.candidates_token_count
+            record_lm_usage(
+                self,
+                usage_data.prompt_token_count,
+                usage_data.candidates_token_count,
+            )
 
     def get_usage_and_reset(self):
         """Get the total tokens used and reset the token usage."""
@@ -983,15 +1376,19 @@ class GoogleModel(dspy.dsp.modules.lm.LM):
     @backoff.on_exception(
         backoff.expo,
         (Exception,),
-        max_time=1000,
+        max_time=backoff_max_time(1000),
         max_tries=8,
-        on_backoff=backoff_hdlr,
+        on_backoff=[backoff_hdlr, record_retry],
         giveup=giveup_hdlr,
     )
     def request(self, prompt: str, **kwargs):
         """Handles retrieval of completions from Google whilst handling API errors"""
         return self.basic_request(prompt, **kwargs)
 
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    @track_lm_call
     def __call__(
         self,
         prompt: str,
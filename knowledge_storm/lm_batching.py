@@ -0,0 +1,171 @@
+"""
+Batched generation for self-hosted LM backends.
+
+STORM fans out LM calls through threads (per section in article generation, per node in Co-STORM report generation),
+so a self-hosted server receives N concurrent single-prompt requests. Servers such as vLLM take a list of prompts on
+their completions endpoint and schedule the batch far more efficiently. `MicroBatcher` coalesces concurrent calls that
+arrive within a short window into one batched request, and `split_completions_response` turns the batched response back
+into one response per prompt so that usage and history are still recorded per prompt.
+"""
+
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence
+
+from .metrics import InstrumentedThreadPoolExecutor
+from .prompt_budget import count_tokens
+
+
+class _PendingBatch:
+    def __init__(self, kwargs: Dict):
+        self.kwargs = kwargs
+        self.prompts = []
+        self.futures = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batched requests.
+
+    The first call of a batch waits up to `window_ms` for other calls with the same kwargs, or until `max_batch_size`
+    calls are pending, and then runs `batch_fn(prompts, **kwargs)` for all of them on its own thread. `batch_fn` must
+    return one result per prompt. If it raises, every call of the batch raises the same exception.
+
+    Args:
+        batch_fn (Callable): Sends one batched request.
+        max_batch_size (int): Maximum number of prompts per batch.
+        window_ms (float): How long the first call of a batch waits for others to join.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[..., List[Any]],
+        max_batch_size: int = 16,
+        window_ms: float = 10.0,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.window_ms = window_ms
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str, **kwargs):
+        """Adds the prompt to a batch and blocks until the batch returns. Returns the result for this prompt."""
+        # only calls with identical generation parameters can share a request
+        key = json.dumps(kwargs, sort_keys=True, default=str)
+        future = Future()
+        with self._lock:
+            batch = self._pending.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = _PendingBatch(kwargs)
+                self._pending[key] = batch
+            batch.prompts.append(prompt)
+            batch.futures.append(future)
+            if len(batch.prompts) >= self.max_batch_size:
+                # later calls start a new batch
+                del self._pending[key]
+                batch.full.set()
+        if is_leader:
+            batch.full.wait(self.window_ms / 1000)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _PendingBatch):
+        try:
+            results = self.batch_fn(batch.prompts, **batch.kwargs)
+            if len(results) != len(batch.prompts):
+                raise ValueError(
+                    f"Expected {len(batch.prompts)} results from the batched request, got {len(results)}."
+                )
+        except BaseException as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+
+def apportion(total: int, weights: Sequence[float]) -> List[int]:
+    """Splits an integer total in proportion to the weights, using the largest remainder so the parts sum to the total."""
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights = [1] * len(weights)
+        weight_sum = len(weights)
+    shares = [total * w / weight_sum for w in weights]
+    parts = [int(share) for share in shares]
+    remainder_order = sorted(
+        range(len(shares)), key=lambda i: shares[i] - parts[i], reverse=True
+    )
+    for i in remainder_order[: total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+def split_completions_response(
+    response: Dict, prompts: Sequence[str], n: int = 1, model: str = ""
+) -> List[Dict]:
+    """
+    Splits the response of an OpenAI-compatible completions request with a list of prompts into one response per
+    prompt. Choice `i * n + j` is the j-th completion of prompt i. The API reports the usage of the whole batch, so it
+    is apportioned to the prompts by their estimated token counts.
+
+    Args:
+        response (dict): The batched response, e.g. from `model_dump()`.
+        prompts (Sequence[str]): The prompts of the batch, in request order.
+        n (int): Number of completions per prompt.
+        model (str): Model name used to estimate token counts.
+    """
+    choices = sorted(response.get("choices", []), key=lambda c: c.get("index", 0))
+    choices_per_prompt = [
+        [{**c, "index": j} for j, c in enumerate(choices[i * n : (i + 1) * n])]
+        for i in range(len(prompts))
+    ]
+    usage = response.get("usage") or {}
+    prompt_tokens = apportion(
+        usage.get("prompt_tokens") or 0,
+        [count_tokens(prompt, model) for prompt in prompts],
+    )
+    completion_tokens = apportion(
+        usage.get("completion_tokens") or 0,
+        [
+            sum(count_tokens(c.get("text") or "", model) for c in prompt_choices)
+            for prompt_choices in choices_per_prompt
+        ],
+    )
+    return [
+        {
+            "id": response.get("id"),
+            "model": response.get("model"),
+            "choices": choices_per_prompt[i],
+            "usage": {
+                "prompt_tokens": prompt_tokens[i],
+                "completion_tokens": completion_tokens[i],
+                "total_tokens": prompt_tokens[i] + completion_tokens[i],
+            },
+            "batch_size": len(prompts),
+        }
+        for i in range(len(prompts))
+    ]
+
+
+def generate_concurrently(
+    lm, prompts: Sequence[str], max_workers: int = 8, **kwargs
+) -> List[List[str]]:
+    """
+    Calls `lm(prompt, **kwargs)` for each prompt on a thread pool, for backends whose API takes one prompt per request.
+    Returns the completions of each prompt in order.
+    """
+    if not prompts:
+        return []
+    with InstrumentedThreadPoolExecutor(
+        "lm_batch", max_workers=min(max_workers, len(prompts))
+    ) as executor:
+        return list(executor.map(lambda prompt: lm(prompt, **kwargs), prompts))
@@ -0,0 +1,267 @@
+"""
+Bounded in-memory LM call history with streaming to disk.
+
+By default every LM client appends the full prompt, the raw response and the kwargs of each call to its `history` list,
+which grows without bound over long Co-STORM sessions and batch runs. `LMConfigs.set_history_sink` replaces these lists
+with `LMHistoryBuffer`s, ring buffers that keep only the most recent calls in memory and stream every call to an
+`LMHistorySink` as it happens, so memory stays flat and the history is on disk even if the run crashes.
+"""
+
+import copy
+import gzip
+import json
+import random
+import threading
+import zlib
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence
+
+
+def to_serializable(value: Any) -> Any:
+    """
+    Converts an LM call record into JSON serializable values. Response objects of the API clients are converted with
+    `model_dump` (OpenAI, Anthropic), `to_dict` (Google) or their `__dict__`, and anything else with `str`.
+    """
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(key): to_serializable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_serializable(item) for item in value]
+    for method_name in ("model_dump", "to_dict"):
+        method = getattr(value, method_name, None)
+        if callable(method):
+            try:
+                return to_serializable(method())
+            except Exception:
+                pass
+    if hasattr(value, "__dict__"):
+        return to_serializable(
+            {key: item for key, item in vars(value).items() if not key.startswith("_")}
+        )
+    return str(value)
+
+
+class LMHistorySink:
+    """Receives every LM call record. Subclasses must be safe to call from multiple threads."""
+
+    def write(self, record: Dict):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JSONLHistorySink(LMHistorySink):
+    """
+    Streams LM call records to a JSON Lines file, optionally compressed.
+
+    Each record is flushed as soon as it is written, so the file holds every completed call even if the process
+    crashes. Compressed files are flushed at block boundaries; use `read_lm_history` to read files that were not
+    closed, since `gzip.open` rejects a stream without its end marker.
+
+    Args:
+        path (str): Output file. An existing file is overwritten.
+        compression (str, optional): None, "gzip" or "zstd". By default inferred from a ".gz" or ".zst" suffix.
+            "zstd" requires `pip install zstandard`.
+        sample_rate (float): Fraction of calls to keep, between 0 and 1.
+        redact_fields (Sequence[str]): Keys whose values are replaced by "[REDACTED]" wherever they appear in a record,
+            e.g. ("prompt", "kwargs").
+        redact (Callable, optional): Called with each serialized record after `redact_fields` are applied. Returns the
+            record to write, or None to drop it.
+        seed (int, optional): Seed of the sampling.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str] = "infer",
+        sample_rate: float = 1.0,
+        redact_fields: Sequence[str] = (),
+        redact: Optional[Callable[[Dict], Optional[Dict]]] = None,
+        seed: Optional[int] = None,
+    ):
+        if compression == "infer":
+            if path.endswith(".gz"):
+                compression = "gzip"
+            elif path.endswith(".zst"):
+                compression = "zstd"
+            else:
+                compression = None
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unsupported compression {compression}.")
+        self.path = path
+        self.compression = compression
+        self.sample_rate = sample_rate
+        self.redact_fields = set(redact_fields)
+        self.redact = redact
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._raw_file = None
+        self._zstd_flush_block = None
+        if compression == "gzip":
+            self._file = gzip.open(path, "wb")
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError as err:
+                raise ImportError(
+                    "zstd compression requires `pip install zstandard`."
+                ) from err
+            self._raw_file = open(path, "wb")
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw_file)
+            self._zstd_flush_block = zstandard.FLUSH_BLOCK
+        else:
+            self._file = open(path, "wb")
+
+    def _redact_fields(self, value):
+        if isinstance(value, dict):
+            return {
+                key: (
+                    "[REDACTED]"
+                    if key in self.redact_fields
+                    else self._redact_fields(item)
+                )
+                for key, item in value.items()
+            }
+        if isinstance(value, list):
+            return [self._redact_fields(item) for item in value]
+        return value
+
+    def write(self, record: Dict):
+        if self.sample_rate < 1 and self._random.random() >= self.sample_rate:
+            return
+        record = to_serializable(record)
+        if self.redact_fields:
+            record = self._redact_fields(record)
+        if self.redact is not None:
+            record = self.redact(record)
+            if record is None:
+                return
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._flush()
+
+    def _flush(self):
+        if self._zstd_flush_block is not None:
+            self._file.flush(self._zstd_flush_block)
+            self._raw_file.flush()
+        else:
+            self._file.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            if self._raw_file is not None:
+                self._raw_file.close()
+            self._file = None
+
+
+class LMHistoryBuffer(deque):
+    """
+    A drop-in replacement for the `history` list of an LM client that keeps at most `maxlen` recent calls in memory
+    (all calls if None, none if 0) and writes every appended call to `sink`.
+    """
+
+    def __init__(
+        self,
+        maxlen: Optional[int] = None,
+        sink: Optional[LMHistorySink] = None,
+        iterable=(),
+    ):
+        super().__init__(iterable, maxlen)
+        self.sink = sink
+
+    def append(self, record):
+        if self.sink is not None:
+            try:
+                self.sink.write(record)
+            except Exception as e:
+                print(f"Error writing LM history record: {e}")
+        super().append(record)
+
+    def __getitem__(self, index):
+        # dspy reads the history with slices, e.g. in inspect_history
+        if isinstance(index, slice):
+            return list(self)[index]
+        return super().__getitem__(index)
+
+    def __copy__(self):
+        return LMHistoryBuffer(self.maxlen, self.sink, self)
+
+    def __deepcopy__(self, memo):
+        # the sink holds an open file and is shared, not copied
+        return LMHistoryBuffer(self.maxlen, self.sink, copy.deepcopy(list(self), memo))
+
+    def __reduce__(self):
+        return (LMHistoryBuffer, (self.maxlen, None, list(self)))
+
+
+def read_lm_history(
+    path: str, compression: Optional[str] = "infer", chunk_size: int = 1 << 20
+) -> Iterator[Dict]:
+    """
+    Reads the records written by `JSONLHistorySink`, including from files of runs that did not close the sink. The file
+    is decompressed and parsed in chunks of `chunk_size` bytes, so memory does not grow with the file size.
+    """
+    if compression == "infer":
+        if path.endswith(".gz"):
+            compression = "gzip"
+        elif path.endswith(".zst"):
+            compression = "zstd"
+        else:
+            compression = None
+    decompressor = None
+    if compression == "gzip":
+        # unlike `gzip.open`, a decompression object accepts a stream without its end marker
+        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    elif compression == "zstd":
+        import zstandard
+
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    pending = b""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                record = _parse_record(line)
+                if record is not None:
+                    yield record
+    record = _parse_record(pending)
+    if record is not None:
+        yield record
+
+
+def _parse_record(line: bytes) -> Optional[Dict]:
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line.decode("utf-8"))
+    except ValueError:
+        # the last line of a crashed run may be incomplete
+        return None
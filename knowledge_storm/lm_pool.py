@@ -0,0 +1,333 @@
+"""
+Load balancing across replicas of the same LM.
+
+`LMEndpointPool` wraps several LM clients, one per replica (e.g. `VLLMClient`s on different ports or `KamiwazaModel`s
+with different `api_base`s), behind the interface of a single LM so that it can be set on `STORMWikiLMConfigs` or
+`CollaborativeStormLMConfigs` in place of one model. Each call goes to the replica with the fewest outstanding calls or
+the lowest expected latency. Replicas that keep failing, or fail the optional active health check, are ejected for a
+backoff period and re-admitted on probation afterwards.
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+import dspy
+import requests
+
+from .metrics import (
+    LM_REPLICA_ADMITTED,
+    LM_REPLICA_DURATION,
+    LM_REPLICA_EJECTIONS,
+    LM_REPLICA_OUTSTANDING,
+    LM_REPLICA_REQUESTS,
+)
+from .deadline import deadline_lm_call
+from .hedging import hedge_lm_call
+from .prompt_budget import _get_lm_model_name
+from .singleflight import coalesce_lm_call
+
+logger = logging.getLogger(__name__)
+
+
+def _get_health_check_url(lm) -> Optional[str]:
+    if hasattr(lm, "ports") and hasattr(lm, "url"):
+        # TGIClient
+        return f"{lm.url}:{lm.ports[0]}/health"
+    base_url = getattr(lm, "api_base", None) or getattr(lm, "base_url", None)
+    if not base_url:
+        return None
+    base_url = str(base_url).rstrip("/")
+    if isinstance(lm, dspy.OllamaLocal):
+        return f"{base_url}/api/tags"
+    # VLLMClient appends chat/ to the base URL of chat models
+    return re.sub(r"/chat$", "", base_url) + "/models"
+
+
+def check_endpoint_health(lm, timeout: float = 5.0) -> bool:
+    """
+    Active health check for `LMEndpointPool(health_check=check_endpoint_health)`. Sends a GET request to the model list of OpenAI-compatible servers
+    (vLLM, Kamiwaza), the /health endpoint of TGI or the tag list of Ollama, and treats any response other than a server
+    error as healthy. Clients without a known endpoint are always considered healthy.
+    """
+    url = _get_health_check_url(lm)
+    if url is None:
+        return True
+    try:
+        response = requests.get(url, timeout=timeout)
+    except requests.RequestException:
+        return False
+    return response.status_code < 500
+
+
+def _get_replica_name(lm, idx: int) -> str:
+    if hasattr(lm, "ports") and hasattr(lm, "url"):
+        return f"{lm.url}:{lm.ports[0]}"
+    base_url = getattr(lm, "api_base", None) or getattr(lm, "base_url", None)
+    return str(base_url) if base_url else f"replica_{idx}"
+
+
+class _Replica:
+    def __init__(self, lm, name: str):
+        self.lm = lm
+        self.name = name
+        self.outstanding = 0
+        self.latency_ewma: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejection_count = 0
+        # a re-admitted replica is ejected again on its first failure
+        self.on_probation = False
+
+    def is_admitted(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class LMEndpointPool(dspy.dsp.modules.lm.LM):
+    """
+    Routes LM calls across replicas of the same model.
+
+    Usage:
+        lm = LMEndpointPool([VLLMClient(model=model, port=port, max_tokens=500) for port in (8000, 8001, 8002)])
+        lm_configs.set_article_gen_lm(lm)
+
+    Usage, history and `kwargs` are shared with the replicas, so `LMConfigs` sees the pool as one model. A failed call
+    is retried on another replica. A replica is ejected after `max_consecutive_failures` failed calls in a row or a
+    failed health check, for `ejection_seconds` doubled on every ejection in a row (at most `max_ejection_seconds`).
+    Health checks re-admit ejected replicas early once they pass. When every replica is ejected, calls go to the replica
+    that is due to be re-admitted first rather than failing.
+
+    Args:
+        lms (List): One LM client per replica. The first one's `kwargs` are used as the pool's.
+        routing (str): "least_outstanding" sends each call to the replica with the fewest calls in flight. "latency"
+            sends it to the replica with the lowest (outstanding calls + 1) * moving average latency.
+        names (List[str], optional): Replica names in the metrics. Defaults to the endpoint URLs.
+        max_consecutive_failures (int): Failed calls in a row that eject a replica.
+        ejection_seconds (float): Initial ejection period.
+        max_ejection_seconds (float): Maximum ejection period.
+        max_attempts (int): Number of replicas a call is tried on before its error is raised. Must be at least 1.
+        health_check (Callable, optional): Called with a replica's LM client, returns whether it is healthy, e.g.
+            `check_endpoint_health`. If set, a daemon thread checks every replica each `health_check_interval` seconds
+            until `close()` is called. None (the default) disables active health checks; replicas are then only
+            ejected on failed calls.
+        health_check_interval (float): Seconds between active health checks.
+    """
+
+    def __init__(
+        self,
+        lms: List,
+        routing: Literal["least_outstanding", "latency"] = "least_outstanding",
+        names: Optional[List[str]] = None,
+        max_consecutive_failures: int = 3,
+        ejection_seconds: float = 30.0,
+        max_ejection_seconds: float = 300.0,
+        max_attempts: int = 2,
+        health_check: Optional[Callable[[Any], bool]] = None,
+        health_check_interval: float = 10.0,
+    ):
+        if not lms:
+            raise ValueError("LMEndpointPool requires at least one LM.")
+        if routing not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unsupported routing {routing}.")
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1.")
+        names = names or [_get_replica_name(lm, idx) for idx, lm in enumerate(lms)]
+        self._replicas = [_Replica(lm, name) for lm, name in zip(lms, names)]
+        super().__init__(model=_get_lm_model_name(lms[0]))
+        self.kwargs = lms[0].kwargs
+        self.model = _get_lm_model_name(lms[0])
+        self.provider = getattr(lms[0], "provider", "default")
+        self.pool_name = self.model or "lm_pool"
+        self.routing = routing
+        self.max_consecutive_failures = max_consecutive_failures
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.max_attempts = min(max_attempts, len(lms))
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        for replica in self._replicas:
+            # the pool coalesces and hedges calls before routing them, so hedges can go to another replica
+            replica.lm.coalesce_requests = False
+            replica.lm.hedging_policy = None
+            LM_REPLICA_ADMITTED.labels(pool=self.pool_name, replica=replica.name).set(1)
+
+        self._stop_event = threading.Event()
+        self._health_check_thread = None
+        if health_check is not None and health_check_interval:
+            self._health_check_thread = threading.Thread(
+                target=self._run_health_checks, daemon=True
+            )
+            self._health_check_thread.start()
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, value):
+        # replicas append to the pool's history, including after LMConfigs replaces it
+        self._history = value
+        for replica in self.__dict__.get("_replicas", []):
+            replica.lm.history = value
+
+    def _acquire_replica(self, exclude: List[_Replica]) -> Optional[_Replica]:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self._replicas if r not in exclude]
+            if not candidates:
+                return None
+            admitted = [r for r in candidates if r.is_admitted(now)]
+            if admitted:
+                candidates = admitted
+            else:
+                candidates = [min(candidates, key=lambda r: r.ejected_until)]
+            if self.routing == "latency":
+
+                def cost(r):
+                    # replicas without a measurement yet are tried first
+                    return (r.outstanding + 1) * (r.latency_ewma or 0.0)
+
+            else:
+
+                def cost(r):
+                    return r.outstanding
+
+            min_cost = min(cost(r) for r in candidates)
+            replica = self._random.choice(
+                [r for r in candidates if cost(r) == min_cost]
+            )
+            replica.outstanding += 1
+        LM_REPLICA_OUTSTANDING.labels(pool=self.pool_name, replica=replica.name).inc()
+        return replica
+
+    def _eject(self, replica: _Replica, reason: str):
+        """Must be called with the lock held."""
+        ejection_seconds = min(
+            self.ejection_seconds * 2**replica.ejection_count, self.max_ejection_seconds
+        )
+        replica.ejected_until = time.monotonic() + ejection_seconds
+        replica.ejection_count += 1
+        replica.consecutive_failures = 0
+        replica.on_probation = True
+        LM_REPLICA_EJECTIONS.labels(pool=self.pool_name, replica=replica.name).inc()
+        LM_REPLICA_ADMITTED.labels(pool=self.pool_name, replica=replica.name).set(0)
+        logger.warning(
+            f"Ejecting LM replica {replica.name} for {ejection_seconds:.0f}s: {reason}"
+        )
+
+    def _release_replica(self, replica: _Replica, elapsed: float, error=None):
+        labels = {"pool": self.pool_name, "replica": replica.name}
+        LM_REPLICA_OUTSTANDING.labels(**labels).dec()
+        LM_REPLICA_REQUESTS.labels(**labels, status="error" if error else "ok").inc()
+        LM_REPLICA_DURATION.labels(**labels).observe(elapsed)
+        with self._lock:
+            replica.outstanding -= 1
+            if error is None:
+                replica.consecutive_failures = 0
+                replica.ejection_count = 0
+                replica.on_probation = False
+                replica.latency_ewma = (
+                    elapsed
+                    if replica.latency_ewma is None
+                    else 0.7 * replica.latency_ewma + 0.3 * elapsed
+                )
+                return
+            replica.consecutive_failures += 1
+            if replica.is_admitted(time.monotonic()) and (
+                replica.on_probation
+                or replica.consecutive_failures >= self.max_consecutive_failures
+            ):
+                self._eject(replica, str(error))
+
+    def _route(self, func: Callable[[Any], Any]):
+        """Calls `func` with the LM client of a replica, trying up to `max_attempts` replicas."""
+        tried = []
+        last_error = None
+        for _ in range(self.max_attempts):
+            replica = self._acquire_replica(tried)
+            if replica is None:
+                break
+            tried.append(replica)
+            start = time.perf_counter()
+            try:
+                result = func(replica.lm)
+            except Exception as e:
+                self._release_replica(replica, time.perf_counter() - start, error=e)
+                logger.warning(f"LM replica {replica.name} failed: {e}")
+                last_error = e
+                continue
+            self._release_replica(replica, time.perf_counter() - start)
+            return result
+        raise last_error
+
+    def basic_request(self, prompt, **kwargs):
+        return self._route(lambda lm: lm.basic_request(prompt, **kwargs))
+
+    @coalesce_lm_call
+    @deadline_lm_call
+    @hedge_lm_call
+    def __call__(self, prompt, *args, **kwargs):
+        return self._route(lambda lm: lm(prompt, *args, **kwargs))
+
+    def batch_generate(self, prompts: List[str], **kwargs) -> List[List[str]]:
+        """Sends the whole batch to one replica. Requires replicas with `batch_generate`."""
+        return self._route(lambda lm: lm.batch_generate(prompts, **kwargs))
+
+    def check_health(self):
+        """Runs the health check on every replica, ejecting failing ones and re-admitting ejected ones that pass."""
+        for replica in self._replicas:
+            try:
+                healthy = self.health_check(replica.lm)
+            except Exception as e:
+                logger.warning(
+                    f"Error checking health of LM replica {replica.name}: {e}"
+                )
+                healthy = False
+            with self._lock:
+                is_admitted = replica.is_admitted(time.monotonic())
+                if not healthy and is_admitted:
+                    self._eject(replica, "failed health check")
+                elif healthy and not is_admitted:
+                    replica.ejected_until = 0.0
+                    LM_REPLICA_ADMITTED.labels(
+                        pool=self.pool_name, replica=replica.name
+                    ).set(1)
+
+    def _run_health_checks(self):
+        while not self._stop_event.wait(self.health_check_interval):
+            self.check_health()
+
+    def close(self):
+        """Stops the active health checks."""
+        self._stop_event.set()
+
+    def get_replica_stats(self) -> List[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": replica.name,
+                    "admitted": replica.is_admitted(now),
+                    "outstanding": replica.outstanding,
+                    "latency_ewma_seconds": replica.latency_ewma,
+                    "ejection_count": replica.ejection_count,
+                }
+                for replica in self._replicas
+            ]
+
+    def get_usage_and_reset(self):
+        """Get the total tokens used by all replicas and reset the token usage."""
+        usage = {}
+        for replica in self._replicas:
+            if not hasattr(replica.lm, "get_usage_and_reset"):
+                continue
+            for model_name, tokens in replica.lm.get_usage_and_reset().items():
+                model_usage = usage.setdefault(model_name, {})
+                for token_type, count in tokens.items():
+                    model_usage[token_type] = model_usage.get(token_type, 0) + count
+        return usage
@@ -1,17 +1,39 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
 from contextlib import contextmanager
 import time
 import pytz
+from collections import deque
 from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 # Define California timezone
 CALIFORNIA_TZ = pytz.timezone("America/Los_Angeles")
 
+# span ids are unique across LoggingWrapper instances so that merged traces stay consistent
+_span_ids = itertools.count(1)
+_trace_ids = itertools.count(1)
+# the innermost active span of the current thread or task
+_current_span = contextvars.ContextVar("storm_current_span", default=None)
+
+
+def _ns_to_datetime(time_ns: int) -> datetime:
+    return datetime.fromtimestamp(time_ns / 1e9, pytz.utc)
+
 
 class EventLog:
+    """Timing of the events with the same name in a pipeline stage, summed over all occurrences."""
+
     def __init__(self, event_name):
         self.event_name = event_name
         self.start_time = None
         self.end_time = None
+        self.total_time = 0.0
+        self.count = 0
         self.child_events = {}
 
     def record_start_time(self):
@@ -24,7 +46,20 @@ class EventLog:
             pytz.utc
         )  # Store in UTC for consistent timezone conversion
 
+    def add_occurrence(self, start_time: datetime, end_time: datetime):
+        """Adds one occurrence of the event. Start and end time span the earliest start and the latest end."""
+        self.start_time = (
+            start_time if self.start_time is None else min(self.start_time, start_time)
+        )
+        self.end_time = (
+            end_time if self.end_time is None else max(self.end_time, end_time)
+        )
+        self.total_time += (end_time - start_time).total_seconds()
+        self.count += 1
+
     def get_total_time(self):
+        if self.count:
+            return self.total_time
         if self.start_time and self.end_time:
             return (self.end_time - self.start_time).total_seconds()
         return 0
@@ -52,13 +87,126 @@ class EventLog:
         return self.child_events
 
 
+class Span:
+    """
+    A timed operation in a trace. Spans form a tree through `parent_id`; the root of each tree is a pipeline stage.
+
+    Attributes:
+        span_id (int): Unique id of the span.
+        parent_id (int, optional): Id of the enclosing span, None for pipeline stages.
+        trace_id (int): Id of the LoggingWrapper that recorded the span.
+        name (str): Event or pipeline stage name.
+        pipeline_stage (str): Pipeline stage the span belongs to.
+        thread_id (int), thread_name (str): Thread the span ran on.
+        attributes (dict): Free-form metadata such as model, tokens, query count or bytes.
+        error (str, optional): Error raised inside the span, if any.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pipeline_stage: str,
+        trace_id: int,
+        parent_id: Optional[int] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.trace_id = trace_id
+        self.name = name
+        self.pipeline_stage = pipeline_stage
+        current_thread = threading.current_thread()
+        self.thread_id = current_thread.ident
+        self.thread_name = current_thread.name
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_to_attribute(self, key: str, value):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self, error: Optional[BaseException] = None):
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end_time_ns = time.time_ns()
+
+    def is_active(self):
+        return self.end_time_ns is None
+
+    def get_duration_seconds(self):
+        if self.end_time_ns is None:
+            return 0
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "pipeline_stage": self.pipeline_stage,
+            "thread_id": self.thread_id,
+            "thread_name": self.thread_name,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_seconds": self.get_duration_seconds(),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def _flatten_lm_usage(lm_usage: Dict[str, Dict]) -> List[Tuple[str, Dict]]:
+    """
+    Returns (model, usage) pairs. STORM reports usage per model, while Co-STORM reports it per LM attribute and then
+    per model, e.g. {"question_answering_lm": {"gpt-4o": {"prompt_tokens": ...}}}.
+    """
+    model_usage = []
+    for name, usage in lm_usage.items():
+        if "prompt_tokens" in usage or "completion_tokens" in usage:
+            model_usage.append((name, usage))
+        else:
+            model_usage.extend(usage.items())
+    return model_usage
+
+
+def _to_otel_attribute_value(value):
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)) and all(
+        isinstance(item, (str, bool, int, float)) for item in value
+    ):
+        return list(value)
+    return json.dumps(value, default=str)
+
+
 class LoggingWrapper:
-    def __init__(self, lm_config):
+    """
+    Records pipeline stages, LM usage and a trace of timed events.
+
+    `log_event` is safe to call from multiple threads. Every event becomes a `Span` whose parent is the innermost span
+    active in the calling thread or task, or the pipeline stage if there is none; use `bind_span_context` to keep the
+    parent when handing work to a thread pool. The latest `max_spans` finished spans are kept until `reset_trace` and
+    can be exported as JSON, in the Chrome trace-event format (viewable in Perfetto or chrome://tracing) or to
+    OpenTelemetry.
+
+    LM usage and history are collected from `lm_config` at the end of each pipeline stage. Pass `lm_config=None` for a
+    wrapper that shares LM clients with another one and must leave their usage to it.
+    """
+
+    def __init__(self, lm_config, max_spans: int = 100000):
         self.logging_dict = {}
         self.lm_config = lm_config
         self.current_pipeline_stage = None
-        self.event_stack = []
         self.pipeline_stage_active = False
+        self.trace_id = next(_trace_ids)
+        # bounded so that a long-lived session does not keep every span
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self._stage_span: Optional[Span] = None
+        self._lock = threading.RLock()
 
     def _pipeline_stage_start(self, pipeline_stage: str):
         if self.pipeline_stage_active:
@@ -72,84 +220,79 @@ class LoggingWrapper:
             "lm_usage": {},
             "lm_history": [],
             "query_count": 0,
+            "placement_stats": {"embedding_only_count": 0, "lm_choice_count": 0},
         }
+        self._stage_span = Span(
+            name=pipeline_stage, pipeline_stage=pipeline_stage, trace_id=self.trace_id
+        )
         self.pipeline_stage_active = True
 
-    def _event_start(self, event_name: str):
-        if not self.pipeline_stage_active:
-            raise RuntimeError("No pipeline stage is currently active.")
-
-        if not self.event_stack and self.current_pipeline_stage:
-            # Top-level event (directly under the pipeline stage)
-            if (
-                event_name
-                not in self.logging_dict[self.current_pipeline_stage]["time_usage"]
-            ):
-                event = EventLog(event_name=event_name)
-                event.record_start_time()
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ] = event
-                self.event_stack.append(event)
-            else:
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ].record_start_time()
-        elif self.event_stack:
-            # Nested event (under another event)
-            parent_event = self.event_stack[-1]
-            if event_name not in parent_event.get_child_events():
-                event = EventLog(event_name=event_name)
-                event.record_start_time()
-                parent_event.add_child_event(event)
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ] = event
-                self.event_stack.append(event)
-            else:
-                parent_event.get_child_events()[event_name].record_start_time()
-        else:
-            raise RuntimeError(
-                "Cannot start an event without an active pipeline stage or parent event."
-            )
+    def _get_current_span(self) -> Optional[Span]:
+        span = _current_span.get()
+        if span is not None and span.trace_id == self.trace_id and span.is_active():
+            return span
+        # no span of this wrapper in the current context, e.g. in a thread started without bind_span_context
+        return self._stage_span
 
-    def _event_end(self, event_name: str):
+    def _event_start(self, event_name: str, attributes=None) -> Span:
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active.")
 
-        if not self.event_stack:
-            raise RuntimeError("No parent event is currently active.")
-
-        if self.event_stack:
-            current_event_log = self.event_stack[-1]
-            if event_name in current_event_log.get_child_events():
-                current_event_log.get_child_events()[event_name].record_end_time()
-            elif (
-                event_name
-                in self.logging_dict[self.current_pipeline_stage]["time_usage"]
-            ):
-                self.logging_dict[self.current_pipeline_stage]["time_usage"][
-                    event_name
-                ].record_end_time()
-            else:
-                raise AssertionError(
-                    f"Failure to record end time for event {event_name}. Start time is not recorded."
-                )
-            if current_event_log.event_name == event_name:
-                self.event_stack.pop()
-        else:
-            raise RuntimeError("Cannot end an event without an active parent event.")
+        parent = self._get_current_span()
+        return Span(
+            name=event_name,
+            pipeline_stage=self.current_pipeline_stage,
+            trace_id=self.trace_id,
+            parent_id=parent.span_id if parent is not None else None,
+            attributes=attributes,
+        )
 
-    def _pipeline_stage_end(self):
+    def _event_end(self, span: Span, error: Optional[BaseException] = None):
+        span.end(error=error)
+        with self._lock:
+            self.spans.append(span)
+            pipeline_log = self.logging_dict.get(span.pipeline_stage)
+            if pipeline_log is None:
+                # the stage was dumped while the event was running
+                return
+            time_usage = pipeline_log["time_usage"]
+            if span.name not in time_usage:
+                time_usage[span.name] = EventLog(event_name=span.name)
+            time_usage[span.name].add_occurrence(
+                _ns_to_datetime(span.start_time_ns), _ns_to_datetime(span.end_time_ns)
+            )
+
+    def _pipeline_stage_end(self, error: Optional[BaseException] = None):
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active to end.")
 
-        self.logging_dict[self.current_pipeline_stage][
-            "lm_usage"
-        ] = self.lm_config.collect_and_reset_lm_usage()
-        self.logging_dict[self.current_pipeline_stage][
-            "lm_history"
-        ] = self.lm_config.collect_and_reset_lm_history()
+        lm_usage, lm_history = {}, []
+        if self.lm_config is not None:
+            lm_usage = self.lm_config.collect_and_reset_lm_usage()
+            lm_history = self.lm_config.collect_and_reset_lm_history()
+        self.logging_dict[self.current_pipeline_stage]["lm_usage"] = lm_usage
+        self.logging_dict[self.current_pipeline_stage]["lm_history"] = lm_history
+        model_usage = _flatten_lm_usage(lm_usage)
+        self._stage_span.set_attributes(
+            models=sorted({model for model, _ in model_usage}),
+            prompt_tokens=sum(
+                usage.get("prompt_tokens", 0) for _, usage in model_usage
+            ),
+            completion_tokens=sum(
+                usage.get("completion_tokens", 0) for _, usage in model_usage
+            ),
+            coalesced_requests=sum(
+                usage.get("coalesced_requests", 0) for _, usage in model_usage
+            ),
+            hedged_requests=sum(
+                usage.get("hedged_requests", 0) for _, usage in model_usage
+            ),
+            query_count=self.logging_dict[self.current_pipeline_stage]["query_count"],
+        )
+        self._stage_span.end(error=error)
+        with self._lock:
+            self.spans.append(self._stage_span)
+        self._stage_span = None
         self.pipeline_stage_active = False
 
     def add_query_count(self, count):
@@ -158,16 +301,80 @@ class LoggingWrapper:
                 "No pipeline stage is currently active to add query count."
             )
 
-        self.logging_dict[self.current_pipeline_stage]["query_count"] += count
+        with self._lock:
+            self.logging_dict[self.current_pipeline_stage]["query_count"] += count
+            span = self._get_current_span()
+            if span is not None and span is not self._stage_span:
+                span.add_to_attribute("query_count", count)
+
+    def add_placement_stats(self, placement_stats):
+        if not self.pipeline_stage_active:
+            raise RuntimeError(
+                "No pipeline stage is currently active to add placement stats."
+            )
+
+        with self._lock:
+            stage_placement_stats = self.logging_dict[self.current_pipeline_stage][
+                "placement_stats"
+            ]
+            for key, count in placement_stats.items():
+                stage_placement_stats[key] = stage_placement_stats.get(key, 0) + count
+
+    def add_span_attributes(self, **attributes):
+        """Sets attributes on the innermost active span of the current thread or task."""
+        span = self._get_current_span()
+        if span is not None:
+            with self._lock:
+                span.set_attributes(**attributes)
+
+    def merge_logging_and_reset(self, other: "LoggingWrapper"):
+        """Move the finished pipeline stages and spans logged by another LoggingWrapper into this one."""
+        with other._lock:
+            logging_dict = dict(other.logging_dict)
+            spans = list(other.spans)
+            other.logging_dict.clear()
+            other.spans.clear()
+        with self._lock:
+            self.logging_dict.update(logging_dict)
+            self.spans.extend(spans)
+
+    def bind_span_context(self, func: Callable) -> Callable:
+        """
+        Returns a callable that runs `func` with the span active at the time of binding as its parent span.
+        Threads do not inherit the span context, so wrap functions submitted to a thread pool with it.
+        """
+        parent = self._get_current_span()
+
+        @functools.wraps(func)
+        def run_with_span_context(*args, **kwargs):
+            token = _current_span.set(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current_span.reset(token)
+
+        return run_with_span_context
 
     @contextmanager
-    def log_event(self, event_name):
+    def log_event(self, event_name, **attributes):
+        """
+        Times the enclosed block as a span nested under the current span. Keyword arguments are recorded as span
+        attributes; more can be added from inside the block with `add_span_attributes` or on the yielded span.
+        """
         if not self.pipeline_stage_active:
             raise RuntimeError("No pipeline stage is currently active.")
 
-        self._event_start(event_name)
-        yield
-        self._event_end(event_name)
+        span = self._event_start(event_name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self._event_end(span, error=e)
+            raise
+        else:
+            self._event_end(span)
+        finally:
+            _current_span.reset(token)
 
     @contextmanager
     def log_pipeline_stage(self, pipeline_stage):
@@ -178,16 +385,164 @@ class LoggingWrapper:
             self._pipeline_stage_end()
 
         start_time = time.time()
+        error = None
         try:
             self._pipeline_stage_start(pipeline_stage)
             yield
         except Exception as e:
             print(f"Error occurred during pipeline stage '{pipeline_stage}': {e}")
+            error = e
+            raise
         finally:
             self.logging_dict[self.current_pipeline_stage]["total_wall_time"] = (
                 time.time() - start_time
             )
-            self._pipeline_stage_end()
+            self._pipeline_stage_end(error=error)
+
+    def get_trace(self) -> List[Dict[str, Any]]:
+        """Returns the finished spans as dictionaries, ordered by start time."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: (s.start_time_ns, s.span_id))
+            return [span.to_dict() for span in spans]
+
+    def export_trace_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.get_trace(), f, indent=2, default=str)
+
+    def get_chrome_trace(self) -> Dict[str, Any]:
+        """
+        Returns the trace in the Chrome trace-event format. Each thread gets its own track, and a flow arrow links a
+        span to its parent when the two ran on different threads, so the critical path can be followed across threads.
+        """
+        pid = os.getpid()
+        trace_events = []
+        thread_names = {}
+        spans_by_id = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            spans_by_id[span.span_id] = span
+            thread_names[span.thread_id] = span.thread_name
+            trace_events.append(
+                {
+                    "name": span.name,
+                    "cat": span.pipeline_stage,
+                    "ph": "X",
+                    "ts": span.start_time_ns / 1000,
+                    "dur": (span.end_time_ns - span.start_time_ns) / 1000,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": {
+                        "span_id": span.span_id,
+                        "parent_id": span.parent_id,
+                        "error": span.error,
+                        **span.attributes,
+                    },
+                }
+            )
+        for span in spans:
+            parent = spans_by_id.get(span.parent_id)
+            if parent is None or parent.thread_id == span.thread_id:
+                continue
+            for phase, thread_id in (("s", parent.thread_id), ("f", span.thread_id)):
+                flow_event = {
+                    "name": "spawn",
+                    "cat": "flow",
+                    "ph": phase,
+                    "id": span.span_id,
+                    "ts": span.start_time_ns / 1000,
+                    "pid": pid,
+                    "tid": thread_id,
+                }
+                if phase == "f":
+                    flow_event["bp"] = "e"
+                trace_events.append(flow_event)
+        for thread_id, thread_name in thread_names.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread_id,
+                    "args": {"name": thread_name},
+                }
+            )
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.get_chrome_trace(), f, default=str)
+
+    def export_to_opentelemetry(self, tracer=None) -> bool:
+        """
+        Replays the finished spans into OpenTelemetry with their original timestamps and parent links.
+
+        Args:
+            tracer: OpenTelemetry tracer to use. Defaults to the `knowledge_storm` tracer of the global tracer provider.
+
+        Returns:
+            bool: Whether the spans were exported. Requires the `opentelemetry-api` package.
+        """
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            print(
+                "opentelemetry-api is not installed, skipping OpenTelemetry export. "
+                "Install it with `pip install opentelemetry-api opentelemetry-sdk`."
+            )
+            return False
+
+        if tracer is None:
+            tracer = otel_trace.get_tracer("knowledge_storm")
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: (s.start_time_ns, s.span_id))
+        otel_spans = {}
+        for span in spans:
+            parent = otel_spans.get(span.parent_id)
+            attributes = {
+                key: _to_otel_attribute_value(value)
+                for key, value in span.attributes.items()
+            }
+            attributes.update(
+                {
+                    "storm.pipeline_stage": span.pipeline_stage,
+                    "thread.id": span.thread_id,
+                    "thread.name": span.thread_name,
+                }
+            )
+            otel_span = tracer.start_span(
+                span.name,
+                context=(
+                    otel_trace.set_span_in_context(parent)
+                    if parent is not None
+                    else None
+                ),
+                start_time=span.start_time_ns,
+                attributes=attributes,
+            )
+            if span.error is not None:
+                otel_span.set_status(
+                    otel_trace.Status(otel_trace.StatusCode.ERROR, span.error)
+                )
+            otel_spans[span.span_id] = otel_span
+        for span in spans:
+            otel_spans[span.span_id].end(end_time=span.end_time_ns)
+        return True
+
+    def reset_trace(self):
+        with self._lock:
+            self.spans.clear()
+
+    def _get_placement_stats_with_skip_rate(self, placement_stats):
+        total = (
+            placement_stats["embedding_only_count"] + placement_stats["lm_choice_count"]
+        )
+        return {
+            **placement_stats,
+            "lm_skip_rate": (
+                placement_stats["embedding_only_count"] / total if total > 0 else 0.0
+            ),
+        }
 
     def dump_logging_and_reset(self, reset_logging=True):
         log_dump = {}
@@ -197,6 +552,7 @@ class LoggingWrapper:
                     "total_time_seconds": event.get_total_time(),
                     "start_time": event.get_start_time(),
                     "end_time": event.get_end_time(),
+                    "count": event.count,
                 }
                 for event_name, event in pipeline_log["time_usage"].items()
             }
@@ -205,6 +561,9 @@ class LoggingWrapper:
                 "lm_usage": pipeline_log["lm_usage"],
                 "lm_history": pipeline_log["lm_history"],
                 "query_count": pipeline_log["query_count"],
+                "placement_stats": self._get_placement_stats_with_skip_rate(
+                    pipeline_log["placement_stats"]
+                ),
                 "total_wall_time": pipeline_log["total_wall_time"],
             }
         if reset_logging:
@@ -0,0 +1,566 @@
+"""
+Live performance metrics for LM, retrieval, embedding and web page requests.
+
+The LM wrappers in `lm.py`, the retrievers in `rm.py`, `get_text_embeddings` and `WebPageHelper` report request counts,
+latency histograms, tokens per second, in-flight requests, errors, retries, cache hits and thread pool queue depth into
+the process-wide `REGISTRY`. Read it with `REGISTRY.snapshot()`, render it in the Prometheus text format with
+`REGISTRY.render_prometheus()`, or serve both over HTTP with `start_metrics_server` to dashboard live runs.
+"""
+
+import contextvars
+import functools
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+from .prompt_budget import _get_lm_model_name
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DEFAULT_THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 300, 400, 500, 600, 800, 1000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    formatted = (
+        '{}="{}"'.format(
+            key,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(formatted) + "}"
+
+
+class _Metric:
+    """A metric family. Each combination of label values is a separate time series."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """Returns the time series for the given label values, creating it on first use."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _iter_children(self):
+        with self._lock:
+            items = list(self._children.items())
+        for key, child in items:
+            yield dict(zip(self.labelnames, key)), child
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._bucket_counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for idx, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    self._bucket_counts[idx] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    def get(self) -> Dict:
+        with self._lock:
+            cumulative_counts = []
+            total = 0
+            for count in self._bucket_counts:
+                total += count
+                cumulative_counts.append(total)
+            return {
+                "buckets": dict(zip(self.buckets, cumulative_counts)),
+                "sum": self._sum,
+                "count": self._count,
+            }
+
+
+class CounterMetric(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class GaugeMetric(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class HistogramMetric(_Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class MetricsRegistry:
+    """A thread-safe collection of metrics that can be read as a dictionary or in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, labelnames, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(
+                    f"Metric {name} is already registered as a {metric.metric_type}."
+                )
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        return self._get_or_create(CounterMetric, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        return self._get_or_create(GaugeMetric, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        return self._get_or_create(
+            HistogramMetric, name, documentation, labelnames, buckets=buckets
+        )
+
+    def _iter_metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self) -> Dict:
+        """
+        Returns the current value of every time series.
+
+        Returns:
+            Dict: Maps metric names to their type, help text and samples. Each sample has `labels` and either `value`
+                (counters and gauges) or cumulative `buckets`, `sum` and `count` (histograms).
+        """
+        snapshot = {}
+        for metric in self._iter_metrics():
+            samples = []
+            for labels, child in metric._iter_children():
+                if metric.metric_type == "histogram":
+                    value = child.get()
+                    value["buckets"] = {
+                        _format_value(upper_bound): count
+                        for upper_bound, count in value["buckets"].items()
+                    }
+                    samples.append({"labels": labels, **value})
+                else:
+                    samples.append({"labels": labels, "value": child.get()})
+            snapshot[metric.name] = {
+                "type": metric.metric_type,
+                "help": metric.documentation,
+                "samples": samples,
+            }
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._iter_metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for labels, child in metric._iter_children():
+                if metric.metric_type == "histogram":
+                    value = child.get()
+                    for upper_bound, count in value["buckets"].items():
+                        bucket_labels = {**labels, "le": _format_value(upper_bound)}
+                        lines.append(
+                            f"{metric.name}_bucket{_format_labels(bucket_labels)} {count}"
+                        )
+                    lines.append(
+                        f"{metric.name}_sum{_format_labels(labels)} {_format_value(value['sum'])}"
+                    )
+                    lines.append(
+                        f"{metric.name}_count{_format_labels(labels)} {value['count']}"
+                    )
+                else:
+                    lines.append(
+                        f"{metric.name}{_format_labels(labels)} {_format_value(child.get())}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drops all recorded time series. Metric definitions are kept."""
+        for metric in self._iter_metrics():
+            with metric._lock:
+                metric._children.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter(
+    "storm_requests_total",
+    "Requests to LMs, retrievers, embedding models and web pages.",
+    ("component", "provider", "model", "status"),
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    "storm_request_duration_seconds",
+    "Request latency in seconds, including retries.",
+    ("component", "provider", "model"),
+)
+IN_FLIGHT_REQUESTS = REGISTRY.gauge(
+    "storm_in_flight_requests",
+    "Requests that have been sent and not completed yet.",
+    ("component", "provider", "model"),
+)
+RETRIES = REGISTRY.counter(
+    "storm_retries_total",
+    "Requests retried after an error or rate limit.",
+    ("provider",),
+)
+RESPONSE_BYTES = REGISTRY.counter(
+    "storm_response_bytes_total",
+    "Bytes received in responses.",
+    ("component", "provider"),
+)
+LM_TOKENS = REGISTRY.counter(
+    "storm_lm_tokens_total",
+    "Prompt, completion and prompt cache tokens reported by LM providers.",
+    ("provider", "model", "type"),
+)
+LM_COMPLETION_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "storm_lm_completion_tokens_per_second",
+    "Completion tokens per second of each LM call.",
+    ("provider", "model"),
+    buckets=DEFAULT_THROUGHPUT_BUCKETS,
+)
+RETRIEVED_RESULTS = REGISTRY.counter(
+    "storm_retrieved_results_total",
+    "Queries sent to and results returned by retrievers.",
+    ("provider", "type"),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "storm_cache_lookups_total",
+    "Cache lookups by result.",
+    ("cache", "result"),
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "storm_coalesced_requests_total",
+    "Requests that shared the in-flight upstream call of an identical request instead of sending their own.",
+    ("component", "provider"),
+)
+PARTIAL_RETRIEVALS = REGISTRY.counter(
+    "storm_partial_retrievals_total",
+    "Retriever.retrieve calls that returned before all of their queries answered, by whether the query quorum or "
+    "the time budget ended the wait.",
+    ("provider", "reason"),
+)
+STRAGGLER_QUERIES = REGISTRY.counter(
+    "storm_straggler_queries_total",
+    "Search queries left out of a partial retrieval, by whether their results were dropped or kept for later.",
+    ("provider", "outcome"),
+)
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    "storm_deadline_exceeded_total",
+    "Calls and tasks abandoned because the deadline of their scope passed.",
+    ("scope",),
+)
+HEDGED_REQUESTS = REGISTRY.counter(
+    "storm_hedged_requests_total",
+    "Slow LM calls by hedging event: duplicate sent, duplicate won, or duplicate skipped because the budget was exhausted.",
+    ("provider", "event"),
+)
+LM_REPLICA_REQUESTS = REGISTRY.counter(
+    "storm_lm_replica_requests_total",
+    "Calls routed to each replica of an LM endpoint pool.",
+    ("pool", "replica", "status"),
+)
+LM_REPLICA_DURATION = REGISTRY.histogram(
+    "storm_lm_replica_request_duration_seconds",
+    "Latency of the calls routed to each replica of an LM endpoint pool.",
+    ("pool", "replica"),
+)
+LM_REPLICA_OUTSTANDING = REGISTRY.gauge(
+    "storm_lm_replica_outstanding_requests",
+    "Calls in flight on each replica of an LM endpoint pool.",
+    ("pool", "replica"),
+)
+LM_REPLICA_ADMITTED = REGISTRY.gauge(
+    "storm_lm_replica_admitted",
+    "1 if the replica receives traffic, 0 if it is ejected.",
+    ("pool", "replica"),
+)
+LM_REPLICA_EJECTIONS = REGISTRY.counter(
+    "storm_lm_replica_ejections_total",
+    "Times a replica was ejected from an LM endpoint pool after failures or failed health checks.",
+    ("pool", "replica"),
+)
+THREAD_POOL_QUEUE_DEPTH = REGISTRY.gauge(
+    "storm_thread_pool_queue_depth",
+    "Tasks submitted to a thread pool that have not started yet.",
+    ("pool",),
+)
+THREAD_POOL_ACTIVE_WORKERS = REGISTRY.gauge(
+    "storm_thread_pool_active_workers",
+    "Thread pool workers running a task.",
+    ("pool",),
+)
+
+# the request tracked in the current thread or task, used to attribute LM token usage to its call
+_current_request = contextvars.ContextVar("storm_current_request", default=None)
+
+
+class RequestTracker:
+    """Per-request state yielded by `track_request`."""
+
+    def __init__(self):
+        self.failed = False
+        self.completion_tokens = 0
+
+    def mark_failed(self):
+        """Marks a request that failed without raising, e.g. when the error is handled by the caller."""
+        self.failed = True
+
+
+@contextmanager
+def track_request(component: str, provider: str, model: Optional[str] = None):
+    """
+    Records the count, latency, in-flight state and outcome of the enclosed request.
+
+    Args:
+        component (str): One of "lm", "rm", "embedding" or "webpage".
+        provider (str): Name of the client, e.g. the LM or retriever class name.
+        model (str, optional): Model name, if any.
+    """
+    labels = {"component": component, "provider": provider, "model": model or ""}
+    in_flight = IN_FLIGHT_REQUESTS.labels(**labels)
+    tracker = RequestTracker()
+    token = _current_request.set(tracker)
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield tracker
+    except BaseException:
+        tracker.failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        in_flight.dec()
+        _current_request.reset(token)
+        REQUESTS.labels(**labels, status="error" if tracker.failed else "ok").inc()
+        REQUEST_DURATION.labels(**labels).observe(elapsed)
+        if component == "lm" and tracker.completion_tokens and elapsed > 0:
+            LM_COMPLETION_TOKENS_PER_SECOND.labels(
+                provider=provider, model=model or ""
+            ).observe(tracker.completion_tokens / elapsed)
+
+
+def track_lm_call(func):
+    """Decorates the method of an LM client that sends one generation request, usually `__call__`."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with track_request("lm", type(self).__name__, _get_lm_model_name(self)):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def record_lm_usage(
+    lm,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cache_read_tokens: int = 0,
+    cache_creation_tokens: int = 0,
+):
+    """Records the token usage of an LM response. Called from the `log_usage` methods of the LM clients."""
+    provider = type(lm).__name__
+    model = _get_lm_model_name(lm) or ""
+    for token_type, count in (
+        ("prompt", prompt_tokens),
+        ("completion", completion_tokens),
+        ("cache_read", cache_read_tokens),
+        ("cache_creation", cache_creation_tokens),
+    ):
+        if count or token_type in ("prompt", "completion"):
+            LM_TOKENS.labels(provider=provider, model=model, type=token_type).inc(
+                count or 0
+            )
+    tracker = _current_request.get()
+    if tracker is not None:
+        tracker.completion_tokens += completion_tokens or 0
+
+
+def track_retriever_call(func):
+    """Decorates the `forward` method of a retriever."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        provider = type(self).__name__
+        query_or_queries = args[0] if args else kwargs.get("query_or_queries")
+        with track_request("rm", provider):
+            results = func(self, *args, **kwargs)
+        RETRIEVED_RESULTS.labels(provider=provider, type="query").inc(
+            1 if isinstance(query_or_queries, str) else len(query_or_queries or [])
+        )
+        RETRIEVED_RESULTS.labels(provider=provider, type="result").inc(
+            len(results or [])
+        )
+        return results
+
+    return wrapper
+
+
+def record_retry(details):
+    """`on_backoff` handler for `backoff` decorated requests that counts retries by client class."""
+    args = details.get("args") or ()
+    provider = type(args[0]).__name__ if args else details["target"].__name__
+    RETRIES.labels(provider=provider).inc()
+
+
+def record_response_bytes(component: str, provider: str, num_bytes: int):
+    RESPONSE_BYTES.labels(component=component, provider=provider).inc(num_bytes)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor that reports its queue depth and number of busy workers under `pool_name`."""
+
+    def __init__(self, pool_name: str, max_workers: Optional[int] = None, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self.pool_name = pool_name
+
+    def submit(self, fn, /, *args, **kwargs):
+        queue_depth = THREAD_POOL_QUEUE_DEPTH.labels(pool=self.pool_name)
+        active_workers = THREAD_POOL_ACTIVE_WORKERS.labels(pool=self.pool_name)
+        started = threading.Event()
+
+        def run():
+            started.set()
+            queue_depth.dec()
+            active_workers.inc()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                active_workers.dec()
+
+        queue_depth.inc()
+        try:
+            future = super().submit(run)
+        except BaseException:
+            queue_depth.dec()
+            raise
+        # tasks cancelled before they start never leave the queue through run()
+        future.add_done_callback(
+            lambda f: queue_depth.dec() if not started.is_set() else None
+        )
+        return future
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body = json.dumps(self.registry.snapshot()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep scrapes out of the console output
+        pass
+
+
+def start_metrics_server(
+    port: int = 9464, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY
+) -> ThreadingHTTPServer:
+    """
+    Serves `registry` in the Prometheus text format at `/metrics` and as JSON at `/metrics.json` from a daemon thread.
+    Call `shutdown()` on the returned server to stop it.
+    """
+    handler = type(
+        "MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
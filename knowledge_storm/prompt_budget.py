@@ -0,0 +1,187 @@
+"""
+Token-aware sizing of prompt inputs.
+
+Prompt inputs used to be limited by word counts, which misestimate tokens for non-English and code-heavy text.
+`PromptPacker` measures text in tokens (with `tiktoken` when installed, otherwise with a script-aware estimate),
+caps its budget by the context window of the LM the prompt is sent to, and assembles segments in linear time.
+"""
+
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# context window sizes in tokens, matched by longest model name prefix
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-3.5-turbo": 16385,
+    "o1": 128000,
+    "claude": 200000,
+    "deepseek": 65536,
+    "mistralai/Mixtral": 32768,
+    "mixtral": 32768,
+    "meta-llama/Meta-Llama-3.1": 131072,
+    "meta-llama/Llama-3": 8192,
+    "llama3.1": 131072,
+    "llama3": 8192,
+    "gemini": 1000000,
+}
+
+_NON_ASCII_PATTERN = re.compile(r"[^\x00-\x7f]")
+_tiktoken_encodings: Dict[Optional[str], Any] = {}
+
+
+def get_model_context_window(model: Optional[str]) -> Optional[int]:
+    """Returns the context window of a model, or None if the model is unknown."""
+    if not model:
+        return None
+    model_name = model.split("/", 1)[1] if model.startswith("openai/") else model
+    matched_prefix = None
+    for prefix in MODEL_CONTEXT_WINDOWS:
+        if model_name.lower().startswith(prefix.lower()) and (
+            matched_prefix is None or len(prefix) > len(matched_prefix)
+        ):
+            matched_prefix = prefix
+    return MODEL_CONTEXT_WINDOWS[matched_prefix] if matched_prefix else None
+
+
+def _get_tiktoken_encoding(model: Optional[str]):
+    if model not in _tiktoken_encodings:
+        encoding = None
+        try:
+            import tiktoken
+
+            try:
+                encoding = tiktoken.encoding_for_model(model or "")
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # tiktoken is optional, fall back to estimation
+            encoding = None
+        _tiktoken_encodings[model] = encoding
+    return _tiktoken_encodings[model]
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Counts the tokens of a text for the given model.
+
+    Uses `tiktoken` when it is installed. Otherwise estimates one token per 4 ASCII characters and one token per
+    non-ASCII character, which stays conservative for CJK text where word counts are far too low.
+    """
+    if not text:
+        return 0
+    encoding = _get_tiktoken_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    num_non_ascii_chars = len(_NON_ASCII_PATTERN.findall(text))
+    return math.ceil((len(text) - num_non_ascii_chars) / 4) + num_non_ascii_chars
+
+
+def _get_lm_model_name(lm) -> Optional[str]:
+    kwargs = getattr(lm, "kwargs", None) or {}
+    return kwargs.get("model") or getattr(lm, "model", None)
+
+
+class PromptPacker:
+    """
+    Fits prompt inputs into a token budget.
+
+    Args:
+        max_tokens (int): Token budget of the packed text.
+        model (str, optional): Model name used to select the tokenizer.
+        separator (str): String placed between packed segments.
+    """
+
+    def __init__(self, max_tokens: int, model: Optional[str] = None, separator="\n"):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.separator = separator
+        self._separator_tokens = count_tokens(separator, model) if separator else 0
+
+    @classmethod
+    def for_lm(
+        cls,
+        lm,
+        max_tokens: int,
+        reserved_tokens: int = 1000,
+        separator="\n",
+    ) -> "PromptPacker":
+        """
+        Creates a packer for prompts sent to `lm`. The budget is `max_tokens`, lowered if needed so that the packed text,
+        `reserved_tokens` for instructions and other inputs, and the completion fit into the context window of the model.
+        """
+        model = _get_lm_model_name(lm)
+        context_window = get_model_context_window(model)
+        if context_window is not None:
+            completion_tokens = (getattr(lm, "kwargs", None) or {}).get("max_tokens", 0)
+            max_tokens = max(
+                0, min(max_tokens, context_window - completion_tokens - reserved_tokens)
+            )
+        return cls(max_tokens=max_tokens, model=model, separator=separator)
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def truncate(self, text: str) -> str:
+        """
+        Truncates the text to the budget, keeping whole lines. A line that does not fit is cut at a word boundary and
+        no further lines are included.
+        """
+        if self.count(text) <= self.max_tokens:
+            return text.strip()
+        kept_lines = []
+        used_tokens = 0
+        for line in text.split("\n"):
+            line = line.strip()
+            line_tokens = self.count(line) + (1 if kept_lines else 0)
+            if used_tokens + line_tokens <= self.max_tokens:
+                kept_lines.append(line)
+                used_tokens += line_tokens
+                continue
+            # keep the words of the overflowing line that still fit
+            kept_words = []
+            for word in line.split():
+                word_tokens = self.count(word) + 1
+                if used_tokens + word_tokens > self.max_tokens:
+                    break
+                kept_words.append(word)
+                used_tokens += word_tokens
+            if kept_words:
+                kept_lines.append(" ".join(kept_words))
+            break
+        return "\n".join(kept_lines).strip()
+
+    def select(
+        self, segments: Sequence[str], priorities: Optional[Sequence[int]] = None
+    ) -> List[int]:
+        """
+        Selects segments in priority order (lower value first, ties in input order) until the next segment does not fit.
+
+        Returns:
+            List[int]: Indices of the selected segments, in priority order.
+        """
+        order = range(len(segments))
+        if priorities is not None:
+            order = sorted(order, key=lambda idx: priorities[idx])
+        selected = []
+        used_tokens = 0
+        for idx in order:
+            segment_tokens = self.count(segments[idx]) + (
+                self._separator_tokens if selected else 0
+            )
+            if used_tokens + segment_tokens > self.max_tokens:
+                break
+            selected.append(idx)
+            used_tokens += segment_tokens
+        return selected
+
+    def pack(
+        self, segments: Sequence[str], priorities: Optional[Sequence[int]] = None
+    ) -> str:
+        """Joins the segments selected by `select` in their input order."""
+        selected = sorted(self.select(segments, priorities))
+        return self.separator.join(segments[idx] for idx in selected)
@@ -11,6 +11,8 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_qdrant import Qdrant
 from qdrant_client import QdrantClient
 
+from .deadline import backoff_max_time, get_timeout
+from .metrics import record_retry, track_retriever_call
 from .utils import WebPageHelper
 
 
@@ -39,6 +41,7 @@ class YouRM(dspy.Retrieve):
 
         return {"YouRM": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -64,6 +67,7 @@ class YouRM(dspy.Retrieve):
                 results = requests.get(
                     f"https://api.ydc-index.io/search?query={query}",
                     headers=headers,
+                    timeout=get_timeout(),
                 ).json()
 
                 authoritative_results = []
@@ -129,6 +133,7 @@ class BingSearch(dspy.Retrieve):
 
         return {"BingSearch": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -155,7 +160,10 @@ class BingSearch(dspy.Retrieve):
         for query in queries:
             try:
                 results = requests.get(
-                    self.endpoint, headers=headers, params={**self.params, "q": query}
+                    self.endpoint,
+                    headers=headers,
+                    params={**self.params, "q": query},
+                    timeout=get_timeout(),
                 ).json()
 
                 for d in results["webPages"]["value"]:
@@ -299,6 +307,7 @@ class VectorRM(dspy.Retrieve):
         """
         return self.qdrant.client.count(collection_name=self.collection_name)
 
+    @track_retriever_call
     def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
         """
         Search in your data for self.k top passages for query or queries.
@@ -351,7 +360,10 @@ class StanfordOvalArxivRM(dspy.Retrieve):
         payload = {"query": query, "num_blocks": self.k}
 
         response = requests.post(
-            self.endpoint, json=payload, headers={"Content-Type": "application/json"}
+            self.endpoint,
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=get_timeout(),
         )
 
         # Check if the request was successful
@@ -374,6 +386,7 @@ class StanfordOvalArxivRM(dspy.Retrieve):
                 f"Error: Unable to retrieve results. Status code: {response.status_code}"
             )
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -405,9 +418,11 @@ class SerperRM(dspy.Retrieve):
         min_char_count: int = 150,
         snippet_chunk_size: int = 1000,
         webpage_helper_max_threads=10,
+        base_url: str = "https://google.serper.dev",
     ):
         """Args:
         serper_search_api_key str: API key to run serper, can be found by creating an account on https://serper.dev/
+        base_url str: Base URL of the Serper API, e.g. to point it at a local stand-in server.
         query_params (dict or list of dict): parameters in dictionary or list of dictionaries that has a max size of 100 that will be used to query.
             Commonly used fields are as follows (see more information in https://serper.dev/playground):
                 q str: query that will be used with google search
@@ -451,7 +466,7 @@ class SerperRM(dspy.Retrieve):
         else:
             self.serper_search_api_key = os.environ["SERPER_API_KEY"]
 
-        self.base_url = "https://google.serper.dev"
+        self.base_url = base_url
 
     def serper_runner(self, query_params):
         self.search_url = f"{self.base_url}/search"
@@ -462,7 +477,11 @@ class SerperRM(dspy.Retrieve):
         }
 
         response = requests.request(
-            "POST", self.search_url, headers=headers, json=query_params
+            "POST",
+            self.search_url,
+            headers=headers,
+            json=query_params,
+            timeout=get_timeout(),
         )
 
         if response == None:
@@ -477,6 +496,7 @@ class SerperRM(dspy.Retrieve):
         self.usage = 0
         return {"SerperRM": usage}
 
+    @track_retriever_call
     def forward(self, query_or_queries: Union[str, List[str]], exclude_urls: List[str]):
         """
         Calls the API and searches for the query passed in.
@@ -586,6 +606,7 @@ class BraveRM(dspy.Retrieve):
 
         return {"BraveRM": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -615,6 +636,7 @@ class BraveRM(dspy.Retrieve):
                 response = requests.get(
                     f"https://api.search.brave.com/res/v1/web/search?result_filter=web&q={query}",
                     headers=headers,
+                    timeout=get_timeout(),
                 ).json()
                 results = response.get("web", {}).get("results", [])
 
@@ -668,6 +690,7 @@ class SearXNG(dspy.Retrieve):
         self.usage = 0
         return {"SearXNG": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -697,7 +720,10 @@ class SearXNG(dspy.Retrieve):
             try:
                 params = {"q": query, "format": "json"}
                 response = requests.get(
-                    self.searxng_api_url, headers=headers, params=params
+                    self.searxng_api_url,
+                    headers=headers,
+                    params=params,
+                    timeout=get_timeout(),
                 )
                 results = response.json()
 
@@ -780,9 +806,9 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
     @backoff.on_exception(
         backoff.expo,
         (Exception,),
-        max_time=1000,
+        max_time=backoff_max_time(1000),
         max_tries=8,
-        on_backoff=backoff_hdlr,
+        on_backoff=[backoff_hdlr, record_retry],
         giveup=giveup_hdlr,
     )
     def request(self, query: str):
@@ -791,6 +817,7 @@ class DuckDuckGoSearchRM(dspy.Retrieve):
         )
         return results
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -909,6 +936,7 @@ class TavilySearchRM(dspy.Retrieve):
         self.usage = 0
         return {"TavilySearchRM": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -1037,6 +1065,7 @@ class GoogleSearch(dspy.Retrieve):
         self.usage = 0
         return {"GoogleSearch": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -1179,6 +1208,7 @@ class AzureAISearch(dspy.Retrieve):
 
         return {"AzureAISearch": usage}
 
+    @track_retriever_call
     def forward(
         self, query_or_queries: Union[str, List[str]], exclude_urls: List[str] = []
     ):
@@ -0,0 +1,126 @@
+"""
+In-flight request coalescing ("singleflight") for LM and search calls.
+
+Concurrent personas and experts often send byte-identical LM prompts or search queries at the same moment. A response
+cache does not help because neither call has finished yet. `SingleFlight` lets the first of several concurrent
+identical calls run and hands its result (or exception) to the others when it returns, so they share one upstream call.
+The LM wrappers in `lm.py` coalesce their `__call__` with `coalesce_lm_call`, and `Retriever.retrieve` coalesces each
+query. Coalesced calls are counted in the usage stats and the `storm_coalesced_requests_total` metric.
+"""
+
+import copy
+import functools
+import json
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, Hashable
+
+from .deadline import DeadlineExceeded, get_remaining_seconds
+from .metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Callers arriving while a call with the same key is in flight wait for it and
+    receive a copy of its result, or its exception.
+
+    Args:
+        component (str): Reported in the `storm_coalesced_requests_total` metric, e.g. "lm" or "rm".
+        provider (str): Reported in the metric, e.g. the LM class name.
+        copy_result (Callable): Applied to the result for each waiting caller, so that callers can modify what they
+            receive. Defaults to a shallow copy.
+    """
+
+    def __init__(
+        self,
+        component: str = "",
+        provider: str = "",
+        copy_result: Callable[[Any], Any] = copy.copy,
+    ):
+        self.component = component
+        self.provider = provider
+        self.copy_result = copy_result
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced_count = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs):
+        """
+        Calls `func(*args, **kwargs)`, unless a call with the same key is in flight, in which case waits for its result
+        until the current deadline.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced_count += 1
+        if not is_leader:
+            COALESCED_REQUESTS.labels(
+                component=self.component, provider=self.provider
+            ).inc()
+            done, _ = wait([future], timeout=get_remaining_seconds())
+            if not done:
+                raise DeadlineExceeded(
+                    "Deadline exceeded waiting for a coalesced call."
+                )
+            return self.copy_result(future.result())
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def get_coalesced_count_and_reset(self) -> int:
+        with self._lock:
+            count = self.coalesced_count
+            self.coalesced_count = 0
+        return count
+
+
+def make_request_key(*args, **kwargs) -> str:
+    """Builds a coalescing key from the arguments of a request."""
+    return json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+def _get_singleflight(obj, component: str) -> SingleFlight:
+    group = obj.__dict__.get("_singleflight")
+    if group is None:
+        # setdefault keeps the first group if two threads get here at the same time
+        group = obj.__dict__.setdefault(
+            "_singleflight", SingleFlight(component, type(obj).__name__)
+        )
+    return group
+
+
+def coalesce_lm_call(func):
+    """
+    Decorates the `__call__` of an LM client so that concurrent calls with the same prompt and kwargs share one request.
+    Set `coalesce_requests = False` on a client to send every call, e.g. to draw independent samples at a high
+    temperature.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(self, "coalesce_requests", True):
+            return func(self, *args, **kwargs)
+        key = make_request_key(*args, **kwargs)
+        return _get_singleflight(self, "lm").do(key, func, self, *args, **kwargs)
+
+    return wrapper
+
+
+def get_coalesced_count_and_reset(obj) -> int:
+    """Returns the number of coalesced calls of an LM client or retriever since the last reset."""
+    group = getattr(obj, "_singleflight", None)
+    if group is None:
+        return 0
+    return group.get_coalesced_count_and_reset()
@@ -13,8 +13,10 @@ from .modules.knowledge_curation import StormKnowledgeCurationModule
 from .modules.outline_generation import StormOutlineGenerationModule
 from .modules.persona_generator import StormPersonaGenerator
 from .modules.storm_dataclass import StormInformationTable, StormArticle
+from ..deadline import deadline_scope
 from ..interface import Engine, LMConfigs, Retriever
 from ..lm import OpenAIModel, AzureOpenAIModel, KamiwazaModel
+from ..lm_history import JSONLHistorySink, to_serializable
 from ..utils import FileIOHelper, makeStringRed, truncate_filename
 
 
@@ -213,6 +215,54 @@ class STORMWikiRunnerArguments:
             "Consider reducing it if keep getting 'Exceed rate limit' error when calling LM API."
         },
     )
+    retrieve_min_query_fraction: float = field(
+        default=1.0,
+        metadata={
+            "help": "Return search results once this fraction of the search queries of a turn have answered, "
+            "dropping the slower ones. 1.0 waits for every query."
+        },
+    )
+    retrieve_timeout: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "Time budget in seconds for the search queries of a turn. Queries without results by then are "
+            "dropped. None for no budget."
+        },
+    )
+    retrieve_keep_late_results: bool = field(
+        default=False,
+        metadata={
+            "help": "Keep the search queries dropped by retrieve_min_query_fraction or retrieve_timeout running, "
+            "and add their results to the next search of the same conversation instead of discarding them."
+        },
+    )
+    run_timeout: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "Time budget in seconds for the whole run. Stages past the deadline return the results "
+            "finished so far. None for no deadline."
+        },
+    )
+    stage_timeout: Optional[float] = field(
+        default=None,
+        metadata={
+            "help": "Time budget in seconds for each stage, bounded by the run deadline. None for no deadline."
+        },
+    )
+    max_lm_history_per_lm: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Keep at most this many recent calls per LM in memory and stream every call to "
+            "llm_call_history.jsonl.gz in the output directory as it happens, instead of dumping the whole history "
+            "in post_run. None keeps the full history in memory."
+        },
+    )
+
+
+def _drop_call_kwargs(call):
+    # All kwargs are dumped together to run_config.json.
+    call.pop("kwargs", None)
+    return call
 
 
 class STORMWikiRunner(Engine):
@@ -224,8 +274,15 @@ class STORMWikiRunner(Engine):
         super().__init__(lm_configs=lm_configs)
         self.args = args
         self.lm_configs = lm_configs
-
-        self.retriever = Retriever(rm=rm, max_thread=self.args.max_thread_num)
+        self.lm_history_sink: Optional[JSONLHistorySink] = None
+
+        self.retriever = Retriever(
+            rm=rm,
+            max_thread=self.args.max_thread_num,
+            min_query_fraction=self.args.retrieve_min_query_fraction,
+            timeout=self.args.retrieve_timeout,
+            keep_late_results=self.args.retrieve_keep_late_results,
+        )
         storm_persona_generator = StormPersonaGenerator(
             self.lm_configs.question_asker_lm
         )
@@ -255,6 +312,9 @@ class STORMWikiRunner(Engine):
         self.lm_configs.init_check()
         self.apply_decorators()
 
+    def get_stage_timeout(self, stage: str) -> Optional[float]:
+        return self.args.stage_timeout
+
     def run_knowledge_curation_module(
         self,
         ground_truth_url: str = "None",
@@ -279,6 +339,9 @@ class STORMWikiRunner(Engine):
         information_table.dump_url_to_info(
             os.path.join(self.article_output_dir, "raw_search_results.json")
         )
+        information_table.dump_snippet_store(
+            os.path.join(self.article_output_dir, "snippet_store.npz")
+        )
         return information_table
 
     def run_outline_generation_module(
@@ -348,6 +411,13 @@ class STORMWikiRunner(Engine):
             config_log, os.path.join(self.article_output_dir, "run_config.json")
         )
 
+        if self.lm_history_sink is not None:
+            # the history was streamed to llm_call_history.jsonl.gz during the run
+            self.lm_configs.collect_and_reset_lm_history()
+            self.lm_history_sink.close()
+            self.lm_history_sink = None
+            return
+
         llm_call_history = self.lm_configs.collect_and_reset_lm_history()
         with open(
             os.path.join(self.article_output_dir, "llm_call_history.jsonl"), "w"
@@ -356,20 +426,17 @@ class STORMWikiRunner(Engine):
                 if "kwargs" in call:
                     call.pop("kwargs")  # All kwargs are dumped together to run_config.json.
                 # Convert ChatCompletion object to a serializable format
-                serializable_call = {}
-                for key, value in call.items():
-                    if hasattr(value, '__dict__'):
-                        serializable_call[key] = value.__dict__
-                    else:
-                        serializable_call[key] = value
-                f.write(json.dumps(serializable_call) + "\n")
+                f.write(json.dumps(to_serializable(call)) + "\n")
 
     def _load_information_table_from_local_fs(self, information_table_local_path):
         assert os.path.exists(information_table_local_path), makeStringRed(
             f"{information_table_local_path} not exists. Please set --do-research argument to prepare the conversation_log.json for this topic."
         )
         return StormInformationTable.from_conversation_log_file(
-            information_table_local_path
+            information_table_local_path,
+            snippet_store_path=os.path.join(
+                os.path.dirname(information_table_local_path), "snippet_store.npz"
+            ),
         )
 
     def _load_outline_from_local_fs(self, topic, outline_local_path):
@@ -438,59 +505,72 @@ class STORMWikiRunner(Engine):
             self.args.output_dir, self.article_dir_name
         )
         os.makedirs(self.article_output_dir, exist_ok=True)
-
-        # research module
-        information_table: StormInformationTable = None
-        if do_research:
-            information_table = self.run_knowledge_curation_module(
-                ground_truth_url=ground_truth_url, callback_handler=callback_handler
+        if self.args.max_lm_history_per_lm is not None:
+            if self.lm_history_sink is not None:
+                self.lm_history_sink.close()
+            self.lm_history_sink = JSONLHistorySink(
+                os.path.join(self.article_output_dir, "llm_call_history.jsonl.gz"),
+                redact=_drop_call_kwargs,
             )
-        # outline generation module
-        outline: StormArticle = None
-        if do_generate_outline:
-            # load information table if it's not initialized
-            if information_table is None:
-                information_table = self._load_information_table_from_local_fs(
-                    os.path.join(self.article_output_dir, "conversation_log.json")
-                )
-            outline = self.run_outline_generation_module(
-                information_table=information_table, callback_handler=callback_handler
+            self.lm_configs.set_history_sink(
+                self.lm_history_sink,
+                max_history_per_lm=self.args.max_lm_history_per_lm,
             )
 
-        # article generation module
-        draft_article: StormArticle = None
-        if do_generate_article:
-            if information_table is None:
-                information_table = self._load_information_table_from_local_fs(
-                    os.path.join(self.article_output_dir, "conversation_log.json")
+        with deadline_scope(self.args.run_timeout, name="run"):
+            # research module
+            information_table: StormInformationTable = None
+            if do_research:
+                information_table = self.run_knowledge_curation_module(
+                    ground_truth_url=ground_truth_url, callback_handler=callback_handler
                 )
-            if outline is None:
-                outline = self._load_outline_from_local_fs(
-                    topic=topic,
-                    outline_local_path=os.path.join(
-                        self.article_output_dir, "storm_gen_outline.txt"
-                    ),
+            # outline generation module
+            outline: StormArticle = None
+            if do_generate_outline:
+                # load information table if it's not initialized
+                if information_table is None:
+                    information_table = self._load_information_table_from_local_fs(
+                        os.path.join(self.article_output_dir, "conversation_log.json")
+                    )
+                outline = self.run_outline_generation_module(
+                    information_table=information_table,
+                    callback_handler=callback_handler,
                 )
-            draft_article = self.run_article_generation_module(
-                outline=outline,
-                information_table=information_table,
-                callback_handler=callback_handler,
-            )
 
-        # article polishing module
-        if do_polish_article:
-            if draft_article is None:
-                draft_article_path = os.path.join(
-                    self.article_output_dir, "storm_gen_article.txt"
-                )
-                url_to_info_path = os.path.join(
-                    self.article_output_dir, "url_to_info.json"
+            # article generation module
+            draft_article: StormArticle = None
+            if do_generate_article:
+                if information_table is None:
+                    information_table = self._load_information_table_from_local_fs(
+                        os.path.join(self.article_output_dir, "conversation_log.json")
+                    )
+                if outline is None:
+                    outline = self._load_outline_from_local_fs(
+                        topic=topic,
+                        outline_local_path=os.path.join(
+                            self.article_output_dir, "storm_gen_outline.txt"
+                        ),
+                    )
+                draft_article = self.run_article_generation_module(
+                    outline=outline,
+                    information_table=information_table,
+                    callback_handler=callback_handler,
                 )
-                draft_article = self._load_draft_article_from_local_fs(
-                    topic=topic,
-                    draft_article_path=draft_article_path,
-                    url_to_info_path=url_to_info_path,
+
+            # article polishing module
+            if do_polish_article:
+                if draft_article is None:
+                    draft_article_path = os.path.join(
+                        self.article_output_dir, "storm_gen_article.txt"
+                    )
+                    url_to_info_path = os.path.join(
+                        self.article_output_dir, "url_to_info.json"
+                    )
+                    draft_article = self._load_draft_article_from_local_fs(
+                        topic=topic,
+                        draft_article_path=draft_article_path,
+                        url_to_info_path=url_to_info_path,
+                    )
+                self.run_article_polishing_module(
+                    draft_article=draft_article, remove_duplicate=remove_duplicate
                 )
-            self.run_article_polishing_module(
-                draft_article=draft_article, remove_duplicate=remove_duplicate
-            )
@@ -1,14 +1,14 @@
-import concurrent.futures
 import copy
 import logging
-from concurrent.futures import as_completed
 from typing import List, Union, Any, Optional
 
 import dspy
 
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
+from ...deadline import DeadlineThreadPoolExecutor, as_completed_within_deadline
 from ...interface import ArticleGenerationModule, Information
+from ...prompt_budget import PromptPacker
 from ...utils import ArticleTextProcessing
 
 
@@ -89,8 +89,8 @@ class StormArticleGenerationModule(ArticleGenerationModule):
             section_output_dict_collection = [section_output_dict]
         else:
 
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=self.max_thread_num
+            with DeadlineThreadPoolExecutor(
+                "section_generation", max_workers=self.max_thread_num
             ) as executor:
                 future_to_sec_title = {}
                 for section_title in sections_to_write:
@@ -120,7 +120,10 @@ class StormArticleGenerationModule(ArticleGenerationModule):
                         )
                     ] = section_title
 
-                for future in as_completed(future_to_sec_title):
+                # sections not written by the deadline keep only their outline
+                for future in as_completed_within_deadline(
+                    future_to_sec_title, "sections"
+                ):
                     section_output_dict_collection.append(future.result())
 
         article = copy.deepcopy(article_with_outline)
@@ -145,12 +148,11 @@ class ConvToSection(dspy.Module):
     def forward(
         self, topic: str, outline: str, section: str, collected_info: List[Information]
     ):
-        info = ""
-        for idx, storm_info in enumerate(collected_info):
-            info += f"[{idx + 1}]\n" + "\n".join(storm_info.snippets)
-            info += "\n\n"
-
-        info = ArticleTextProcessing.limit_word_count_preserve_newline(info, 1500)
+        info = "\n\n".join(
+            f"[{idx + 1}]\n" + "\n".join(storm_info.snippets)
+            for idx, storm_info in enumerate(collected_info)
+        )
+        info = PromptPacker.for_lm(self.engine, max_tokens=2000).truncate(info)
 
         with dspy.settings.context(lm=self.engine):
             section = ArticleTextProcessing.clean_up_section(
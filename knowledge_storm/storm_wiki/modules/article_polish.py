@@ -4,6 +4,7 @@ from typing import Union, Any, Optional, Dict
 import dspy
 
 from .storm_dataclass import StormArticle
+from ...deadline import DeadlineExceeded
 from ...interface import ArticlePolishingModule
 from ...utils import ArticleTextProcessing
 
@@ -39,9 +40,13 @@ class StormArticlePolishingModule(ArticlePolishingModule):
         """
 
         article_text = draft_article.to_string()
-        polish_result = self.polish_page(
-            topic=topic, draft_page=article_text, polish_whole_page=remove_duplicate
-        )
+        try:
+            polish_result = self.polish_page(
+                topic=topic, draft_page=article_text, polish_whole_page=remove_duplicate
+            )
+        except DeadlineExceeded:
+            print("Deadline exceeded: returning the unpolished draft article.")
+            return draft_article
         lead_section = f"# summary\n{polish_result.lead_section}"
         polished_article = "\n\n".join([lead_section, polish_result.page])
         polished_article_dict = ArticleTextProcessing.parse_article_into_dict(
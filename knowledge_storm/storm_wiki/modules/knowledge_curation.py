@@ -1,15 +1,20 @@
-import concurrent.futures
 import logging
 import os
-from concurrent.futures import as_completed
-from typing import Union, List, Tuple, Optional, Dict, Any
+from typing import Union, List, Tuple, Optional, Dict, Any, Hashable
 
 import dspy
 
 from .callback import BaseCallbackHandler
 from .persona_generator import StormPersonaGenerator
 from .storm_dataclass import DialogueTurn, StormInformationTable
+from ...deadline import (
+    DeadlineExceeded,
+    DeadlineThreadPoolExecutor,
+    as_completed_within_deadline,
+    get_deadline,
+)
 from ...interface import KnowledgeCurationModule, Retriever, Information
+from ...prompt_budget import PromptPacker
 from ...utils import ArticleTextProcessing
 
 try:
@@ -57,18 +62,30 @@ class ConvSimulator(dspy.Module):
         ground_truth_url: The ground_truth_url will be excluded from search to avoid ground truth leakage in evaluation.
         """
         dlg_history: List[DialogueTurn] = []
+        # late search results are kept per conversation, since conversations of different personas run concurrently
+        late_results_key = object()
         for _ in range(self.max_turn):
-            user_utterance = self.wiki_writer(
-                topic=topic, persona=persona, dialogue_turns=dlg_history
-            ).question
-            if user_utterance == "":
-                logging.error("Simulated Wikipedia writer utterance is empty.")
+            deadline = get_deadline()
+            if deadline is not None and deadline.expired():
+                # keep the turns finished so far
                 break
-            if user_utterance.startswith("Thank you so much for your help!"):
+            try:
+                user_utterance = self.wiki_writer(
+                    topic=topic, persona=persona, dialogue_turns=dlg_history
+                ).question
+                if user_utterance == "":
+                    logging.error("Simulated Wikipedia writer utterance is empty.")
+                    break
+                if user_utterance.startswith("Thank you so much for your help!"):
+                    break
+                expert_output = self.topic_expert(
+                    topic=topic,
+                    question=user_utterance,
+                    ground_truth_url=ground_truth_url,
+                    late_results_key=late_results_key,
+                )
+            except DeadlineExceeded:
                 break
-            expert_output = self.topic_expert(
-                topic=topic, question=user_utterance, ground_truth_url=ground_truth_url
-            )
             dlg_turn = DialogueTurn(
                 agent_utterance=expert_output.answer,
                 user_utterance=user_utterance,
@@ -79,6 +96,12 @@ class ConvSimulator(dspy.Module):
             if callback_handler:
                 callback_handler.on_dialogue_turn_end(dlg_turn=dlg_turn)
 
+        late_results = self.topic_expert.retriever.pop_late_results(
+            late_results_key, close=True
+        )
+        if dlg_history and late_results:
+            dlg_history[-1].search_results.extend(late_results)
+
         return dspy.Prediction(dlg_history=dlg_history)
 
 
@@ -111,7 +134,7 @@ class WikiWriter(dspy.Module):
             )
         conv = "\n".join(conv)
         conv = conv.strip() or "N/A"
-        conv = ArticleTextProcessing.limit_word_count_preserve_newline(conv, 2500)
+        conv = PromptPacker.for_lm(self.engine, max_tokens=3300).truncate(conv)
 
         with dspy.settings.context(lm=self.engine):
             if persona is not None and len(persona.strip()) > 0:
@@ -202,7 +225,13 @@ class TopicExpert(dspy.Module):
         self.max_search_queries = max_search_queries
         self.search_top_k = search_top_k
 
-    def forward(self, topic: str, question: str, ground_truth_url: str):
+    def forward(
+        self,
+        topic: str,
+        question: str,
+        ground_truth_url: str,
+        late_results_key: Optional[Hashable] = None,
+    ):
         with dspy.settings.context(lm=self.engine, show_guidelines=False):
             # Identify: Break down question into queries.
             queries = self.generate_queries(topic=topic, question=question).queries
@@ -213,18 +242,22 @@ class TopicExpert(dspy.Module):
             queries = queries[: self.max_search_queries]
             # Search
             searched_results: List[Information] = self.retriever.retrieve(
-                list(set(queries)), exclude_urls=[ground_truth_url]
+                list(set(queries)),
+                exclude_urls=[ground_truth_url],
+                late_results_key=late_results_key,
             )
+            if late_results_key is not None:
+                # results of earlier searches of this conversation that answered after their turn
+                searched_results.extend(
+                    self.retriever.pop_late_results(late_results_key)
+                )
             if len(searched_results) > 0:
                 # Evaluate: Simplify this part by directly using the top 1 snippet.
-                info = ""
-                for n, r in enumerate(searched_results):
-                    info += "\n".join(f"[{n + 1}]: {s}" for s in r.snippets[:1])
-                    info += "\n\n"
-
-                info = ArticleTextProcessing.limit_word_count_preserve_newline(
-                    info, 1000
+                info = "\n\n".join(
+                    "\n".join(f"[{n + 1}]: {s}" for s in r.snippets[:1])
+                    for n, r in enumerate(searched_results)
                 )
+                info = PromptPacker.for_lm(self.engine, max_tokens=1300).truncate(info)
 
                 try:
                     answer = self.answer_question(
@@ -325,7 +358,9 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
 
         max_workers = min(self.max_thread_num, len(considered_personas))
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with DeadlineThreadPoolExecutor(
+            "conversation", max_workers=max_workers
+        ) as executor:
             future_to_persona = {
                 executor.submit(run_conv, persona): persona
                 for persona in considered_personas
@@ -336,7 +371,9 @@ class StormKnowledgeCurationModule(KnowledgeCurationModule):
                 for t in executor._threads:
                     add_script_run_ctx(t)
 
-            for future in as_completed(future_to_persona):
+            for future in as_completed_within_deadline(
+                future_to_persona, "conversations"
+            ):
                 persona = future_to_persona[future]
                 conv = future.result()
                 conversations.append(
@@ -4,7 +4,9 @@ import dspy
 
 from .callback import BaseCallbackHandler
 from .storm_dataclass import StormInformationTable, StormArticle
+from ...deadline import DeadlineExceeded
 from ...interface import OutlineGenerationModule
+from ...prompt_budget import PromptPacker
 from ...utils import ArticleTextProcessing
 
 
@@ -103,22 +105,31 @@ class WriteOutline(dspy.Module):
             ]
         )
         conv = ArticleTextProcessing.remove_citations(conv)
-        conv = ArticleTextProcessing.limit_word_count_preserve_newline(conv, 5000)
+        conv = PromptPacker.for_lm(self.engine, max_tokens=6600).truncate(conv)
 
         with dspy.settings.context(lm=self.engine):
             if old_outline is None:
-                old_outline = ArticleTextProcessing.clean_up_outline(
-                    self.draft_page_outline(topic=topic).outline
-                )
+                try:
+                    old_outline = ArticleTextProcessing.clean_up_outline(
+                        self.draft_page_outline(topic=topic).outline
+                    )
+                except DeadlineExceeded:
+                    # without an outline, article generation writes directly about the topic
+                    print("Deadline exceeded: continuing without an outline.")
+                    old_outline = ""
                 if callback_handler:
                     callback_handler.on_direct_outline_generation_end(
                         outline=old_outline
                     )
-            outline = ArticleTextProcessing.clean_up_outline(
-                self.write_page_outline(
-                    topic=topic, old_outline=old_outline, conv=conv
-                ).outline
-            )
+            try:
+                outline = ArticleTextProcessing.clean_up_outline(
+                    self.write_page_outline(
+                        topic=topic, old_outline=old_outline, conv=conv
+                    ).outline
+                )
+            except DeadlineExceeded:
+                print("Deadline exceeded: using the draft outline.")
+                outline = old_outline
             if callback_handler:
                 callback_handler.on_outline_refinement_end(outline=outline)
 
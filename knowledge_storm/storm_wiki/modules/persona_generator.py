@@ -6,11 +6,13 @@ import dspy
 import requests
 from bs4 import BeautifulSoup
 
+from ...deadline import DeadlineExceeded, get_timeout
+
 
 def get_wiki_page_title_and_toc(url):
     """Get the main title and table of contents from an url of a Wikipedia page."""
 
-    response = requests.get(url)
+    response = requests.get(url, timeout=get_timeout())
     soup = BeautifulSoup(response.content, "html.parser")
 
     # Get the main title from the first h1 tag
@@ -148,7 +150,11 @@ class StormPersonaGenerator:
             List[str]: A list of persona descriptions, including the default 'Basic fact writer' persona
                 and up to `max_num_persona` additional personas generated based on the topic.
         """
-        personas = self.create_writer_with_persona(topic=topic)
+        try:
+            personas = self.create_writer_with_persona(topic=topic).personas
+        except DeadlineExceeded:
+            print("Deadline exceeded: continuing with the default persona only.")
+            personas = []
         default_persona = "Basic fact writer: Basic fact writer focusing on broadly covering the basic facts about the topic."
-        considered_personas = [default_persona] + personas.personas[:max_num_persona]
+        considered_personas = [default_persona] + personas[:max_num_persona]
         return considered_personas
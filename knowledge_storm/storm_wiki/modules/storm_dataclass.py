@@ -1,5 +1,7 @@
 import copy
+import os
 import re
+from array import array
 from collections import OrderedDict
 from typing import Union, Optional, Any, List, Tuple, Dict
 
@@ -52,6 +54,123 @@ class DialogueTurn:
         )
 
 
+class StormSnippetStore:
+    """
+    Columnar store for the snippets collected during KnowledgeCuration stage.
+
+    Every unique snippet text is kept once in `texts`. The table itself is two integer columns,
+    `url_ids` and `snippet_ids`, with one row per (url, snippet) pair. Rows keep insertion order
+    and are deduplicated per url, so the footprint stays proportional to the unique text.
+    """
+
+    def __init__(self):
+        self.urls: List[str] = []
+        self.texts: List[str] = []
+        self._url_to_id: Dict[str, int] = {}
+        self._text_to_id: Dict[str, int] = {}
+        self._rows = set()
+        self._url_id_column = array("i")
+        self._snippet_id_column = array("i")
+        self._url_row_index = None
+
+    def __len__(self):
+        return len(self._url_id_column)
+
+    def add(self, url: str, snippets: List[str]):
+        """Add snippets of the url, skipping (url, snippet) pairs that are already stored."""
+        url_id = self._url_to_id.get(url)
+        if url_id is None:
+            url_id = len(self.urls)
+            self._url_to_id[url] = url_id
+            self.urls.append(url)
+        for snippet in snippets:
+            snippet_id = self._text_to_id.get(snippet)
+            if snippet_id is None:
+                snippet_id = len(self.texts)
+                self._text_to_id[snippet] = snippet_id
+                self.texts.append(snippet)
+            row_key = (url_id << 32) | snippet_id
+            if row_key in self._rows:
+                continue
+            self._rows.add(row_key)
+            self._url_id_column.append(url_id)
+            self._snippet_id_column.append(snippet_id)
+        self._url_row_index = None
+
+    @property
+    def url_ids(self) -> np.ndarray:
+        return np.array(self._url_id_column, dtype=np.int32)
+
+    @property
+    def snippet_ids(self) -> np.ndarray:
+        return np.array(self._snippet_id_column, dtype=np.int32)
+
+    def _get_url_row_index(self):
+        # rows grouped by url (stable, so insertion order is kept within each url)
+        if self._url_row_index is None:
+            url_ids = self.url_ids
+            row_order = np.argsort(url_ids, kind="stable")
+            boundaries = np.searchsorted(
+                url_ids[row_order], np.arange(len(self.urls) + 1)
+            )
+            self._url_row_index = (row_order, boundaries)
+        return self._url_row_index
+
+    def get_snippets(self, url: str) -> List[str]:
+        url_id = self._url_to_id.get(url)
+        if url_id is None:
+            return []
+        row_order, boundaries = self._get_url_row_index()
+        rows = row_order[boundaries[url_id] : boundaries[url_id + 1]]
+        return [self.texts[self._snippet_id_column[row]] for row in rows]
+
+    def save(self, path: str):
+        """Write the store to a .npz file. Texts are saved as one UTF-8 buffer plus offsets."""
+
+        def _pack(strings):
+            encoded = [s.encode("utf-8") for s in strings]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(e) for e in encoded], out=offsets[1:])
+            return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+        text_buffer, text_offsets = _pack(self.texts)
+        url_buffer, url_offsets = _pack(self.urls)
+        np.savez(
+            path,
+            text_buffer=text_buffer,
+            text_offsets=text_offsets,
+            url_buffer=url_buffer,
+            url_offsets=url_offsets,
+            url_ids=self.url_ids,
+            snippet_ids=self.snippet_ids,
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        def _unpack(buffer, offsets):
+            buffer = buffer.tobytes()
+            return [
+                buffer[start:end].decode("utf-8")
+                for start, end in zip(offsets[:-1], offsets[1:])
+            ]
+
+        with np.load(path) as data:
+            store = cls()
+            store.texts = _unpack(data["text_buffer"], data["text_offsets"])
+            store.urls = _unpack(data["url_buffer"], data["url_offsets"])
+            store._url_id_column = array("i", data["url_ids"].tobytes())
+            store._snippet_id_column = array("i", data["snippet_ids"].tobytes())
+        store._text_to_id = {text: idx for idx, text in enumerate(store.texts)}
+        store._url_to_id = {url: idx for idx, url in enumerate(store.urls)}
+        store._rows = {
+            (url_id << 32) | snippet_id
+            for url_id, snippet_id in zip(
+                store._url_id_column, store._snippet_id_column
+            )
+        }
+        return store
+
+
 class StormInformationTable(InformationTable):
     """
     The InformationTable class serves as data class to store the information
@@ -62,28 +181,59 @@ class StormInformationTable(InformationTable):
     would be perspective guided dialogue history.
     """
 
-    def __init__(self, conversations: Optional[List[Tuple[str, List[DialogueTurn]]]] = None):
+    def __init__(
+        self,
+        conversations: Optional[List[Tuple[str, List[DialogueTurn]]]] = None,
+        snippet_store: Optional[StormSnippetStore] = None,
+    ):
         super().__init__()
         self.conversations = conversations or []
+        self.snippet_store = (
+            snippet_store
+            if snippet_store is not None
+            else StormInformationTable.construct_snippet_store(self.conversations)
+        )
         self.url_to_info: Dict[str, Information] = (
-            StormInformationTable.construct_url_to_info(self.conversations)
+            StormInformationTable.construct_url_to_info(
+                self.conversations, snippet_store=self.snippet_store
+            )
         )
 
     @staticmethod
-    def construct_url_to_info(
+    def construct_snippet_store(
         conversations: List[Tuple[str, List[DialogueTurn]]]
+    ) -> StormSnippetStore:
+        snippet_store = StormSnippetStore()
+        for persona, conv in conversations:
+            for turn in conv:
+                for storm_info in turn.search_results:
+                    snippet_store.add(storm_info.url, storm_info.snippets)
+        return snippet_store
+
+    @staticmethod
+    def construct_url_to_info(
+        conversations: List[Tuple[str, List[DialogueTurn]]],
+        snippet_store: Optional[StormSnippetStore] = None,
     ) -> Dict[str, Information]:
+        """
+        Merge search results by url. Snippets are deduplicated in the order they are first collected.
+        The Information objects in the conversations are left untouched.
+        """
+        if snippet_store is None:
+            snippet_store = StormInformationTable.construct_snippet_store(conversations)
         url_to_info = {}
 
         for persona, conv in conversations:
             for turn in conv:
                 for storm_info in turn.search_results:
-                    if storm_info.url in url_to_info:
-                        url_to_info[storm_info.url].snippets.extend(storm_info.snippets)
-                    else:
-                        url_to_info[storm_info.url] = storm_info
-        for url in url_to_info:
-            url_to_info[url].snippets = list(set(url_to_info[url].snippets))
+                    if storm_info.url not in url_to_info:
+                        url_to_info[storm_info.url] = Information(
+                            url=storm_info.url,
+                            description=storm_info.description,
+                            snippets=snippet_store.get_snippets(storm_info.url),
+                            title=storm_info.title,
+                            meta=storm_info.meta,
+                        )
         return url_to_info
 
     @staticmethod
@@ -98,32 +248,53 @@ class StormInformationTable(InformationTable):
         return conversation_log
 
     def dump_url_to_info(self, path):
-        url_to_info = copy.deepcopy(self.url_to_info)
-        for url in url_to_info:
-            url_to_info[url] = url_to_info[url].to_dict()
+        url_to_info = {url: info.to_dict() for url, info in self.url_to_info.items()}
         FileIOHelper.dump_json(url_to_info, path)
 
+    def dump_snippet_store(self, path):
+        self.snippet_store.save(path)
+
     @classmethod
-    def from_conversation_log_file(cls, path):
+    def from_conversation_log_file(cls, path, snippet_store_path=None):
+        """
+        Loads the table from a conversation log. With `snippet_store_path` (a .npz file written by
+        `dump_snippet_store`), the snippet store is loaded from it instead of being rebuilt from the conversations,
+        unless its urls do not match the conversations.
+        """
         conversation_log_data = FileIOHelper.load_json(path)
         conversations = []
         for item in conversation_log_data:
             dialogue_turns = [DialogueTurn(**turn) for turn in item["dlg_turns"]]
             persona = item["perspective"]
             conversations.append((persona, dialogue_turns))
-        return cls(conversations)
-
-    def prepare_table_for_retrieval(self):
-        self.encoder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
-        self.collected_urls = []
-        self.collected_snippets = []
-        for url, information in self.url_to_info.items():
-            for snippet in information.snippets:
-                self.collected_urls.append(url)
-                self.collected_snippets.append(snippet)
+        snippet_store = None
+        if snippet_store_path is not None and os.path.exists(snippet_store_path):
+            snippet_store = StormSnippetStore.load(snippet_store_path)
+            conversation_urls = {
+                storm_info.url
+                for _, conv in conversations
+                for turn in conv
+                for storm_info in turn.search_results or []
+            }
+            if set(snippet_store.urls) != conversation_urls:
+                # the conversation log was changed after the store was written
+                snippet_store = None
+        return cls(conversations, snippet_store=snippet_store)
+
+    def prepare_table_for_retrieval(self, encoder=None):
+        """
+        Encodes the collected snippets for `retrieve_information`.
+
+        Args:
+            encoder: Object with a SentenceTransformer-style `encode` method. Defaults to paraphrase-MiniLM-L6-v2.
+        """
+        self.encoder = encoder or SentenceTransformer("paraphrase-MiniLM-L6-v2")
+        # each unique snippet text is encoded once, rows share the embedding via snippet id
         self.encoded_snippets = self.encoder.encode(
-            self.collected_snippets, show_progress_bar=False
+            self.snippet_store.texts, show_progress_bar=False
         )
+        self.collected_url_ids = self.snippet_store.url_ids
+        self.collected_snippet_ids = self.snippet_store.snippet_ids
 
     def retrieve_information(
         self, queries: Union[List[str], str], search_top_k
@@ -135,21 +306,25 @@ class StormInformationTable(InformationTable):
         for query in queries:
             encoded_query = self.encoder.encode(query, show_progress_bar=False)
             sim = cosine_similarity([encoded_query], self.encoded_snippets)[0]
+            sim = sim[self.collected_snippet_ids]
             sorted_indices = np.argsort(sim)
             for i in sorted_indices[-search_top_k:][::-1]:
-                selected_urls.append(self.collected_urls[i])
-                selected_snippets.append(self.collected_snippets[i])
+                selected_urls.append(self.snippet_store.urls[self.collected_url_ids[i]])
+                selected_snippets.append(
+                    self.snippet_store.texts[self.collected_snippet_ids[i]]
+                )
 
         url_to_snippets = {}
         for url, snippet in zip(selected_urls, selected_snippets):
             if url not in url_to_snippets:
-                url_to_snippets[url] = set()
-            url_to_snippets[url].add(snippet)
+                url_to_snippets[url] = {}
+            url_to_snippets[url][snippet] = None
 
         selected_url_to_info = {}
         for url in url_to_snippets:
-            selected_url_to_info[url] = copy.deepcopy(self.url_to_info[url])
-            selected_url_to_info[url].snippets = list(url_to_snippets[url])
+            info_dict = self.url_to_info[url].to_dict()
+            info_dict["snippets"] = list(url_to_snippets[url])
+            selected_url_to_info[url] = Information.from_dict(info_dict)
 
         return list(selected_url_to_info.values())
 
@@ -382,13 +557,16 @@ class StormArticle(Article):
 
     def reorder_reference_index(self):
         # pre-order traversal to get order of references appear in the article
-        ref_indices = []
+        nodes_with_ref_indices = []
 
         def pre_order_find_index(node):
             if node is not None:
                 if node.content is not None and node.content:
-                    ref_indices.extend(
-                        ArticleTextProcessing.parse_citation_indices(node.content)
+                    nodes_with_ref_indices.append(
+                        (
+                            node,
+                            ArticleTextProcessing.parse_citation_indices(node.content),
+                        )
                     )
                 for child in node.children:
                     pre_order_find_index(child)
@@ -396,21 +574,17 @@ class StormArticle(Article):
         pre_order_find_index(self.root)
         # constrcut index mapping
         ref_index_mapping = {}
-        for ref_index in ref_indices:
-            if ref_index not in ref_index_mapping:
-                ref_index_mapping[ref_index] = len(ref_index_mapping) + 1
-
-        # update content
-        def pre_order_update_index(node):
-            if node is not None:
-                if node.content is not None and node.content:
-                    node.content = ArticleTextProcessing.update_citation_index(
-                        node.content, ref_index_mapping
-                    )
-                for child in node.children:
-                    pre_order_update_index(child)
-
-        pre_order_update_index(self.root)
+        for _, ref_indices in nodes_with_ref_indices:
+            for ref_index in ref_indices:
+                if ref_index not in ref_index_mapping:
+                    ref_index_mapping[ref_index] = len(ref_index_mapping) + 1
+
+        # update content, skipping nodes whose citations keep their index
+        for node, ref_indices in nodes_with_ref_indices:
+            if any(ref_index_mapping[idx] != idx for idx in ref_indices):
+                node.content = ArticleTextProcessing.update_citation_index(
+                    node.content, ref_index_mapping
+                )
         # update reference
         for url in list(self.reference["url_to_unified_index"]):
             pre_index = self.reference["url_to_unified_index"][url]
@@ -1,4 +1,3 @@
-import concurrent.futures
 import json
 import logging
 import os
@@ -20,7 +19,14 @@ from qdrant_client import QdrantClient, models
 from tqdm import tqdm
 from trafilatura import extract
 
+from .deadline import (
+    DeadlineThreadPoolExecutor,
+    as_completed_within_deadline,
+    get_deadline,
+    get_timeout,
+)
 from .lm import OpenAIModel
+from .metrics import record_response_bytes, track_request
 
 logging.getLogger("httpx").setLevel(logging.WARNING)  # Disable INFO logging for httpx.
 
@@ -290,6 +296,18 @@ class QdrantVectorStoreManager:
         qdrant.client.close()
 
 
+# Patterns used by ArticleTextProcessing, compiled once at import.
+_CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+_CITATION_REMAP_PATTERN = re.compile(r"\[(-?\d+)\]")
+_CITATION_GROUP_PATTERN = re.compile(r"\[\d+(?:,\s*\d+)*\]")
+_OUTLINE_NON_CONTENT_SECTION_PATTERN = re.compile(
+    r"#[#]? (?:See [Aa]lso|Notes|References|External [Ll]inks|Bibliography"
+    r"|Further [Rr]eading|Summary|Appendices|Appendix).*?(?=##|$)",
+    flags=re.DOTALL,
+)
+_BRACKET_PATTERN = re.compile(r"\[.*?\]")
+
+
 class ArticleTextProcessing:
     @staticmethod
     def limit_word_count_preserve_newline(input_string, max_word_count):
@@ -309,21 +327,17 @@ class ArticleTextProcessing:
         """
 
         word_count = 0
-        limited_string = ""
-
-        for word in input_string.split("\n"):
-            line_words = word.split()
-            for lw in line_words:
-                if word_count < max_word_count:
-                    limited_string += lw + " "
-                    word_count += 1
-                else:
-                    break
+        limited_lines = []
+
+        for line in input_string.split("\n"):
             if word_count >= max_word_count:
                 break
-            limited_string = limited_string.strip() + "\n"
+            line_words = line.split()[: max_word_count - word_count]
+            if line_words:
+                limited_lines.append(" ".join(line_words))
+                word_count += len(line_words)
 
-        return limited_string.strip()
+        return "\n".join(limited_lines).strip()
 
     @staticmethod
     def remove_citations(s):
@@ -339,7 +353,7 @@ class ArticleTextProcessing:
             str: The string with all citation patterns removed.
         """
 
-        return re.sub(r"\[\d+(?:,\s*\d+)*\]", "", s)
+        return _CITATION_GROUP_PATTERN.sub("", s)
 
     @staticmethod
     def parse_citation_indices(s):
@@ -352,8 +366,7 @@ class ArticleTextProcessing:
         Returns:
             List[int]: A list of unique citation indexes extracted from the content, in the order they appear.
         """
-        matches = re.findall(r"\[\d+\]", s)
-        return [int(index[1:-1]) for index in matches]
+        return [int(index) for index in _CITATION_PATTERN.findall(s)]
 
     @staticmethod
     def remove_uncompleted_sentences_with_citations(text):
@@ -449,11 +462,12 @@ class ArticleTextProcessing:
     def clean_up_outline(outline, topic=""):
         output_lines = []
         current_level = 0  # To track the current section level
+        topic_header = f"# {topic.lower()}"
 
         for line in outline.split("\n"):
             stripped_line = line.strip()
 
-            if topic != "" and f"# {topic.lower()}" in stripped_line.lower():
+            if topic != "" and topic_header in stripped_line.lower():
                 output_lines = []
 
             # Check if the line is a section header
@@ -469,29 +483,10 @@ class ArticleTextProcessing:
 
         outline = "\n".join(output_lines)
 
-        # Remove references.
-        outline = re.sub(r"#[#]? See also.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(r"#[#]? See Also.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(r"#[#]? Notes.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(r"#[#]? References.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(
-            r"#[#]? External links.*?(?=##|$)", "", outline, flags=re.DOTALL
-        )
-        outline = re.sub(
-            r"#[#]? External Links.*?(?=##|$)", "", outline, flags=re.DOTALL
-        )
-        outline = re.sub(r"#[#]? Bibliography.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(
-            r"#[#]? Further reading*?(?=##|$)", "", outline, flags=re.DOTALL
-        )
-        outline = re.sub(
-            r"#[#]? Further Reading*?(?=##|$)", "", outline, flags=re.DOTALL
-        )
-        outline = re.sub(r"#[#]? Summary.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(r"#[#]? Appendices.*?(?=##|$)", "", outline, flags=re.DOTALL)
-        outline = re.sub(r"#[#]? Appendix.*?(?=##|$)", "", outline, flags=re.DOTALL)
+        # Remove references, see also, appendix and other non-content sections.
+        outline = _OUTLINE_NON_CONTENT_SECTION_PATTERN.sub("", outline)
         # clean up citation in outline
-        outline = re.sub(r"\[.*?\]", "", outline)
+        outline = _BRACKET_PATTERN.sub("", outline)
         return outline
 
     @staticmethod
@@ -531,15 +526,19 @@ class ArticleTextProcessing:
 
     @staticmethod
     def update_citation_index(s, citation_map):
-        """Update citation index in the string based on the citation map."""
-        for original_citation in citation_map:
-            s = s.replace(
-                f"[{original_citation}]", f"__PLACEHOLDER_{original_citation}__"
-            )
-        for original_citation, unify_citation in citation_map.items():
-            s = s.replace(f"__PLACEHOLDER_{original_citation}__", f"[{unify_citation}]")
-
-        return s
+        """
+        Update citation index in the string based on the citation map. All citations are remapped at once in a
+        single pass, so a citation is never remapped twice.
+        """
+        if not citation_map:
+            return s
+        replacements = {
+            str(original_citation): f"[{unify_citation}]"
+            for original_citation, unify_citation in citation_map.items()
+        }
+        return _CITATION_REMAP_PATTERN.sub(
+            lambda match: replacements.get(match.group(1), match.group(0)), s
+        )
 
     @staticmethod
     def parse_article_into_dict(input_string):
@@ -664,24 +663,38 @@ class WebPageHelper:
         )
 
     def download_webpage(self, url: str):
-        try:
-            res = self.httpx_client.get(url, timeout=4)
-            if res.status_code >= 400:
-                res.raise_for_status()
-            return res.content
-        except httpx.HTTPError as exc:
-            print(f"Error while requesting {exc.request.url!r} - {exc!r}")
+        deadline = get_deadline()
+        if deadline is not None and deadline.expired():
             return None
+        with track_request("webpage", "WebPageHelper") as request:
+            try:
+                res = self.httpx_client.get(url, timeout=get_timeout(4))
+                if res.status_code >= 400:
+                    res.raise_for_status()
+                record_response_bytes("webpage", "WebPageHelper", len(res.content))
+                return res.content
+            except httpx.HTTPError as exc:
+                print(f"Error while requesting {exc.request.url!r} - {exc!r}")
+                request.mark_failed()
+                return None
 
     def urls_to_articles(self, urls: List[str]) -> Dict:
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.max_thread_num
+        htmls = {}
+        with DeadlineThreadPoolExecutor(
+            "webpage_download", max_workers=self.max_thread_num
         ) as executor:
-            htmls = list(executor.map(self.download_webpage, urls))
+            future_to_url = {
+                executor.submit(self.download_webpage, url): url for url in urls
+            }
+            for future in as_completed_within_deadline(
+                future_to_url, "webpage downloads"
+            ):
+                htmls[future_to_url[future]] = future.result()
 
         articles = {}
 
-        for h, u in zip(htmls, urls):
+        for u in urls:
+            h = htmls.get(u)
             if h is None:
                 continue
             article_text = extract(
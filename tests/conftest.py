@@ -0,0 +1,110 @@
+import os
+import sys
+
+import dspy
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import (
+    CollaborativeStormLMConfigs,
+    CoStormRunner,
+    RunnerArgument,
+)
+from knowledge_storm.interface import Information
+from knowledge_storm.logging_wrapper import LoggingWrapper
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+from fake_server import FakeServer
+
+
+class FakeLM:
+    """Stands in for an LM client. It is never called; tests add to `prompt_tokens` to simulate usage."""
+
+    kwargs = {"model": "fake"}
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.history = []
+
+    def get_usage_and_reset(self):
+        usage = {"fake": {"prompt_tokens": self.prompt_tokens, "completion_tokens": 0}}
+        self.prompt_tokens = 0
+        return usage
+
+
+class EmptyRM(dspy.Retrieve):
+    def forward(self, query_or_queries, exclude_urls=[]):
+        return []
+
+
+@pytest.fixture
+def make_lm_config():
+    """Returns a factory of Co-STORM LM configs whose LMs are all `FakeLM`s."""
+
+    def make():
+        lm_config = CollaborativeStormLMConfigs()
+        for attr_name in list(lm_config.__dict__):
+            setattr(lm_config, attr_name, FakeLM())
+        return lm_config
+
+    return make
+
+
+@pytest.fixture
+def make_rm():
+    """Returns a factory of retrieval modules that find nothing."""
+    return EmptyRM
+
+
+@pytest.fixture
+def make_runner(make_lm_config, make_rm):
+    """Returns a factory of Co-STORM runners on "topic" with fake LMs; keyword arguments go to `RunnerArgument`."""
+
+    def make(**runner_argument_kwargs):
+        lm_config = make_lm_config()
+        return CoStormRunner(
+            lm_config=lm_config,
+            runner_argument=RunnerArgument(topic="topic", **runner_argument_kwargs),
+            logging_wrapper=LoggingWrapper(lm_config),
+            rm=make_rm(),
+        )
+
+    return make
+
+
+@pytest.fixture
+def restored_runner_dict(make_lm_config, make_rm):
+    """
+    Returns a function mapping a runner to the dict of a runner restored from it. `ConversationTurn.from_dict` pads the
+    role description, so runners restored from checkpoints or spills are compared against this.
+    """
+
+    def restore(costorm_runner):
+        return CoStormRunner.from_dict(
+            costorm_runner.to_dict(), lm_config=make_lm_config(), rm=make_rm()
+        ).to_dict()
+
+    return restore
+
+
+@pytest.fixture
+def make_information():
+    """Returns a factory of distinct `Information` objects numbered by `idx`."""
+
+    def make(idx):
+        return Information(
+            url=f"https://example.com/{idx}",
+            description="description",
+            snippets=[f"snippet {idx}"],
+            title=f"title {idx}",
+            meta={"question": "q", "query": "query"},
+        )
+
+    return make
+
+
+@pytest.fixture
+def fake_server():
+    """A running `benchmarks/fake_server.py` server with the default config."""
+    server = FakeServer().start()
+    yield server
+    server.stop()
@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from knowledge_storm.collaborative_storm.checkpoint import CoStormCheckpointLog
+from knowledge_storm.dataclass import ConversationTurn
+
+
+def _make_turn(utterance):
+    return ConversationTurn(
+        role="Expert: an expert",
+        raw_utterance=utterance,
+        utterance_type="Potential Answer",
+        utterance=utterance,
+    )
+
+
+@pytest.fixture
+def load_checkpoint(make_lm_config, make_rm):
+    def load(path):
+        return CoStormCheckpointLog.load(
+            str(path), lm_config=make_lm_config(), rm=make_rm()
+        )
+
+    return load
+
+
+def test_checkpoint_log_round_trip(
+    tmp_path, make_runner, make_information, load_checkpoint, restored_runner_dict
+):
+    path = tmp_path / "session.jsonl"
+    runner = make_runner()
+    checkpoint_log = CoStormCheckpointLog(str(path))
+    runner.knowledge_base.insert_from_outline_string("# a\n## b\n# c")
+    runner.knowledge_base.insert_information("a -> b", make_information(1))
+    runner.conversation_history.append(_make_turn("first"))
+    runner.discourse_manager.next_turn_moderator_override = True
+    checkpoint_log.checkpoint(runner)
+    assert load_checkpoint(path).to_dict() == restored_runner_dict(runner)
+
+    runner.conversation_history.append(_make_turn("second"))
+    runner.knowledge_base.insert_information(
+        "c -> d", make_information(2), missing_node_handling="create"
+    )
+    runner.discourse_manager.next_turn_moderator_override = False
+    checkpoint_log.checkpoint(runner)
+    assert load_checkpoint(path).to_dict() == restored_runner_dict(runner)
+    assert load_checkpoint(path).to_dict()["next_turn_moderator_override"] is False
+
+
+def test_checkpoint_log_records_non_sequential_info_uuids(
+    tmp_path, make_runner, make_information, load_checkpoint, restored_runner_dict
+):
+    path = tmp_path / "session.jsonl"
+    runner = make_runner()
+    checkpoint_log = CoStormCheckpointLog(str(path))
+    checkpoint_log.checkpoint(runner)
+
+    runner.knowledge_base.restore_information(
+        citation_uuid=7, information=make_information(7)
+    )
+    runner.knowledge_base.insert_information(
+        "a", make_information(1), missing_node_handling="create"
+    )
+    checkpoint_log.checkpoint(runner)
+
+    restored = load_checkpoint(path)
+    assert set(restored.knowledge_base.info_uuid_to_info_dict) == {2, 7}
+    assert restored.to_dict() == restored_runner_dict(runner)
+
+
+def test_checkpoint_delta_holds_only_new_info(
+    tmp_path, make_runner, make_information, load_checkpoint, restored_runner_dict
+):
+    path = tmp_path / "session.jsonl"
+    runner = make_runner()
+    checkpoint_log = CoStormCheckpointLog(str(path))
+    runner.knowledge_base.insert_from_outline_string("# a")
+    runner.knowledge_base.insert_information("a", make_information(1))
+    checkpoint_log.checkpoint(runner)
+
+    runner.knowledge_base.insert_information("a", make_information(2))
+    # cited but not placed in the tree
+    runner.knowledge_base.insert_information(
+        "missing", make_information(3), missing_node_handling="abort"
+    )
+    checkpoint_log.checkpoint(runner)
+
+    delta = json.loads(path.read_text().splitlines()[-1])
+    assert delta["type"] == "delta"
+    assert sorted(delta["new_info"]) == ["2", "3"]
+    assert load_checkpoint(path).to_dict() == restored_runner_dict(runner)
@@ -0,0 +1,113 @@
+import pytest
+
+from knowledge_storm.interface import LMConfigs
+
+pytest.importorskip("anthropic")
+
+from knowledge_storm.lm import ClaudeModel
+from fake_server import _count_tokens
+
+SEPARATOR = ClaudeModel.DSPY_SECTION_SEPARATOR
+TEMPLATE = "Write the section. " * 40 + SEPARATOR + "Demo: " * 40 + SEPARATOR
+
+
+@pytest.fixture
+def make_claude_model(fake_server):
+    def make(**kwargs):
+        return ClaudeModel(
+            model="claude-3-5-sonnet",
+            api_key="fake",
+            api_base=f"{fake_server.url}/v1/messages",
+            cache_min_tokens=50,
+            max_tokens=100,
+            **kwargs,
+        )
+
+    return make
+
+
+def test_stable_prefixes_get_cache_breakpoints(make_claude_model):
+    lm = make_claude_model()
+    collected_info = "Collected information: " * 40 + "\n"
+
+    content = lm._build_message_content(TEMPLATE + collected_info + "Section: a")
+    assert [block["text"] for block in content] == [
+        TEMPLATE,
+        collected_info + "Section: a",
+    ]
+    assert content[0]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in content[1]
+
+    # the collected information is shared with the previous prompt
+    content = lm._build_message_content(TEMPLATE + collected_info + "Section: b")
+    assert [block["text"] for block in content] == [
+        TEMPLATE,
+        collected_info,
+        "Section: b",
+    ]
+    assert [bool(block.get("cache_control")) for block in content] == [
+        True,
+        True,
+        False,
+    ]
+
+
+def test_short_prefixes_are_not_cached(make_claude_model):
+    lm = make_claude_model()
+    prompt = "Short instructions." + SEPARATOR + "Input: a\nOutput:"
+    assert lm._build_message_content(prompt) == prompt
+    assert lm._build_message_content(prompt) == prompt
+
+    # only the inputs shared with the previous prompt are long enough to cache
+    prompt = "Short instructions." + SEPARATOR + "Input: " * 40 + "\nOutput:"
+    assert lm._build_message_content(prompt) == prompt
+    content = lm._build_message_content(prompt)
+    assert [block["text"] for block in content] == [prompt[:-7], "Output:"]
+
+    lm = make_claude_model(prompt_caching=False)
+    assert lm._build_message_content(TEMPLATE + "Output:") == TEMPLATE + "Output:"
+
+
+def test_usage_counts_cache_reads_and_writes(make_claude_model, fake_server):
+    lm = make_claude_model()
+    prompt = TEMPLATE + "Output:"
+    template_tokens = _count_tokens(TEMPLATE)
+
+    lm(prompt)
+    lm(prompt)
+
+    assert lm.get_usage_and_reset() == {
+        "claude-3-5-sonnet": {
+            "prompt_tokens": 2 * (_count_tokens(prompt) - template_tokens),
+            "completion_tokens": lm.history[0]["response"]["usage"]["output_tokens"]
+            + lm.history[1]["response"]["usage"]["output_tokens"],
+            "cache_creation_input_tokens": template_tokens,
+            "cache_read_input_tokens": template_tokens,
+        }
+    }
+    assert fake_server.get_stats()["messages"] == {
+        "requests": 2,
+        "cache_misses": 1,
+        "cache_hits": 1,
+    }
+    assert lm.get_usage_and_reset()["claude-3-5-sonnet"]["cache_read_input_tokens"] == 0
+
+
+def test_lm_configs_merge_cache_usage(make_claude_model):
+    class ClaudeLMConfigs(LMConfigs):
+        def __init__(self):
+            self.question_lm = make_claude_model()
+            self.answer_lm = make_claude_model()
+
+    lm_configs = ClaudeLMConfigs()
+    prompt = TEMPLATE + "Output:"
+    # the fake server shares its prompt cache between clients, like one Anthropic account
+    lm_configs.question_lm(prompt)
+    lm_configs.answer_lm(prompt)
+
+    usage = lm_configs.collect_and_reset_lm_usage()["claude-3-5-sonnet"]
+    assert usage["cache_creation_input_tokens"] == _count_tokens(TEMPLATE)
+    assert usage["cache_read_input_tokens"] == _count_tokens(TEMPLATE)
+    assert usage["prompt_tokens"] == 2 * (
+        _count_tokens(prompt) - _count_tokens(TEMPLATE)
+    )
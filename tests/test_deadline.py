@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from knowledge_storm import deadline as deadline_module
+from knowledge_storm.deadline import (
+    DeadlineExceeded,
+    DeadlineThreadPoolExecutor,
+    as_completed_within_deadline,
+    deadline_lm_call,
+    deadline_scope,
+    get_timeout,
+    run_within_deadline,
+)
+
+
+class FakeLM:
+    def __init__(self, delay=0.0, inner=None):
+        self.delay = delay
+        self.inner = inner
+        self.threads = []
+
+    @deadline_lm_call
+    def __call__(self, prompt):
+        self.threads.append(threading.current_thread())
+        time.sleep(self.delay)
+        if self.inner is not None:
+            return self.inner(prompt)
+        return [prompt]
+
+
+def test_call_without_deadline_runs_inline():
+    lm = FakeLM()
+    assert lm("prompt") == ["prompt"]
+    assert lm.threads == [threading.current_thread()]
+
+
+def test_call_past_deadline_raises():
+    lm = FakeLM(delay=1.0)
+    with deadline_scope(0.1):
+        with pytest.raises(DeadlineExceeded):
+            lm("prompt")
+
+
+def test_nested_call_under_same_deadline_runs_inline():
+    # e.g. an LM pool whose replicas are also decorated with `deadline_lm_call`
+    replica = FakeLM()
+    pool = FakeLM(inner=replica)
+    with deadline_scope(5):
+        assert pool("prompt") == ["prompt"]
+    assert pool.threads[0] is not threading.current_thread()
+    assert replica.threads == pool.threads
+
+
+def test_threads_are_bounded(monkeypatch):
+    monkeypatch.setattr(
+        deadline_module, "_deadline_call_slots", threading.BoundedSemaphore(1)
+    )
+    release = threading.Event()
+    with deadline_scope(0.1):
+        with pytest.raises(DeadlineExceeded):
+            run_within_deadline(release.wait)
+    # the abandoned call still holds the only slot
+    started = time.monotonic()
+    with deadline_scope(0.1):
+        with pytest.raises(DeadlineExceeded):
+            run_within_deadline(lambda: None)
+    assert time.monotonic() - started < 0.5
+
+    release.set()
+    deadline_module._deadline_call_slots.acquire(timeout=1)
+    deadline_module._deadline_call_slots.release()
+    with deadline_scope(1):
+        assert run_within_deadline(lambda: "done") == "done"
+
+
+def test_earlier_enclosing_deadline_wins():
+    with deadline_scope(1, name="outer") as outer:
+        with deadline_scope(10, name="inner") as inner:
+            assert inner is outer
+            assert get_timeout(default=30) <= 1
+        with deadline_scope(0.5, name="inner") as inner:
+            assert inner is not outer
+            assert get_timeout() <= 0.5
+    assert get_timeout(default=30) == 30
+
+
+def test_as_completed_within_deadline_drops_slow_tasks():
+    release = threading.Event()
+    with deadline_scope(0.2):
+        with DeadlineThreadPoolExecutor("test", max_workers=1) as executor:
+            fast = executor.submit(lambda: "fast")
+            slow = executor.submit(release.wait, 5)
+            queued = executor.submit(lambda: "queued")
+            results = [
+                f.result() for f in as_completed_within_deadline([fast, slow, queued])
+            ]
+    release.set()
+    assert results == ["fast"]
+    assert queued.cancelled()
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import CollaborativeStormLMConfigs
+from knowledge_storm.hedging import (
+    HedgingPolicy,
+    get_hedge_counts_and_reset,
+    hedge_lm_call,
+)
+
+
+def _make_policy(max_hedge_ratio=1.0):
+    policy = HedgingPolicy(
+        percentile=50,
+        min_delay_seconds=0.05,
+        max_hedge_ratio=max_hedge_ratio,
+        min_samples=1,
+    )
+    policy.record_latency(0.05)
+    return policy
+
+
+class Attempts:
+    """Calls that behave differently per attempt: (delay, result or exception) in the order they start."""
+
+    def __init__(self, *behaviors):
+        self.behaviors = list(behaviors)
+        self.num_calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            delay, outcome = self.behaviors[self.num_calls]
+            self.num_calls += 1
+        time.sleep(delay)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def test_fast_call_is_not_hedged():
+    policy = _make_policy()
+    call = Attempts((0, "primary"))
+
+    assert policy.run(call) == "primary"
+    assert call.num_calls == 1
+    assert policy.get_counts_and_reset() == {"hedged_requests": 0, "hedge_wins": 0}
+
+
+def test_slow_call_is_hedged_and_hedge_wins():
+    policy = _make_policy()
+    call = Attempts((1.0, "primary"), (0, "hedge"))
+
+    assert policy.run(call) == "hedge"
+    assert call.num_calls == 2
+    assert policy.get_counts_and_reset() == {"hedged_requests": 1, "hedge_wins": 1}
+
+
+def test_failed_attempt_falls_back_to_the_other():
+    policy = _make_policy()
+    call = Attempts((0.1, ValueError("primary failed")), (0.3, "hedge"))
+
+    assert policy.run(call) == "hedge"
+    assert policy.get_counts_and_reset() == {"hedged_requests": 1, "hedge_wins": 1}
+
+
+def test_error_is_raised_when_all_attempts_fail():
+    policy = _make_policy()
+    call = Attempts(
+        (0.1, ValueError("primary failed")), (0.3, KeyError("hedge failed"))
+    )
+
+    with pytest.raises(ValueError, match="primary failed"):
+        policy.run(call)
+
+
+def test_fast_failure_is_raised_without_hedging():
+    policy = _make_policy()
+    call = Attempts((0, ValueError("failed")))
+
+    with pytest.raises(ValueError):
+        policy.run(call)
+    assert call.num_calls == 1
+
+
+def test_hedges_are_capped_by_the_budget():
+    policy = _make_policy(max_hedge_ratio=0.5)
+    call = Attempts((0.1, "primary"))
+
+    # the first call may not hedge, since one duplicate would exceed half of one call
+    assert policy.run(call) == "primary"
+    assert call.num_calls == 1
+    assert policy.get_counts_and_reset()["hedged_requests"] == 0
+
+
+class FakeLM:
+    kwargs = {"model": "fake"}
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.delays = [1.0, 0]
+        self.hedging_policy = _make_policy()
+
+    @hedge_lm_call
+    def __call__(self, prompt, **kwargs):
+        time.sleep(self.delays.pop(0))
+        self.prompt_tokens += 10
+        return [f"completion of {prompt}"]
+
+    def get_usage_and_reset(self):
+        usage = {"fake": {"prompt_tokens": self.prompt_tokens, "completion_tokens": 0}}
+        self.prompt_tokens = 0
+        return usage
+
+
+def test_co_storm_usage_reports_hedged_requests():
+    lm_config = CollaborativeStormLMConfigs()
+    lm_config.question_answering_lm = FakeLM()
+
+    assert lm_config.question_answering_lm("prompt") == ["completion of prompt"]
+
+    usage = lm_config.collect_and_reset_lm_usage()["question_answering_lm"]["fake"]
+    assert usage["hedged_requests"] == 1
+    assert usage["hedge_wins"] == 1
+    assert get_hedge_counts_and_reset(lm_config.question_answering_lm) == {
+        "hedged_requests": 0,
+        "hedge_wins": 0,
+    }
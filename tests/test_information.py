@@ -0,0 +1,73 @@
+import copy
+import hashlib
+import json
+import pickle
+
+from knowledge_storm.interface import Information
+
+
+def _make_information():
+    info = Information(
+        url="https://example.com",
+        description="description",
+        snippets=["b", "a"],
+        title="title",
+        meta={"question": "q", "query": "query"},
+    )
+    info.citation_uuid = 3
+    return info
+
+
+def _reference_hash(url, snippets, meta):
+    """The hash before it was memoized."""
+    meta_str = f"Question: {meta.get('question', '')}, Query: {meta.get('query', '')}"
+    value = json.dumps((url, tuple(sorted(snippets)), meta_str), sort_keys=True)
+    return hash(int(hashlib.md5(value.encode("utf-8")).hexdigest(), 16))
+
+
+def test_hash_matches_reference():
+    info = _make_information()
+    assert hash(info) == _reference_hash(info.url, info.snippets, info.meta)
+
+
+def test_hash_follows_mutations():
+    info = _make_information()
+    hash(info)
+
+    info.snippets.append("c")
+    assert hash(info) == _reference_hash(info.url, ["a", "b", "c"], info.meta)
+    info.meta["query"] = "other query"
+    assert hash(info) == _reference_hash(info.url, ["a", "b", "c"], info.meta)
+    info.url = "https://example.org"
+    assert hash(info) == _reference_hash(info.url, ["a", "b", "c"], info.meta)
+    info.snippets = ["d"]
+    assert hash(info) == _reference_hash(info.url, ["d"], info.meta)
+
+
+def test_pickle_and_deepcopy_round_trip():
+    info = _make_information()
+    hash(info)
+
+    for restored in (pickle.loads(pickle.dumps(info)), copy.deepcopy(info)):
+        assert restored == info
+        assert hash(restored) == hash(info)
+        assert restored.to_dict() == info.to_dict()
+        assert restored.citation_uuid == 3
+        # the copy is independent of the original
+        restored.snippets.append("new")
+        assert hash(restored) != hash(info)
+
+
+def test_to_dict_round_trip():
+    info = _make_information()
+    restored = Information.from_dict(info.to_dict())
+    assert restored == info
+    assert type(restored.to_dict()["snippets"]) is list
+    assert type(restored.to_dict()["meta"]) is dict
+
+
+def test_equal_information_deduplicates_in_sets():
+    info = _make_information()
+    same = _make_information()
+    same.snippets = ["a", "b"]
+    assert len({info, same}) == 1
@@ -0,0 +1,112 @@
+import dspy
+import numpy as np
+import pytest
+
+from knowledge_storm.collaborative_storm.modules import information_insertion_module
+from knowledge_storm.collaborative_storm.modules.information_insertion_module import (
+    InsertInformationModule,
+)
+from knowledge_storm.logging_wrapper import LoggingWrapper
+
+OUTLINES = ["a", "b", "c"]
+
+
+@pytest.fixture
+def insert_module(monkeypatch):
+    # the intent is always embedded as the first axis
+    monkeypatch.setattr(
+        information_insertion_module,
+        "get_text_embeddings",
+        lambda text, embedding_cache=None: (np.array([1.0, 0.0]), 0),
+    )
+    module = InsertInformationModule(engine=None)
+    module.candidate_choosing = lambda intent, choices: dspy.Prediction(
+        decision="Best placement: [2]"
+    )
+    return module
+
+
+def _encode_outlines(similarities):
+    """Returns unit outline embeddings whose cosine similarities to the intent are `similarities`."""
+    return np.array([[sim, np.sqrt(1 - sim**2)] for sim in similarities])
+
+
+@pytest.mark.parametrize(
+    "sorted_sim, confident",
+    [
+        ([0.9, 0.5], True),
+        ([0.7, 0.5], True),
+        ([0.69, 0.1], False),
+        ([0.9, 0.85], False),
+        ([0.9], True),
+        ([0.6], False),
+        ([], False),
+        (None, False),
+    ],
+)
+def test_default_placement_thresholds(insert_module, sorted_sim, confident):
+    sorted_sim = None if sorted_sim is None else np.array(sorted_sim)
+    assert (
+        bool(insert_module._is_confident_embedding_placement(sorted_sim)) == confident
+    )
+
+
+def test_confident_placement_skips_lm(insert_module):
+    def fail(intent, choices):
+        raise AssertionError("the LM should not be called")
+
+    insert_module.candidate_choosing = fail
+    prediction = insert_module.choose_candidate_from_embedding_ranking(
+        "question", "query", _encode_outlines([0.3, 0.95, 0.5]), OUTLINES
+    )
+
+    assert prediction.information_placement == "b"
+    assert insert_module.get_placement_stats_and_reset() == {
+        "embedding_only_count": 1,
+        "lm_choice_count": 0,
+    }
+
+
+def test_ambiguous_placement_asks_lm(insert_module):
+    prediction = insert_module.choose_candidate_from_embedding_ranking(
+        "question", "query", _encode_outlines([0.3, 0.95, 0.9]), OUTLINES
+    )
+
+    # the second ranked candidate, as chosen by the LM
+    assert prediction.information_placement == "c"
+    assert insert_module.get_placement_stats_and_reset() == {
+        "embedding_only_count": 0,
+        "lm_choice_count": 1,
+    }
+    assert insert_module.get_placement_stats_and_reset() == {
+        "embedding_only_count": 0,
+        "lm_choice_count": 0,
+    }
+
+
+def test_custom_thresholds(insert_module):
+    insert_module.placement_similarity_threshold = 0.5
+    insert_module.placement_margin_threshold = 0.0
+
+    assert insert_module._is_confident_embedding_placement(np.array([0.6, 0.6]))
+
+
+def test_logged_skip_rate():
+    logging_wrapper = LoggingWrapper(lm_config=None)
+    with logging_wrapper.log_pipeline_stage("stage"):
+        logging_wrapper.add_placement_stats(
+            {"embedding_only_count": 2, "lm_choice_count": 1}
+        )
+        logging_wrapper.add_placement_stats(
+            {"embedding_only_count": 1, "lm_choice_count": 0}
+        )
+    with logging_wrapper.log_pipeline_stage("empty stage"):
+        pass
+
+    log_dump = logging_wrapper.dump_logging_and_reset()
+    assert log_dump["stage"]["placement_stats"] == {
+        "embedding_only_count": 3,
+        "lm_choice_count": 1,
+        "lm_skip_rate": 0.75,
+    }
+    assert log_dump["empty stage"]["placement_stats"]["lm_skip_rate"] == 0.0
@@ -0,0 +1,236 @@
+import numpy as np
+import pytest
+
+from knowledge_storm import encoder
+from knowledge_storm.dataclass import KnowledgeBase
+
+
+@pytest.fixture
+def knowledge_base(make_information):
+    knowledge_base = KnowledgeBase(
+        topic="topic", knowledge_base_lm=None, node_expansion_trigger_count=10
+    )
+    knowledge_base.insert_from_outline_string("# a\n## b\n# c\n# empty")
+    knowledge_base.insert_information("topic -> a -> b", make_information(1))
+    knowledge_base.insert_information("topic -> c", make_information(2))
+    return knowledge_base
+
+
+def _get_tree(node):
+    return {
+        child.name: (sorted(child.content), _get_tree(child)) for child in node.children
+    }
+
+
+def _assert_placements_match_tree(knowledge_base):
+    def check(node):
+        for citation_uuid in node.content:
+            assert knowledge_base.info_uuid_to_info_dict[citation_uuid].meta[
+                "placement"
+            ] == " -> ".join(node.get_path_from_root())
+        for child in node.children:
+            check(child)
+
+    check(knowledge_base.root)
+
+
+def _reorganize_without_lm(knowledge_base):
+    knowledge_base.trim_empty_leaf_nodes()
+    knowledge_base.merge_single_child_nodes()
+    knowledge_base.update_all_info_path()
+
+
+def test_reorganize_snapshot_is_independent(knowledge_base):
+    tree = _get_tree(knowledge_base.root)
+    placements = {
+        uuid: info.meta["placement"]
+        for uuid, info in knowledge_base.info_uuid_to_info_dict.items()
+    }
+
+    snapshot = knowledge_base.get_reorganize_snapshot()
+    _reorganize_without_lm(snapshot)
+
+    assert _get_tree(snapshot.root) == {"a": ([1], {}), "c": ([2], {})}
+    assert _get_tree(knowledge_base.root) == tree
+    assert {
+        uuid: info.meta["placement"]
+        for uuid, info in knowledge_base.info_uuid_to_info_dict.items()
+    } == placements
+
+
+def test_apply_reorganized_snapshot_replays_concurrent_mutations(
+    knowledge_base, make_information
+):
+    snapshot = knowledge_base.get_reorganize_snapshot()
+    _reorganize_without_lm(snapshot)
+
+    # mutations made while the snapshot was being reorganized, one of them under a node the reorganization removed
+    knowledge_base.insert_information("topic -> empty", make_information(3))
+    knowledge_base.insert_node(
+        "d", parent_node=knowledge_base.find_node_by_path("topic -> c")
+    )
+    knowledge_base.insert_information("topic -> c -> d", make_information(4))
+
+    knowledge_base.apply_reorganized_snapshot(snapshot)
+
+    assert _get_tree(knowledge_base.root) == {
+        "a": ([1], {}),
+        "c": ([2], {"d": ([4], {})}),
+        "empty": ([3], {}),
+    }
+    _assert_placements_match_tree(knowledge_base)
+    assert knowledge_base._reorganize_journal is None
+
+
+def test_discarded_reorganize_snapshot_stops_journaling(
+    knowledge_base, make_information
+):
+    snapshot = knowledge_base.get_reorganize_snapshot()
+    _reorganize_without_lm(snapshot)
+    knowledge_base.discard_reorganize_snapshot()
+
+    knowledge_base.insert_information("topic -> empty", make_information(3))
+
+    assert knowledge_base._reorganize_journal is None
+    assert _get_tree(knowledge_base.root)["empty"] == ([3], {})
+    assert _get_tree(knowledge_base.root)["a"] == ([], {"b": ([1], {})})
+
+
+class FakeEmbeddings:
+    """Embeds "snippet <idx>" as a one-hot vector; texts in `failing` get no embedding."""
+
+    def __init__(self):
+        self.failing = set()
+        self.encoded = []
+
+    def __call__(self, texts, max_workers=5, embedding_cache=None):
+        for text in texts:
+            if text in embedding_cache or text in self.failing:
+                continue
+            self.encoded.append(text)
+            embedding = np.zeros(64)
+            embedding[int(text.split()[-1])] = 2.0
+            embedding_cache[text] = embedding
+
+
+def test_is_information_cited(knowledge_base, make_information):
+    assert knowledge_base.is_information_cited(make_information(1))
+    assert not knowledge_base.is_information_cited(make_information(3))
+    knowledge_base.insert_information("topic -> c", make_information(3))
+    assert knowledge_base.is_information_cited(make_information(3))
+
+
+def test_cited_snippets_embedding_is_incremental(
+    monkeypatch, knowledge_base, make_information
+):
+    fake_embeddings = FakeEmbeddings()
+    monkeypatch.setattr(encoder, "get_text_embeddings", fake_embeddings)
+
+    first = knowledge_base.get_cited_snippets_embedding()
+    assert np.array_equal(first[:, 1:3], np.eye(2))
+    for idx in range(3, 40):
+        knowledge_base.insert_information("topic -> c", make_information(idx))
+    embedding = knowledge_base.get_cited_snippets_embedding()
+
+    assert embedding.shape == (39, 64)
+    assert np.array_equal(embedding[:, 1:40], np.eye(39))
+    # each snippet is encoded once, and earlier results are not changed by growing the matrix
+    assert len(fake_embeddings.encoded) == 39
+    assert np.array_equal(first[:, 1:3], np.eye(2))
+    assert knowledge_base.get_cited_snippets_embedding().shape == (39, 64)
+
+
+def test_cited_snippets_with_failed_embeddings_are_retried(monkeypatch, knowledge_base):
+    fake_embeddings = FakeEmbeddings()
+    fake_embeddings.failing = {"snippet 2"}
+    monkeypatch.setattr(encoder, "get_text_embeddings", fake_embeddings)
+
+    assert knowledge_base.get_cited_snippets_embedding().shape == (1, 64)
+    fake_embeddings.failing = set()
+    embedding = knowledge_base.get_cited_snippets_embedding()
+
+    assert embedding.shape == (2, 64)
+    assert sorted(np.argmax(embedding, axis=1)) == [1, 2]
+
+
+class FakeSummaryModule:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, knowledge_base, previous_summary=None, new_node_paths=None):
+        self.calls.append((previous_summary, new_node_paths))
+        return f"summary {len(self.calls)}"
+
+
+@pytest.fixture
+def summarized_knowledge_base(knowledge_base):
+    knowledge_base.gen_summary_module = FakeSummaryModule()
+    assert knowledge_base.get_knowledge_base_summary() == "summary 1"
+    return knowledge_base
+
+
+def test_summary_is_cached_per_structure_version(
+    summarized_knowledge_base, make_information
+):
+    version = summarized_knowledge_base.structure_version
+    # information under existing nodes does not change the structure
+    summarized_knowledge_base.insert_information("topic -> c", make_information(3))
+
+    assert summarized_knowledge_base.get_knowledge_base_summary() == "summary 1"
+    assert summarized_knowledge_base.structure_version == version
+    assert len(summarized_knowledge_base.gen_summary_module.calls) == 1
+
+
+def _reorganize_snapshot_of(knowledge_base):
+    snapshot = knowledge_base.get_reorganize_snapshot()
+    _reorganize_without_lm(snapshot)
+    knowledge_base.apply_reorganized_snapshot(snapshot)
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda kb, info: kb.insert_node("d"),
+        lambda kb, info: kb.insert_from_outline_string("# d"),
+        lambda kb, info: kb.insert_information(
+            "topic -> d", info, missing_node_handling="create"
+        ),
+        lambda kb, info: kb.apply_mutation_log([("add_node", "topic", "d", "skip")]),
+        lambda kb, info: kb.trim_empty_leaf_nodes(),
+        lambda kb, info: kb.merge_single_child_nodes(),
+        lambda kb, info: _reorganize_snapshot_of(kb),
+    ],
+    ids=[
+        "insert_node",
+        "insert_from_outline_string",
+        "insert_information",
+        "apply_mutation_log",
+        "trim_empty_leaf_nodes",
+        "merge_single_child_nodes",
+        "apply_reorganized_snapshot",
+    ],
+)
+def test_structural_mutations_invalidate_summary(
+    summarized_knowledge_base, make_information, mutate
+):
+    version = summarized_knowledge_base.structure_version
+    mutate(summarized_knowledge_base, make_information(3))
+
+    assert summarized_knowledge_base.structure_version > version
+    assert summarized_knowledge_base.get_knowledge_base_summary() == "summary 2"
+
+
+def test_grown_structure_is_summarized_incrementally(summarized_knowledge_base):
+    summarized_knowledge_base.incremental_summary = True
+    summarized_knowledge_base.insert_from_outline_string("# d\n## e")
+
+    assert summarized_knowledge_base.get_knowledge_base_summary() == "summary 2"
+    assert summarized_knowledge_base.gen_summary_module.calls[-1] == (
+        "summary 1",
+        ["d", "d -> e"],
+    )
+
+    # a removed node requires a full summary
+    summarized_knowledge_base.trim_empty_leaf_nodes()
+    assert summarized_knowledge_base.get_knowledge_base_summary() == "summary 3"
+    assert summarized_knowledge_base.gen_summary_module.calls[-1] == (None, None)
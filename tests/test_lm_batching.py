@@ -0,0 +1,147 @@
+import threading
+
+import pytest
+
+from knowledge_storm.lm_batching import (
+    MicroBatcher,
+    apportion,
+    split_completions_response,
+)
+
+
+def _submit_concurrently(batcher, prompts, **kwargs):
+    results = {}
+    errors = {}
+    barrier = threading.Barrier(len(prompts))
+
+    def run(prompt):
+        barrier.wait()
+        try:
+            results[prompt] = batcher.submit(prompt, **kwargs)
+        except Exception as e:
+            errors[prompt] = e
+
+    threads = [threading.Thread(target=run, args=(prompt,)) for prompt in prompts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+class RecordingBatchFn:
+    def __init__(self, error=None, drop_last=False):
+        self.batches = []
+        self.error = error
+        self.drop_last = drop_last
+        self._lock = threading.Lock()
+
+    def __call__(self, prompts, **kwargs):
+        with self._lock:
+            self.batches.append((list(prompts), kwargs))
+        if self.error is not None:
+            raise self.error
+        results = [f"{prompt} {kwargs}" for prompt in prompts]
+        return results[:-1] if self.drop_last else results
+
+
+def test_concurrent_calls_are_batched():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher(batch_fn, max_batch_size=16, window_ms=200)
+    prompts = [f"prompt {i}" for i in range(5)]
+
+    results, errors = _submit_concurrently(batcher, prompts, temperature=0)
+
+    assert errors == {}
+    assert results == {prompt: f"{prompt} {{'temperature': 0}}" for prompt in prompts}
+    assert len(batch_fn.batches) == 1
+    assert sorted(batch_fn.batches[0][0]) == prompts
+
+
+def test_batches_are_capped_at_max_batch_size():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, window_ms=200)
+
+    results, errors = _submit_concurrently(batcher, [f"p{i}" for i in range(5)])
+
+    assert errors == {}
+    assert len(results) == 5
+    assert all(len(prompts) <= 2 for prompts, _ in batch_fn.batches)
+    assert sum(len(prompts) for prompts, _ in batch_fn.batches) == 5
+
+
+def test_calls_with_different_kwargs_are_not_batched_together():
+    batch_fn = RecordingBatchFn()
+    batcher = MicroBatcher(batch_fn, window_ms=50)
+    results = {}
+
+    def run(prompt, temperature):
+        results[prompt] = batcher.submit(prompt, temperature=temperature)
+
+    threads = [
+        threading.Thread(target=run, args=("a", 0)),
+        threading.Thread(target=run, args=("b", 1)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {"a": "a {'temperature': 0}", "b": "b {'temperature': 1}"}
+    assert sorted(prompts for prompts, _ in batch_fn.batches) == [["a"], ["b"]]
+
+
+def test_batch_error_is_raised_by_every_call():
+    batcher = MicroBatcher(
+        RecordingBatchFn(error=RuntimeError("server error")), window_ms=200
+    )
+
+    results, errors = _submit_concurrently(batcher, ["a", "b", "c"])
+
+    assert results == {}
+    assert set(errors) == {"a", "b", "c"}
+    assert all(isinstance(error, RuntimeError) for error in errors.values())
+
+
+def test_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(RecordingBatchFn(drop_last=True), window_ms=200)
+
+    results, errors = _submit_concurrently(batcher, ["a", "b"])
+
+    assert results == {}
+    assert all(isinstance(error, ValueError) for error in errors.values())
+    # the batcher keeps working after a failed batch
+    batcher.batch_fn = RecordingBatchFn()
+    assert batcher.submit("c") == "c {}"
+
+
+def test_apportion_sums_to_total():
+    assert apportion(10, [1, 1, 1]) == [4, 3, 3]
+    assert apportion(7, [0, 0]) == [4, 3]
+    assert apportion(5, []) == []
+    assert sum(apportion(101, [3, 5, 7, 11])) == 101
+
+
+def test_split_completions_response():
+    response = {
+        "id": "batch",
+        "model": "model",
+        "choices": [
+            {"index": 3, "text": "b2"},
+            {"index": 0, "text": "a1"},
+            {"index": 1, "text": "a2"},
+            {"index": 2, "text": "b1"},
+        ],
+        "usage": {"prompt_tokens": 9, "completion_tokens": 4},
+    }
+
+    responses = split_completions_response(response, ["a", "b"], n=2)
+
+    assert [[c["text"] for c in r["choices"]] for r in responses] == [
+        ["a1", "a2"],
+        ["b1", "b2"],
+    ]
+    assert [[c["index"] for c in r["choices"]] for r in responses] == [[0, 1], [0, 1]]
+    assert sum(r["usage"]["prompt_tokens"] for r in responses) == 9
+    assert sum(r["usage"]["completion_tokens"] for r in responses) == 4
+    assert all(r["batch_size"] == 2 for r in responses)
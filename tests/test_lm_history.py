@@ -0,0 +1,130 @@
+import copy
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+from knowledge_storm.interface import LMConfigs
+from knowledge_storm.lm_history import (
+    JSONLHistorySink,
+    LMHistoryBuffer,
+    LMHistorySink,
+    read_lm_history,
+)
+
+
+class ListSink(LMHistorySink):
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+def test_buffer_keeps_recent_calls_and_streams_all():
+    sink = ListSink()
+    history = LMHistoryBuffer(maxlen=2, sink=sink)
+    for idx in range(5):
+        history.append({"prompt": idx})
+
+    assert list(history) == [{"prompt": 3}, {"prompt": 4}]
+    assert sink.records == [{"prompt": idx} for idx in range(5)]
+    assert len(LMHistoryBuffer(maxlen=0, sink=sink)) == 0
+
+
+def test_buffer_supports_slicing():
+    history = LMHistoryBuffer(maxlen=3)
+    for idx in range(5):
+        history.append(idx)
+
+    # dspy reads the last calls with negative slices
+    assert history[-2:] == [3, 4]
+    assert history[::-1] == [4, 3, 2]
+    assert history[0] == 2
+
+
+def test_buffer_copies_share_the_sink():
+    sink = ListSink()
+    history = LMHistoryBuffer(maxlen=2, sink=sink)
+    history.append({"prompt": [1]})
+
+    copied = copy.deepcopy(history)
+    assert copied.sink is sink
+    assert copied.maxlen == 2
+    copied[0]["prompt"].append(2)
+    assert history[0] == {"prompt": [1]}
+
+    restored = pickle.loads(pickle.dumps(history))
+    assert list(restored) == [{"prompt": [1]}]
+    assert restored.maxlen == 2
+    # the sink holds an open file and is not pickled
+    assert restored.sink is None
+
+
+def test_sink_redacts_fields(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    with JSONLHistorySink(
+        path,
+        redact_fields=("prompt",),
+        redact=lambda record: None if record["response"] == "drop" else record,
+    ) as sink:
+        sink.write({"prompt": "secret", "response": "ok", "nested": {"prompt": "x"}})
+        sink.write({"prompt": "secret", "response": "drop"})
+
+    assert list(read_lm_history(path)) == [
+        {"prompt": "[REDACTED]", "response": "ok", "nested": {"prompt": "[REDACTED]"}}
+    ]
+
+
+def test_sink_samples_calls(tmp_path):
+    path = str(tmp_path / "history.jsonl")
+    with JSONLHistorySink(path, sample_rate=0.5, seed=0) as sink:
+        for idx in range(200):
+            sink.write({"idx": idx})
+
+    records = list(read_lm_history(path))
+    assert 60 < len(records) < 140
+    assert [record["idx"] for record in records] == sorted(
+        record["idx"] for record in records
+    )
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".jsonl.gz", ".jsonl.zst"])
+def test_read_history_of_unclosed_sink(tmp_path, suffix):
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    path = str(tmp_path / f"history{suffix}")
+    sink = JSONLHistorySink(path)
+    for idx in range(100):
+        sink.write({"idx": idx, "response": "x" * idx})
+
+    # the sink is not closed, as after a crash; small chunks exercise records split across chunks
+    records = list(read_lm_history(path, chunk_size=64))
+
+    assert [record["idx"] for record in records] == list(range(100))
+    sink.close()
+
+
+def test_read_history_skips_incomplete_last_line(tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"idx": 0}\n{"idx": 1}\n{"idx"')
+
+    assert list(read_lm_history(str(path))) == [{"idx": 0}, {"idx": 1}]
+
+
+def test_lm_configs_stream_history_to_sink():
+    class FakeLMConfigs(LMConfigs):
+        def __init__(self):
+            self.question_lm = SimpleNamespace(history=[{"prompt": 0}])
+            self.answer_lm = self.question_lm
+
+    sink = ListSink()
+    lm_configs = FakeLMConfigs()
+    lm_configs.set_history_sink(sink, max_history_per_lm=1)
+    for idx in range(1, 3):
+        lm_configs.question_lm.history.append({"prompt": idx})
+
+    assert lm_configs.answer_lm.history is lm_configs.question_lm.history
+    # calls made before the sink was set are written too
+    assert sink.records == [{"prompt": idx} for idx in range(3)]
+    assert lm_configs.collect_and_reset_lm_history() == [{"prompt": 2}]
@@ -0,0 +1,99 @@
+import pytest
+
+from knowledge_storm.lm_pool import LMEndpointPool
+
+
+class FakeReplica:
+    def __init__(self, name, error=None):
+        self.kwargs = {"model": "fake"}
+        self.api_base = name
+        self.error = error
+        self.num_calls = 0
+        self.history = []
+
+    def __call__(self, prompt, **kwargs):
+        self.num_calls += 1
+        if self.error is not None:
+            raise self.error
+        return [f"{self.api_base}: {prompt}"]
+
+    def get_usage_and_reset(self):
+        usage = {"fake": {"prompt_tokens": self.num_calls, "completion_tokens": 0}}
+        self.num_calls = 0
+        return usage
+
+
+def test_failed_call_is_retried_on_another_replica():
+    failing = FakeReplica("a", error=ConnectionError("down"))
+    healthy = FakeReplica("b")
+    pool = LMEndpointPool([failing, healthy], max_attempts=2)
+    pool._random.seed(0)
+
+    for _ in range(5):
+        assert pool("prompt") == ["b: prompt"]
+    assert healthy.num_calls == 5
+
+
+def test_replica_is_ejected_after_consecutive_failures():
+    failing = FakeReplica("a", error=ConnectionError("down"))
+    healthy = FakeReplica("b")
+    pool = LMEndpointPool([failing, healthy], max_consecutive_failures=2)
+
+    while failing.num_calls < 2:
+        pool("prompt")
+    assert [stats["admitted"] for stats in pool.get_replica_stats()] == [False, True]
+
+    for _ in range(5):
+        pool("prompt")
+    assert failing.num_calls == 2
+
+
+def test_error_is_raised_when_every_attempt_fails():
+    pool = LMEndpointPool(
+        [
+            FakeReplica("a", error=ConnectionError("a is down")),
+            FakeReplica("b", error=ConnectionError("b is down")),
+        ],
+        max_attempts=2,
+    )
+    with pytest.raises(ConnectionError):
+        pool("prompt")
+
+
+def test_max_attempts_must_be_positive():
+    with pytest.raises(ValueError):
+        LMEndpointPool([FakeReplica("a")], max_attempts=0)
+    with pytest.raises(ValueError):
+        LMEndpointPool([])
+
+
+def test_health_checks_are_opt_in():
+    pool = LMEndpointPool([FakeReplica("a")])
+    assert pool._health_check_thread is None
+
+
+def test_health_check_ejects_and_readmits_replicas():
+    replicas = [FakeReplica("a"), FakeReplica("b")]
+    healthy = {"a": True, "b": False}
+    pool = LMEndpointPool(
+        replicas,
+        health_check=lambda lm: healthy[lm.api_base],
+        health_check_interval=0,
+    )
+
+    pool.check_health()
+    assert [stats["admitted"] for stats in pool.get_replica_stats()] == [True, False]
+
+    healthy["b"] = True
+    pool.check_health()
+    assert [stats["admitted"] for stats in pool.get_replica_stats()] == [True, True]
+
+
+def test_usage_is_summed_over_replicas():
+    replicas = [FakeReplica("a"), FakeReplica("b")]
+    pool = LMEndpointPool(replicas)
+    for _ in range(4):
+        pool("prompt")
+    assert pool.get_usage_and_reset() == {
+        "fake": {"prompt_tokens": 4, "completion_tokens": 0}
+    }
@@ -0,0 +1,119 @@
+import pytest
+
+from knowledge_storm.logging_wrapper import LoggingWrapper
+
+
+class FakeLMConfig:
+    def __init__(self, lm_usage):
+        self.lm_usage = lm_usage
+
+    def collect_and_reset_lm_usage(self):
+        lm_usage, self.lm_usage = self.lm_usage, {}
+        return lm_usage
+
+    def collect_and_reset_lm_history(self):
+        return []
+
+
+def _get_stage_span(logging_wrapper, pipeline_stage):
+    return next(
+        span
+        for span in logging_wrapper.get_trace()
+        if span["name"] == pipeline_stage and span["parent_id"] is None
+    )
+
+
+def test_stage_span_sums_usage_per_model():
+    usage = {
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "coalesced_requests": 1,
+        "hedged_requests": 2,
+    }
+    logging_wrapper = LoggingWrapper(FakeLMConfig({"model-a": usage}))
+    with logging_wrapper.log_pipeline_stage("stage"):
+        pass
+
+    attributes = _get_stage_span(logging_wrapper, "stage")["attributes"]
+    assert attributes["models"] == ["model-a"]
+    assert attributes["prompt_tokens"] == 10
+    assert attributes["completion_tokens"] == 5
+    assert attributes["coalesced_requests"] == 1
+    assert attributes["hedged_requests"] == 2
+
+
+def test_stage_span_sums_co_storm_usage_per_lm_and_model():
+    logging_wrapper = LoggingWrapper(
+        FakeLMConfig(
+            {
+                "question_answering_lm": {
+                    "model-a": {"prompt_tokens": 10, "completion_tokens": 5},
+                },
+                "discourse_manage_lm": {
+                    "model-a": {"prompt_tokens": 1, "completion_tokens": 1},
+                    "model-b": {
+                        "prompt_tokens": 2,
+                        "completion_tokens": 3,
+                        "hedged_requests": 1,
+                    },
+                },
+            }
+        )
+    )
+    with logging_wrapper.log_pipeline_stage("stage"):
+        pass
+
+    attributes = _get_stage_span(logging_wrapper, "stage")["attributes"]
+    assert attributes["models"] == ["model-a", "model-b"]
+    assert attributes["prompt_tokens"] == 13
+    assert attributes["completion_tokens"] == 9
+    assert attributes["hedged_requests"] == 1
+
+
+def test_error_in_stage_is_recorded_and_raised():
+    logging_wrapper = LoggingWrapper(FakeLMConfig({}))
+    with pytest.raises(ValueError):
+        with logging_wrapper.log_pipeline_stage("stage"):
+            with logging_wrapper.log_event("event"):
+                raise ValueError("failed")
+
+    trace = logging_wrapper.get_trace()
+    assert _get_stage_span(logging_wrapper, "stage")["error"] == "ValueError: failed"
+    assert [span["error"] for span in trace if span["name"] == "event"] == [
+        "ValueError: failed"
+    ]
+    assert not logging_wrapper.pipeline_stage_active
+    assert "stage" in logging_wrapper.dump_logging_and_reset()
+
+
+def test_wrapper_without_lm_config_does_not_collect_usage():
+    logging_wrapper = LoggingWrapper(lm_config=None)
+    with logging_wrapper.log_pipeline_stage("stage"):
+        pass
+    assert logging_wrapper.dump_logging_and_reset()["stage"]["lm_usage"] == {}
+
+
+def test_spans_are_bounded():
+    logging_wrapper = LoggingWrapper(FakeLMConfig({}), max_spans=3)
+    with logging_wrapper.log_pipeline_stage("stage"):
+        for i in range(5):
+            with logging_wrapper.log_event(f"event {i}"):
+                pass
+
+    assert [span["name"] for span in logging_wrapper.get_trace()] == [
+        "stage",
+        "event 3",
+        "event 4",
+    ]
+
+
+def test_merge_moves_spans():
+    logging_wrapper = LoggingWrapper(FakeLMConfig({}))
+    other = LoggingWrapper(lm_config=None)
+    with other.log_pipeline_stage("other stage"):
+        pass
+
+    logging_wrapper.merge_logging_and_reset(other)
+
+    assert [span["name"] for span in logging_wrapper.get_trace()] == ["other stage"]
+    assert other.get_trace() == []
@@ -0,0 +1,76 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from knowledge_storm import prompt_budget
+from knowledge_storm.prompt_budget import (
+    PromptPacker,
+    count_tokens,
+    get_model_context_window,
+)
+
+
+@pytest.fixture(autouse=True)
+def without_tiktoken(monkeypatch):
+    """Counts tokens with the fallback estimate, so that budgets do not depend on the installed tokenizer."""
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    monkeypatch.setattr(prompt_budget, "_tiktoken_encodings", {})
+
+
+def test_fallback_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("abcdefgh") == 2
+    assert count_tokens("abcde") == 2
+    # one token per non-ASCII character
+    assert count_tokens("知识风暴") == 4
+    assert count_tokens("ab知识") == 3
+    assert prompt_budget._tiktoken_encodings == {None: None}
+
+
+def test_tiktoken_encoding_is_used(monkeypatch):
+    encoding = SimpleNamespace(encode=lambda text, disallowed_special: text.split())
+    monkeypatch.setattr(prompt_budget, "_tiktoken_encodings", {"gpt-4o": encoding})
+
+    assert count_tokens("three word text", model="gpt-4o") == 3
+
+
+def test_truncate_keeps_whole_lines_then_words():
+    packer = PromptPacker(max_tokens=6)
+
+    assert packer.truncate("  short  ") == "short"
+    # the first line takes 3 tokens, then the words of the second line that fit with their separators
+    assert packer.truncate("aaaa bbbb\ncccc dddd\neeee ffff") == "aaaa bbbb\ncccc"
+    assert packer.truncate("a" * 40) == ""
+
+
+def test_select_follows_priorities_until_a_segment_does_not_fit():
+    packer = PromptPacker(max_tokens=5)
+    segments = ["aaaa", "bbbbbbbb", "cccc", "dddd"]
+
+    # 1 token per 4 characters and 1 per separator
+    assert packer.select(segments) == [0, 1]
+    assert packer.select(segments, priorities=[2, 3, 0, 1]) == [2, 3, 0]
+    # stops at the first segment that does not fit instead of skipping to a shorter one
+    assert PromptPacker(max_tokens=3).select(segments) == [0]
+
+
+def test_pack_joins_selected_segments_in_input_order():
+    packer = PromptPacker(max_tokens=4, separator=" | ")
+    segments = ["aaaa", "bbbb", "cccc"]
+
+    # " | " is one token
+    assert packer.pack(segments, priorities=[2, 1, 0]) == "bbbb | cccc"
+    assert packer.count(packer.pack(segments, priorities=[2, 1, 0])) <= 4
+    assert PromptPacker(max_tokens=0).pack(segments) == ""
+
+
+def test_budget_is_capped_by_context_window():
+    lm = SimpleNamespace(kwargs={"model": "gpt-4-0613", "max_tokens": 1000})
+
+    assert get_model_context_window("openai/gpt-4o-mini") == 128000
+    assert get_model_context_window("unknown") is None
+    assert PromptPacker.for_lm(lm, max_tokens=100000).max_tokens == 8192 - 2000
+    assert PromptPacker.for_lm(lm, max_tokens=500).max_tokens == 500
+    unknown_lm = SimpleNamespace(kwargs={"model": "unknown"})
+    assert PromptPacker.for_lm(unknown_lm, max_tokens=100000).max_tokens == 100000
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import dspy
+
+from knowledge_storm import interface
+from knowledge_storm.collaborative_storm.engine import RunnerArgument
+from knowledge_storm.collaborative_storm.modules.collaborative_storm_utils import (
+    _get_answer_question_module_instance,
+)
+from knowledge_storm.interface import Retriever
+from knowledge_storm.logging_wrapper import LoggingWrapper
+
+
+class SlowRM(dspy.Retrieve):
+    """Answers each query with one result; queries in `blocked` wait for `release`."""
+
+    def __init__(self, blocked=()):
+        super().__init__(k=1)
+        self.blocked = set(blocked)
+        self.release = threading.Event()
+
+    def forward(self, query_or_queries, exclude_urls=[]):
+        query = query_or_queries[0]
+        if query in self.blocked:
+            self.release.wait(5)
+        return [
+            {
+                "url": f"https://{query}.com",
+                "description": query,
+                "snippets": [query],
+                "title": query,
+            }
+        ]
+
+
+def _urls(results):
+    return sorted(info.url for info in results)
+
+
+def test_quorum_returns_without_stragglers():
+    rm = SlowRM(blocked=["c"])
+    retriever = Retriever(rm, max_thread=3, min_query_fraction=0.5)
+
+    results = retriever.retrieve(["a", "b", "c"])
+    rm.release.set()
+
+    assert _urls(results) == ["https://a.com", "https://b.com"]
+    usage = retriever.collect_and_reset_rm_usage()
+    assert usage["partial_retrievals"] == 1
+    assert usage["straggler_queries"] == 1
+
+
+def test_queries_done_before_quorum_break_are_kept(monkeypatch):
+    original = interface.as_completed_within_deadline
+
+    def delayed_as_completed(futures, *args, **kwargs):
+        # let the unblocked queries finish before the first result is handled
+        time.sleep(0.2)
+        yield from original(futures, *args, **kwargs)
+
+    monkeypatch.setattr(interface, "as_completed_within_deadline", delayed_as_completed)
+    rm = SlowRM(blocked=["c"])
+    retriever = Retriever(rm, max_thread=3, min_query_fraction=0.1)
+
+    results = retriever.retrieve(["a", "b", "c"])
+    rm.release.set()
+
+    assert _urls(results) == ["https://a.com", "https://b.com"]
+    assert retriever.collect_and_reset_rm_usage()["straggler_queries"] == 1
+
+
+def test_timeout_drops_stragglers():
+    rm = SlowRM(blocked=["b"])
+    retriever = Retriever(rm, max_thread=2, timeout=0.2, keep_late_results=True)
+
+    # without a late results key, stragglers are dropped even with keep_late_results
+    results = retriever.retrieve(["a", "b"])
+    rm.release.set()
+
+    assert _urls(results) == ["https://a.com"]
+    assert retriever._late_results == {}
+
+
+def _wait_for_late_results(retriever, late_results_key):
+    late_results = []
+    for _ in range(50):
+        late_results.extend(retriever.pop_late_results(late_results_key))
+        if late_results:
+            break
+        time.sleep(0.05)
+    return late_results
+
+
+def test_late_results_are_kept_per_caller():
+    rm = SlowRM(blocked=["a2", "b2"])
+    retriever = Retriever(
+        rm, max_thread=4, min_query_fraction=0.5, keep_late_results=True
+    )
+    results = {}
+
+    def caller(name):
+        results[name] = retriever.retrieve(
+            [f"{name}1", f"{name}2"], late_results_key=name
+        )
+
+    threads = [threading.Thread(target=caller, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _urls(results["a"]) == ["https://a1.com"]
+    assert _urls(results["b"]) == ["https://b1.com"]
+
+    rm.release.set()
+    late_results = _wait_for_late_results(retriever, "b")
+    assert _urls(late_results) == ["https://b2.com"]
+    assert late_results[0].meta == {"query": "b2"}
+    assert retriever.pop_late_results("b") == []
+    assert _urls(_wait_for_late_results(retriever, "a")) == ["https://a2.com"]
+    assert retriever.collect_and_reset_rm_usage()["late_queries"] == 2
+
+
+def test_closed_caller_drops_late_results():
+    rm = SlowRM(blocked=["b"])
+    retriever = Retriever(
+        rm, max_thread=2, min_query_fraction=0.5, keep_late_results=True
+    )
+
+    retriever.retrieve(["a", "b"], late_results_key="conversation")
+    assert retriever.pop_late_results("conversation", close=True) == []
+    rm.release.set()
+    time.sleep(0.2)
+
+    assert retriever._late_results == {}
+    assert "late_queries" not in retriever.collect_and_reset_rm_usage()
+
+
+def test_runner_argument_configures_retriever(make_lm_config):
+    module = _get_answer_question_module_instance(
+        lm_config=make_lm_config(),
+        runner_argument=RunnerArgument(topic="topic", retrieve_min_query_fraction=0.5),
+        logging_wrapper=LoggingWrapper(lm_config=None),
+        rm=SlowRM(),
+    )
+
+    assert module.retriever.min_query_fraction == 0.5
@@ -0,0 +1,103 @@
+import concurrent.futures
+import time
+
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import RunnerArgument
+from knowledge_storm.collaborative_storm.session_manager import CoStormSessionManager
+from knowledge_storm.collaborative_storm.warmstart_store import WarmStartSnapshotStore
+from knowledge_storm.dataclass import ConversationTurn
+
+
+@pytest.fixture
+def make_session_manager(tmp_path, make_lm_config, make_rm):
+    def make(**kwargs):
+        return CoStormSessionManager(
+            lm_config=make_lm_config(),
+            spill_dir=str(tmp_path / "spill"),
+            rm=make_rm(),
+            **kwargs,
+        )
+
+    return make
+
+
+def _populate(costorm_runner, information):
+    costorm_runner.knowledge_base.insert_information(
+        "a -> b",
+        information,
+        missing_node_handling="create",
+    )
+    costorm_runner.conversation_history.append(
+        ConversationTurn(
+            role="Expert: an expert",
+            raw_utterance="utterance [1]",
+            utterance_type="Potential Answer",
+        )
+    )
+    costorm_runner.discourse_manager.next_turn_moderator_override = True
+
+
+def test_spill_and_rehydrate_round_trip(
+    tmp_path, make_session_manager, make_information, restored_runner_dict
+):
+    warm_start_store = WarmStartSnapshotStore(str(tmp_path / "warm_start"))
+    session_manager = make_session_manager(warm_start_store=warm_start_store)
+    costorm_runner = session_manager.create_session(
+        "session", RunnerArgument(topic="topic")
+    )
+    _populate(costorm_runner, make_information(1))
+    expected = restored_runner_dict(costorm_runner)
+
+    session_manager.spill("session")
+    assert session_manager.list_active_sessions() == []
+
+    with session_manager.session("session") as rehydrated:
+        assert rehydrated is not costorm_runner
+        assert rehydrated.to_dict() == expected
+        assert rehydrated.discourse_manager.next_turn_moderator_override is True
+        assert rehydrated.warm_start_store is warm_start_store
+    assert session_manager.list_active_sessions() == ["session"]
+
+
+def test_spill_waits_for_background_reorganize(make_session_manager, make_information):
+    session_manager = make_session_manager()
+    costorm_runner = session_manager.create_session(
+        "session", RunnerArgument(topic="topic", background_reorganize=True)
+    )
+    _populate(costorm_runner, make_information(1))
+    snapshot = costorm_runner.knowledge_base.get_reorganize_snapshot()
+
+    def reorganize():
+        time.sleep(0.2)
+        snapshot.insert_node("reorganized")
+
+    costorm_runner._reorganize_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1
+    )
+    costorm_runner._reorganize_snapshot = snapshot
+    costorm_runner._reorganize_future = costorm_runner._reorganize_executor.submit(
+        reorganize
+    )
+
+    session_manager.spill("session")
+
+    assert costorm_runner._reorganize_future is None
+    assert costorm_runner._reorganize_executor is None
+    with session_manager.session("session") as rehydrated:
+        assert rehydrated.knowledge_base.find_node(
+            rehydrated.knowledge_base.root, "reorganized"
+        )
+
+
+def test_sessions_over_budget_are_spilled(make_session_manager):
+    session_manager = make_session_manager(max_active_sessions=1)
+    for session_id in ["first", "second"]:
+        session_manager.create_session(session_id, RunnerArgument(topic=session_id))
+    with session_manager.session("second"):
+        pass
+    assert session_manager.list_active_sessions() == ["second"]
+
+    with session_manager.session("first") as costorm_runner:
+        assert costorm_runner.runner_argument.topic == "first"
+    assert session_manager.list_active_sessions() == ["first"]
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import CollaborativeStormLMConfigs
+from knowledge_storm.deadline import DeadlineExceeded, deadline_scope
+from knowledge_storm.singleflight import (
+    SingleFlight,
+    coalesce_lm_call,
+    get_coalesced_count_and_reset,
+)
+
+
+def _run_concurrently(func, num_threads):
+    results = [None] * num_threads
+    errors = [None] * num_threads
+
+    def run(idx):
+        try:
+            results[idx] = func()
+        except Exception as e:
+            errors[idx] = e
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+class SlowCall:
+    def __init__(self, result=None, error=None, delay=0.2):
+        self.result = result
+        self.error = error
+        self.delay = delay
+        self.num_calls = 0
+
+    def __call__(self):
+        self.num_calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_share_one_call_and_get_copies():
+    group = SingleFlight()
+    call = SlowCall(result=["result"])
+
+    results, errors = _run_concurrently(lambda: group.do("key", call), 4)
+
+    assert call.num_calls == 1
+    assert errors == [None] * 4
+    assert all(result == ["result"] for result in results)
+    assert len({id(result) for result in results}) == 4
+    assert group.get_coalesced_count_and_reset() == 3
+    assert group.get_coalesced_count_and_reset() == 0
+
+
+def test_exception_is_shared_and_key_is_released():
+    group = SingleFlight()
+    call = SlowCall(error=ValueError("upstream failed"))
+
+    _, errors = _run_concurrently(lambda: group.do("key", call), 3)
+
+    assert call.num_calls == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    # a failed call is not cached
+    assert group.do("key", lambda: "retried") == "retried"
+
+
+def test_waiter_stops_at_its_deadline():
+    group = SingleFlight()
+    call = SlowCall(result="result", delay=0.5)
+    leader = threading.Thread(target=group.do, args=("key", call))
+    leader.start()
+    time.sleep(0.05)
+
+    with deadline_scope(0.05):
+        with pytest.raises(DeadlineExceeded):
+            group.do("key", call)
+    leader.join()
+    assert call.num_calls == 1
+
+
+class FakeLM:
+    kwargs = {"model": "fake"}
+
+    def __init__(self):
+        self.prompt_tokens = 0
+
+    @coalesce_lm_call
+    def __call__(self, prompt, **kwargs):
+        time.sleep(0.2)
+        self.prompt_tokens += 10
+        return [f"completion of {prompt}"]
+
+    def get_usage_and_reset(self):
+        usage = {"fake": {"prompt_tokens": self.prompt_tokens, "completion_tokens": 0}}
+        self.prompt_tokens = 0
+        return usage
+
+
+def test_co_storm_usage_reports_coalesced_requests():
+    lm_config = CollaborativeStormLMConfigs()
+    lm_config.question_answering_lm = FakeLM()
+
+    _run_concurrently(lambda: lm_config.question_answering_lm("prompt"), 3)
+
+    assert lm_config.collect_and_reset_lm_usage() == {
+        "question_answering_lm": {
+            "fake": {
+                "prompt_tokens": 10,
+                "completion_tokens": 0,
+                "coalesced_requests": 2,
+            }
+        }
+    }
+    assert get_coalesced_count_and_reset(lm_config.question_answering_lm) == 0
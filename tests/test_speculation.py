@@ -0,0 +1,95 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import TurnPolicySpec
+from knowledge_storm.dataclass import ConversationTurn
+
+
+@pytest.fixture
+def costorm_runner(make_runner):
+    costorm_runner = make_runner(speculative_next_turn=True)
+    costorm_runner.conversation_history.append(
+        ConversationTurn(
+            role="Guest", raw_utterance="question?", utterance_type="Original Question"
+        )
+    )
+    yield costorm_runner
+    costorm_runner.close()
+
+
+def _set_speculative_generate_utterance(costorm_runner, generate_utterance):
+    # the turn after a question is answered by the general knowledge provider
+    agent = costorm_runner.speculative_discourse_manager.general_knowledge_provider
+    agent.generate_utterance = generate_utterance
+
+
+def test_failed_speculation_is_discarded(costorm_runner):
+    def generate_utterance(knowledge_base, conversation_history):
+        raise RuntimeError("LM unavailable")
+
+    _set_speculative_generate_utterance(costorm_runner, generate_utterance)
+    costorm_runner._start_speculation()
+    speculation = costorm_runner._wait_for_speculation()
+
+    assert speculation.future.result() is None
+    assert not costorm_runner._is_speculation_valid(
+        speculation, TurnPolicySpec(agent=speculation.agent)
+    )
+
+
+def test_speculation_leaves_lm_usage_to_the_runner(costorm_runner):
+    lm = costorm_runner.lm_config.question_answering_lm
+
+    def generate_utterance(knowledge_base, conversation_history):
+        lm.prompt_tokens += 10
+        return ConversationTurn(
+            role="General Knowledge Provider",
+            raw_utterance="answer",
+            utterance_type="Potential Answer",
+        )
+
+    _set_speculative_generate_utterance(costorm_runner, generate_utterance)
+    costorm_runner._start_speculation()
+    costorm_runner._wait_for_speculation()
+    with costorm_runner.logging_wrapper.log_pipeline_stage("stage"):
+        pass
+
+    logs = costorm_runner.dump_logging_and_reset()
+    assert logs["conv turn: 2 speculative stage"]["lm_usage"] == {}
+    assert logs["stage"]["lm_usage"]["question_answering_lm"]["fake"] == {
+        "prompt_tokens": 10,
+        "completion_tokens": 0,
+    }
+
+
+def test_user_utterance_cancels_pending_speculation(costorm_runner):
+    release = threading.Event()
+    costorm_runner._speculation_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1
+    )
+    # occupy the speculation worker so that the next speculative turn stays pending
+    costorm_runner._speculation_executor.submit(release.wait)
+    _set_speculative_generate_utterance(
+        costorm_runner,
+        lambda knowledge_base, conversation_history: ConversationTurn(
+            role="General Knowledge Provider",
+            raw_utterance="answer",
+            utterance_type="Potential Answer",
+        ),
+    )
+    costorm_runner._start_speculation()
+    pending_speculation = costorm_runner._speculation
+
+    costorm_runner.step(user_utterance="another question?")
+
+    assert pending_speculation.future.cancelled()
+    assert costorm_runner._speculation is not pending_speculation
+    assert (
+        costorm_runner._speculation.conversation_history
+        == costorm_runner.conversation_history
+    )
+    release.set()
+    speculation = costorm_runner._wait_for_speculation()
+    assert speculation.future.result().raw_utterance == "answer"
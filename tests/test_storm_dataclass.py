@@ -0,0 +1,139 @@
+import numpy as np
+
+from knowledge_storm.interface import Information
+from knowledge_storm.storm_wiki.modules.storm_dataclass import (
+    DialogueTurn,
+    StormInformationTable,
+    StormSnippetStore,
+)
+from knowledge_storm.utils import FileIOHelper
+
+
+class KeywordEncoder:
+    """Embeds text by keyword counts, so that similarity is predictable."""
+
+    keywords = ["apple", "banana", "cherry"]
+
+    def encode(self, texts, show_progress_bar=False):
+        if isinstance(texts, str):
+            return self._encode(texts)
+        return np.array([self._encode(text) for text in texts])
+
+    def _encode(self, text):
+        return np.array([text.count(k) for k in self.keywords], dtype=float) + 1e-3
+
+
+def _make_conversations():
+    turn_1 = DialogueTurn(
+        agent_utterance="a",
+        user_utterance="q",
+        search_queries=["q"],
+        search_results=[
+            Information(
+                url="u1", description="d1", snippets=["apple", "banana"], title="t1"
+            ),
+            Information(url="u2", description="d2", snippets=["cherry"], title="t2"),
+        ],
+    )
+    turn_2 = DialogueTurn(
+        agent_utterance="a",
+        user_utterance="q",
+        search_queries=["q"],
+        search_results=[
+            Information(
+                url="u1", description="d1", snippets=["banana", "apple pie"], title="t1"
+            ),
+        ],
+    )
+    return [("persona 1", [turn_1]), ("persona 2", [turn_2])]
+
+
+def test_snippet_store_deduplicates_rows_and_texts():
+    store = StormSnippetStore()
+    store.add("u1", ["a", "b", "a"])
+    store.add("u2", ["b"])
+    store.add("u1", ["b", "c"])
+
+    assert len(store) == 4
+    assert store.texts == ["a", "b", "c"]
+    assert store.get_snippets("u1") == ["a", "b", "c"]
+    assert store.get_snippets("u2") == ["b"]
+    assert store.get_snippets("missing") == []
+
+
+def test_url_to_info_merges_snippets_like_before():
+    conversations = _make_conversations()
+    table = StormInformationTable(conversations)
+
+    assert set(table.url_to_info) == {"u1", "u2"}
+    # the snippets of a url are the set union of all its search results, in first-seen order
+    assert table.url_to_info["u1"].snippets == ["apple", "banana", "apple pie"]
+    assert table.url_to_info["u2"].snippets == ["cherry"]
+    # the search results in the conversations are not modified
+    assert conversations[0][1][0].search_results[0].snippets == ["apple", "banana"]
+
+
+def test_retrieve_information_returns_closest_snippets():
+    table = StormInformationTable(_make_conversations())
+    table.prepare_table_for_retrieval(encoder=KeywordEncoder())
+
+    results = table.retrieve_information("cherry", search_top_k=1)
+
+    assert [info.url for info in results] == ["u2"]
+    assert results[0].snippets == ["cherry"]
+
+
+def test_snippet_store_save_and_load(tmp_path):
+    store = StormSnippetStore()
+    store.add("u1", ["a", "b", "ünïcode"])
+    store.add("u2", ["b"])
+    path = str(tmp_path / "snippet_store.npz")
+
+    store.save(path)
+    loaded = StormSnippetStore.load(path)
+
+    assert loaded.urls == store.urls
+    assert loaded.texts == store.texts
+    assert np.array_equal(loaded.url_ids, store.url_ids)
+    assert np.array_equal(loaded.snippet_ids, store.snippet_ids)
+    assert loaded.get_snippets("u1") == ["a", "b", "ünïcode"]
+    # the loaded store keeps deduplicating
+    loaded.add("u2", ["b", "c"])
+    assert loaded.get_snippets("u2") == ["b", "c"]
+
+
+def test_information_table_loads_dumped_snippet_store(tmp_path):
+    table = StormInformationTable(_make_conversations())
+    log_path = str(tmp_path / "conversation_log.json")
+    store_path = str(tmp_path / "snippet_store.npz")
+    FileIOHelper.dump_json(
+        StormInformationTable.construct_log_dict(table.conversations), log_path
+    )
+    table.dump_snippet_store(store_path)
+
+    loaded = StormInformationTable.from_conversation_log_file(
+        log_path, snippet_store_path=store_path
+    )
+
+    assert loaded.snippet_store.texts == table.snippet_store.texts
+    assert {url: info.snippets for url, info in loaded.url_to_info.items()} == {
+        url: info.snippets for url, info in table.url_to_info.items()
+    }
+
+
+def test_stale_snippet_store_is_rebuilt(tmp_path):
+    table = StormInformationTable(_make_conversations())
+    log_path = str(tmp_path / "conversation_log.json")
+    store_path = str(tmp_path / "snippet_store.npz")
+    FileIOHelper.dump_json(
+        StormInformationTable.construct_log_dict(table.conversations), log_path
+    )
+    stale_store = StormSnippetStore()
+    stale_store.add("other", ["x"])
+    stale_store.save(store_path)
+
+    loaded = StormInformationTable.from_conversation_log_file(
+        log_path, snippet_store_path=store_path
+    )
+
+    assert set(loaded.snippet_store.urls) == {"u1", "u2"}
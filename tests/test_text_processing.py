@@ -0,0 +1,119 @@
+import random
+import re
+
+from knowledge_storm.utils import ArticleTextProcessing
+
+
+def _reference_update_citation_index(s, citation_map):
+    """update_citation_index before citations were remapped in a single pass."""
+    for original_citation in citation_map:
+        s = s.replace(f"[{original_citation}]", f"__PLACEHOLDER_{original_citation}__")
+    for original_citation, unify_citation in citation_map.items():
+        s = s.replace(f"__PLACEHOLDER_{original_citation}__", f"[{unify_citation}]")
+    return s
+
+
+def _reference_clean_up_outline(outline, topic=""):
+    """clean_up_outline before the non-content sections were stripped with one pattern."""
+    output_lines = []
+    current_level = 0
+    for line in outline.split("\n"):
+        stripped_line = line.strip()
+        if topic != "" and f"# {topic.lower()}" in stripped_line.lower():
+            output_lines = []
+        if stripped_line.startswith("#"):
+            current_level = stripped_line.count("#")
+            output_lines.append(stripped_line)
+        elif stripped_line.startswith("-"):
+            subsection_header = (
+                "#" * (current_level + 1) + " " + stripped_line[1:].strip()
+            )
+            output_lines.append(subsection_header)
+    outline = "\n".join(output_lines)
+    for section_name in [
+        "See also",
+        "See Also",
+        "Notes",
+        "References",
+        "External links",
+        "External Links",
+        "Bibliography",
+        "Summary",
+        "Appendices",
+        "Appendix",
+    ]:
+        outline = re.sub(
+            rf"#[#]? {section_name}.*?(?=##|$)", "", outline, flags=re.DOTALL
+        )
+    outline = re.sub(r"\[.*?\]", "", outline)
+    return outline
+
+
+def _make_text(rng, num_citations):
+    words = []
+    for _ in range(300):
+        words.append(rng.choice(["alpha", "beta", "gamma", "delta."]))
+        if rng.random() < 0.3:
+            words.append(f"[{rng.randint(1, num_citations)}]")
+    return " ".join(words)
+
+
+def test_update_citation_index_matches_reference():
+    rng = random.Random(0)
+    for _ in range(20):
+        text = _make_text(rng, num_citations=30)
+        # a partial map that swaps some citations and merges others
+        citation_map = {
+            original: rng.randint(1, 30)
+            for original in rng.sample(range(1, 31), k=rng.randint(0, 30))
+        }
+        assert ArticleTextProcessing.update_citation_index(
+            text, citation_map
+        ) == _reference_update_citation_index(text, citation_map)
+
+
+def test_update_citation_index_swaps_citations():
+    assert (
+        ArticleTextProcessing.update_citation_index("a [1] b [2] c [12]", {1: 2, 2: 1})
+        == "a [2] b [1] c [12]"
+    )
+
+
+def test_clean_up_outline_matches_reference():
+    rng = random.Random(0)
+    section_names = [
+        "History",
+        "See also",
+        "See Also",
+        "Notes",
+        "References",
+        "External links",
+        "External Links",
+        "Bibliography",
+        "Summary",
+        "Appendices",
+        "Appendix",
+        "Applications",
+    ]
+    for _ in range(20):
+        lines = ["# Topic"]
+        for section_idx in range(rng.randint(1, 10)):
+            lines.append(
+                f"{'#' * rng.randint(2, 3)} {rng.choice(section_names)} [{section_idx}]"
+            )
+            for subsection_idx in range(rng.randint(0, 3)):
+                lines.append(f"  - Subsection {section_idx}.{subsection_idx}")
+            lines.append("Some text that is not part of the outline.")
+        outline = "\n".join(lines)
+        for topic in ["", "topic"]:
+            assert ArticleTextProcessing.clean_up_outline(
+                outline, topic
+            ) == _reference_clean_up_outline(outline, topic)
+
+
+def test_clean_up_outline_removes_further_reading():
+    outline = "# Topic\n## History\n## Further reading\n## Legacy"
+    assert (
+        ArticleTextProcessing.clean_up_outline(outline)
+        == "# Topic\n## History\n## Legacy"
+    )
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from knowledge_storm.lm import VLLMClient
+
+
+@pytest.fixture
+def make_vllm_client(fake_server):
+    def make(**kwargs):
+        host, port = fake_server.url.rsplit(":", 1)
+        return VLLMClient(
+            model="mistral", port=int(port), url=host, max_tokens=50, **kwargs
+        )
+
+    return make
+
+
+def test_micro_batching_requires_opt_in(make_vllm_client):
+    with pytest.raises(ValueError):
+        make_vllm_client(micro_batch_window_ms=5)
+    with pytest.raises(ValueError):
+        make_vllm_client(
+            model_type="chat", raw_prompt_batching=True, micro_batch_window_ms=5
+        )
+
+
+def test_batches_use_chat_endpoint_by_default(make_vllm_client, fake_server):
+    lm = make_vllm_client(max_batch_size=4)
+
+    completions = lm.batch_generate(["a", "b", "c"])
+
+    assert len(completions) == 3
+    assert fake_server.get_stats() == {"chat_completions": {"requests": 3}}
+
+
+def test_raw_prompt_batches_use_completions_endpoint(make_vllm_client, fake_server):
+    lm = make_vllm_client(max_batch_size=2, raw_prompt_batching=True)
+
+    completions = lm.batch_generate(["a", "b", "c"])
+    lm("d")
+
+    assert len(completions) == 3
+    # single calls still go to the chat endpoint
+    assert fake_server.get_stats() == {
+        "completions": {"requests": 2},
+        "chat_completions": {"requests": 1},
+    }
+    assert lm.get_usage_and_reset()["mistral"]["prompt_tokens"] > 0
+
+
+def test_micro_batching_coalesces_concurrent_calls(make_vllm_client, fake_server):
+    lm = make_vllm_client(raw_prompt_batching=True, micro_batch_window_ms=200)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        completions = list(executor.map(lm, ["a", "b", "c"]))
+
+    assert [len(completion) for completion in completions] == [1, 1, 1]
+    assert fake_server.get_stats() == {"completions": {"requests": 1}}
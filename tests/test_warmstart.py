@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+
+import dspy
+import pytest
+
+from knowledge_storm.collaborative_storm.engine import RunnerArgument
+from knowledge_storm.collaborative_storm.modules.warmstart_hierarchical_chat import (
+    WarmStartModule,
+)
+from knowledge_storm.dataclass import ConversationTurn
+from knowledge_storm.logging_wrapper import LoggingWrapper
+
+
+class FakeWarmStartConversation:
+    """Simulates the research; the draft outline must be written while it runs."""
+
+    def __init__(self, draft_outline_started):
+        self.draft_outline_started = draft_outline_started
+        self.turns = [
+            ConversationTurn(
+                role=f"expert {idx}",
+                raw_utterance="utterance",
+                utterance_type="Original Question",
+            )
+            for idx in range(2)
+        ]
+
+    def __call__(self, topic, on_turn):
+        assert self.draft_outline_started.wait(5)
+        for turn in self.turns:
+            on_turn(turn)
+        return dspy.Prediction(conversation_history=self.turns, experts=["expert"])
+
+
+class FakeOutlineModule:
+    def __init__(self, fail_draft=False):
+        self.fail_draft = fail_draft
+        self.draft_outline_started = threading.Event()
+        self.draft_outline = None
+
+    def get_draft_outline(self, topic):
+        self.draft_outline_started.set()
+        if self.fail_draft:
+            raise RuntimeError("draft failed")
+        return "# draft"
+
+    def __call__(self, topic, conv, draft_outline):
+        self.draft_outline = draft_outline
+        return dspy.Prediction(outline="# outline", draft_outline=draft_outline)
+
+
+class FakeKnowledgeBase:
+    def __init__(self, fail_prefetch=False):
+        self.fail_prefetch = fail_prefetch
+        self.release_prefetch = threading.Event()
+        self.prefetched = []
+        self.inserted = []
+
+    def prefetch_conv_turn_embeddings(self, conv_turn):
+        if self.fail_prefetch:
+            raise RuntimeError("embedding failed")
+        self.release_prefetch.wait(5)
+        self.prefetched.append(conv_turn)
+
+    def insert_from_outline_string(self, outline_string):
+        self.outline = outline_string
+
+    def update_from_conv_turn(self, conv_turn, allow_create_new_node):
+        self.inserted.append(conv_turn)
+
+
+def _warm_start(module, knowledge_base):
+    with module.logging_wrapper.log_pipeline_stage("warm start stage"):
+        return module.initiate_warm_start("topic", knowledge_base)
+
+
+@pytest.fixture
+def make_warmstart_module(make_lm_config, make_rm):
+    def make(outline_module):
+        lm_config = make_lm_config()
+        module = WarmStartModule(
+            lm_config=lm_config,
+            runner_argument=RunnerArgument(topic="topic"),
+            logging_wrapper=LoggingWrapper(lm_config),
+            rm=make_rm(),
+        )
+        module.warmstart_outline_gen_module = outline_module
+        module.warmstart_conv = FakeWarmStartConversation(
+            outline_module.draft_outline_started
+        )
+        module.report_to_conversation = lambda knowledge_base, synthesize_sections: [
+            "conversation"
+        ]
+        return module
+
+    return make
+
+
+def test_insertion_does_not_wait_for_prefetches(make_warmstart_module):
+    outline_module = FakeOutlineModule()
+    module = make_warmstart_module(outline_module)
+    knowledge_base = FakeKnowledgeBase()
+
+    history, conversations, experts = _warm_start(module, knowledge_base)
+
+    # the prefetches are still blocked
+    assert knowledge_base.prefetched == []
+    assert outline_module.draft_outline == "# draft"
+    assert knowledge_base.outline == "# outline"
+    assert knowledge_base.inserted == history == module.warmstart_conv.turns
+    assert conversations == ["conversation"]
+    assert experts == ["expert"]
+
+    knowledge_base.release_prefetch.set()
+    for _ in range(50):
+        if len(knowledge_base.prefetched) == 2:
+            break
+        time.sleep(0.05)
+    assert knowledge_base.prefetched == history
+
+
+def test_failed_prefetches_are_logged(make_warmstart_module, caplog):
+    outline_module = FakeOutlineModule(fail_draft=True)
+    module = make_warmstart_module(outline_module)
+    knowledge_base = FakeKnowledgeBase(fail_prefetch=True)
+
+    with caplog.at_level(logging.WARNING):
+        _warm_start(module, knowledge_base)
+        for _ in range(50):
+            if len(caplog.records) == 2:
+                break
+            time.sleep(0.05)
+
+    # the outline is generated without the failed draft outline
+    assert outline_module.draft_outline is None
+    assert knowledge_base.inserted == module.warmstart_conv.turns
+    assert [record.getMessage() for record in caplog.records] == [
+        "Failed to prefetch warm start embeddings: embedding failed"
+    ] * 2
@@ -0,0 +1,83 @@
+import time
+
+import dspy
+
+from knowledge_storm.collaborative_storm.engine import RunnerArgument
+from knowledge_storm.collaborative_storm.warmstart_store import WarmStartSnapshotStore
+
+
+class OtherRM(dspy.Retrieve):
+    def forward(self, query_or_queries, exclude_urls=[]):
+        return []
+
+
+def test_key_ignores_topic_formatting_and_rm_instance(
+    tmp_path, make_lm_config, make_rm
+):
+    store = WarmStartSnapshotStore(str(tmp_path))
+    lm_config = make_lm_config()
+
+    assert store.get_key(
+        RunnerArgument(topic="Some  Topic"), lm_config, make_rm(k=5)
+    ) == store.get_key(RunnerArgument(topic="some topic "), lm_config, make_rm(k=5))
+
+
+def test_key_depends_on_warm_start_settings(tmp_path, make_lm_config, make_rm):
+    store = WarmStartSnapshotStore(str(tmp_path))
+    lm_config = make_lm_config()
+    key = store.get_key(RunnerArgument(topic="topic"), lm_config, make_rm())
+
+    for runner_argument in [
+        RunnerArgument(topic="topic", warmstart_max_thread=1),
+        RunnerArgument(topic="topic", retrieve_min_query_fraction=0.5),
+        RunnerArgument(topic="topic", retrieve_timeout=10),
+    ]:
+        assert store.get_key(runner_argument, lm_config, make_rm()) != key
+    for rm in [OtherRM(), make_rm(k=5)]:
+        assert store.get_key(RunnerArgument(topic="topic"), lm_config, rm) != key
+
+
+def test_save_and_load(tmp_path, make_lm_config, make_rm):
+    store = WarmStartSnapshotStore(str(tmp_path))
+    lm_config = make_lm_config()
+    runner_argument = RunnerArgument(topic="topic")
+    store.save(runner_argument, lm_config, {"experts": []}, rm=make_rm())
+
+    assert store.load(runner_argument, lm_config, rm=make_rm()) == {"experts": []}
+    assert store.load(runner_argument, lm_config, rm=OtherRM()) is None
+    assert WarmStartSnapshotStore(str(tmp_path)).load(
+        runner_argument, lm_config, rm=make_rm()
+    ) == {"experts": []}
+
+
+def test_memory_cache_keeps_recently_used_snapshots(tmp_path, make_lm_config):
+    store = WarmStartSnapshotStore(str(tmp_path), max_memory_entries=2)
+    lm_config = make_lm_config()
+    runner_arguments = [RunnerArgument(topic=f"topic {idx}") for idx in range(3)]
+    for idx, runner_argument in enumerate(runner_arguments[:2]):
+        store.save(runner_argument, lm_config, {"idx": idx})
+    store.load(runner_arguments[0], lm_config)
+    store.save(runner_arguments[2], lm_config, {"idx": 2})
+
+    assert list(store._memory_cache) == [
+        store.get_key(runner_arguments[0], lm_config),
+        store.get_key(runner_arguments[2], lm_config),
+    ]
+    # evicted snapshots are read from disk again
+    assert store.load(runner_arguments[1], lm_config) == {"idx": 1}
+    assert len(store._memory_cache) == 2
+
+
+def test_save_evicts_expired_snapshots_from_memory(
+    tmp_path, make_lm_config, monkeypatch
+):
+    store = WarmStartSnapshotStore(str(tmp_path), ttl_seconds=10)
+    lm_config = make_lm_config()
+    store.save(RunnerArgument(topic="old"), lm_config, {})
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+    store.save(RunnerArgument(topic="new"), lm_config, {})
+
+    assert list(store._memory_cache) == [
+        store.get_key(RunnerArgument(topic="new"), lm_config)
+    ]